@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.fakes import PAGE_FIXTURES, FixtureServer, FixtureFetcher, ambiguous_page_results
+from utils.cache import PageCache
+from utils.enrich import enrich_results
+
+def run(args):
+    server = FixtureServer(latency=args.latency)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = PageCache(os.path.join(directory, 'pages.sqlite'))
+        fetcher = FixtureFetcher(server.base_url, cache=cache, host_concurrency=args.host_concurrency)
+        try:
+            for label in ('cold', 'revalidate'):
+                before = dict(server.requests)
+                start = time.perf_counter()
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    for site, (listing_type, _, _) in PAGE_FIXTURES.items():
+                        enrich_results(ambiguous_page_results(site, args.listings), listing_type, fetcher=fetcher)
+                elapsed = time.perf_counter() - start
+                downloaded = server.requests['200'] - before['200']
+                not_modified = server.requests['304'] - before['304']
+                pages = args.listings * len(PAGE_FIXTURES)
+                print(f"{label:<11} {pages:5d} pages in {elapsed * 1000:8.1f} ms  "
+                      f"{pages / elapsed:8.0f} pages/s  {downloaded} downloaded, {not_modified} not modified")
+        finally:
+            fetcher.close()
+            cache.close()
+            server.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Listing page enrichment against a local fixture server")
+    parser.add_argument('--listings', type=int, default=50, help="listings per site")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds the fixture server takes per page")
+    parser.add_argument('--host-concurrency', type=int, default=2)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    from utils import clients
+    clients.disable_env_file()
+    logging.disable(logging.CRITICAL)
+    run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from email.utils import formatdate
+from urllib.parse import urlparse
+from utils.filter import AMBIGUOUS, extract_fields, listing_domain, TARGET_AREAS
+from utils.compact import count_tokens
+from utils.enrich import PageFetcher
+from utils.replay import completion_chunks
+
+STREETS = [
+    "Istedgade", "Vesterbrogade", "Enghavevej", "Østerbrogade", "Classensgade", "Nordre Frihavnsgade",
+    "Gammel Kongevej", "Falkoner Allé", "Nørrebrogade", "Jægersborggade", "Valby Langgade",
+    "Torvegade", "Strandgade", "Store Kongensgade", "Nansensgade",
+]
+
+FEATURES = [
+    "altan", "nyistandsat køkken", "vaskemaskine", "elevator", "gårdhave", "udsigt over søerne",
+    "trægulve", "højt til loftet", "kælderrum", "tæt på metro",
+]
+
+SOURCES = {
+    'andelsbolig': [
+        ("https://www.dba.dk/andelsbolig/andelslejlighed/id-{id}", "DBA"),
+        ("https://www.facebook.com/marketplace/item/{id}", "Facebook"),
+    ],
+    'lejebolig': [
+        ("https://www.boligportal.dk/lejligheder/k%C3%B8benhavn/{sqm}m2-{rooms}-vaer-id-{id}", "Boligportal"),
+        ("https://www.lejebolig.dk/lejebolig/{id}", "Lejebolig.dk"),
+        ("https://www.dba.dk/lejebolig/lejlighed/id-{id}", "DBA"),
+    ],
+}
+
+class FakeServiceError(Exception):
+    """Simulated transient provider error, retried like a 503."""
+    status_code = 503
+
+class LatencyProfile:
+    """
+    Simulated latency and error rate of a fake service.
+    Latency is drawn from a normal distribution around mean seconds.
+    """
+
+    def __init__(self, mean=0.05, jitter=0.2, error_rate=0.0, seed=0):
+        self.mean = mean
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.latencies = []
+
+    def wait(self):
+        """Sleeps for one simulated call and raises on a simulated error."""
+        with self._lock:
+            delay = max(0.0, self._rng.gauss(self.mean, self.mean * self.jitter))
+            fail = self._rng.random() < self.error_rate
+        start = time.perf_counter()
+        time.sleep(delay)
+        with self._lock:
+            self.latencies.append(time.perf_counter() - start)
+        if fail:
+            raise FakeServiceError("Simuleret fejl fra fake-service")
+
+def synthetic_listings(count, listing_type, seed=0, ambiguous_ratio=0.5):
+    """
+    Generate Danish listing results in the shape Tavily returns them.
+    About ambiguous_ratio of them leave out the price so the model has to be asked.
+    """
+    rng = random.Random(f"{seed}-{listing_type}")
+    listings = []
+    for index in range(count):
+        sqm = rng.randint(35, 150)
+        rooms = rng.randint(1, 5)
+        area = rng.choice(TARGET_AREAS + ["Amager", "Brønshøj"])
+        street = rng.choice(STREETS)
+        url_template, _ = rng.choice(SOURCES[listing_type])
+        url = url_template.format(id=100000 + index, sqm=sqm, rooms=rooms)
+
+        if listing_type == 'andelsbolig':
+            price = f"Pris {rng.randint(8, 40) * 100_000:,} kr.".replace(',', '.')
+            title = f"Andelslejlighed {sqm} m² {rooms} vær. - {street}, {area}"
+        else:
+            price = f"Husleje {rng.randint(60, 250) * 100:,} kr. pr. md.".replace(',', '.')
+            title = f"{rooms} værelses lejlighed på {sqm} m² - {street}, {area}"
+
+        features = ", ".join(rng.sample(FEATURES, 3))
+        body = f"Dejlig lejlighed på {street} i {area} med {features}. " + "Kontakt udlejer for fremvisning. " * rng.randint(1, 6)
+        if rng.random() >= ambiguous_ratio:
+            body = f"{price}. {body}"
+
+        listings.append({
+            'url': url,
+            'title': title,
+            'content': body,
+            'score': round(rng.random(), 4),
+            'raw_content': None,
+        })
+    return listings
+
+class FakeTavilyClient:
+    """
+    Stand-in for TavilyClient.search that spreads a fixed pool of synthetic
+    listings over the queries. max_results is ignored so large scales can be reached.
+    """
+
+    def __init__(self, listings_by_type, queries_by_type, latency=None):
+        self.latency = latency or LatencyProfile()
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._by_query = {}
+        for listing_type, queries in queries_by_type.items():
+            listings = listings_by_type.get(listing_type, [])
+            for index, (_, query) in enumerate(queries):
+                self._by_query[query] = listings[index::len(queries)]
+
+    def search(self, query, search_depth="basic", max_results=5, **kwargs):
+        with self._lock:
+            self.calls += 1
+        self.latency.wait()
+        return {'query': query, 'results': list(self._by_query.get(query, []))}
+
+class _FakeCompletions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model, messages, **kwargs):
+        return self.owner.complete(model, messages, stream=kwargs.get('stream', False))
+
+class FakeOpenAIClient:
+    """
+    Stand-in for the chat completions endpoint. It reads the listings from the
+    INPUT block of the prompt and answers with records built by the local
+    extractor, like a model that follows the output format.
+    """
+
+    def __init__(self, latency=None, cached_prefix_tokens=0):
+        self.latency = latency or LatencyProfile(mean=0.2)
+        self.cached_prefix_tokens = cached_prefix_tokens
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_FakeCompletions(self))
+
+    def complete(self, model, messages, stream=False):
+        with self._lock:
+            self.calls += 1
+        self.latency.wait()
+
+        prompt = messages[-1]['content']
+        payload = json.loads(prompt.rsplit('############################', 1)[1].strip())
+        output = {'summary': '', 'andelsboliger': [], 'lejeboliger': []}
+        for raw_key, out_key, listing_type, price_key in (
+            ('andelsbolig_raw', 'andelsboliger', 'andelsbolig', 'price_dkk'),
+            ('rental_raw', 'lejeboliger', 'lejebolig', 'rent_dkk'),
+        ):
+            for result in (payload.get(raw_key) or {}).get('results', []):
+                fields = extract_fields(result, listing_type)
+                output[out_key].append({
+                    'address': result.get('title'),
+                    price_key: fields.get(price_key),
+                    'sqm': fields['sqm'],
+                    'rooms': fields['rooms'],
+                    'url': result.get('url'),
+                    'source': listing_domain(result.get('url', '')),
+                    'area': fields['area'],
+                    'key_features': result.get('title'),
+                    'missing_fields': [k for k in (price_key, 'sqm') if fields.get(k) is None],
+                })
+        content = json.dumps(output, ensure_ascii=False)
+
+        prompt_tokens = sum(count_tokens(m['content']) for m in messages)
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=count_tokens(content),
+            prompt_tokens_details=SimpleNamespace(cached_tokens=min(prompt_tokens, self.cached_prefix_tokens)),
+        )
+        if stream:
+            return completion_chunks(content, usage)
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+class FakeGmailSender:
+    """
+    Stand-in for GmailSender that serializes the message like the real one
+    and only simulates the API call
+    """
+
+    def __init__(self, latency=None):
+        from utils.gmail_sender import GmailSender
+        self._real = GmailSender()
+        self.latency = latency or LatencyProfile(mean=0.1)
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def prepare_message(self, subject, html_content):
+        return self._real.prepare_message(subject, html_content)
+
+    def send_prepared(self, to_email, message_bytes, name=None):
+        self.latency.wait()
+        with self._lock:
+            self.bytes_sent += len(message_bytes)
+        return {'id': f'fake-{to_email}'}
+
+# One fixture page per site in the markup style of the site, with the fields extraction should find
+PAGE_FIXTURES = {
+    'dba.dk': ('andelsbolig', """
+        <html><head><meta property="og:title" content="Andelslejlighed, Vesterbrogade 12, 1620 København V">
+        <title>DBA</title></head><body>
+        <h1>Andelslejlighed på Vesterbro</h1>
+        <table class="vip-matrix-data">
+          <tr><td>Boligstørrelse</td><td>78 m²</td></tr>
+          <tr><td>Antal værelser</td><td>3</td></tr>
+          <tr><td>Pris</td><td>2.150.000 kr.</td></tr>
+        </table></body></html>
+    """, {'sqm': 78, 'rooms': 3, 'price_dkk': 2_150_000, 'area': 'Vesterbro'}),
+    'boligportal.dk': ('lejebolig', """
+        <html><head><meta property="og:title" content="3 værelses lejlighed på 92 m² i København Ø">
+        <script type="application/ld+json">{"@type": "Apartment", "floorSize": {"value": 92, "unitCode": "MTK"},
+          "numberOfRooms": 3, "address": {"streetAddress": "Classensgade 8", "postalCode": "2100"}}</script>
+        </head><body>
+        <div class="facts"><div><span>Månedlig leje</span><span>14.750 kr.</span></div></div>
+        </body></html>
+    """, {'sqm': 92, 'rooms': 3, 'rent_dkk': 14_750, 'area': 'Østerbro'}),
+    'lejebolig.dk': ('lejebolig', """
+        <html><head><title>Lejebolig på Frederiksberg</title></head><body>
+        <dl><dt>Areal:</dt><dd>64 m2</dd><dt>Værelser:</dt><dd>2</dd>
+        <dt>Husleje:</dt><dd>11.200 kr./md.</dd><dt>Adresse:</dt><dd>Falkoner Allé 40, 2000 Frederiksberg</dd></dl>
+        </body></html>
+    """, {'sqm': 64, 'rooms': 2, 'rent_dkk': 11_200, 'area': 'Frederiksberg'}),
+}
+
+PAGE_URLS = {
+    'dba.dk': "https://www.dba.dk/andelsbolig/andelslejlighed/id-{id}",
+    'boligportal.dk': "https://www.boligportal.dk/lejligheder/k%C3%B8benhavn/92m2-3-vaer-id-{id}",
+    'lejebolig.dk': "https://www.lejebolig.dk/lejebolig/{id}",
+}
+
+LAST_MODIFIED = formatdate(time.time() - 3600, usegmt=True)
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    Serves the fixture page of the site in the path (/dba.dk/...) with
+    Last-Modified and, if the server sends them, an ETag. Conditional
+    requests for an unchanged page are answered with 304.
+    """
+
+    def do_GET(self):
+        server = self.server
+        site = self.path.strip('/').split('/', 1)[0]
+        if site not in PAGE_FIXTURES:
+            self.send_error(404)
+            return
+        body = PAGE_FIXTURES[site][1].encode('utf-8')
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if_none_match = self.headers.get('If-None-Match')
+        if_modified_since = self.headers.get('If-Modified-Since')
+        # If-None-Match wins over If-Modified-Since when both are sent
+        if if_none_match is not None:
+            not_modified = server.etag and if_none_match == etag
+        else:
+            not_modified = if_modified_since == LAST_MODIFIED
+
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.requests['304' if not_modified else '200'] += 1
+            server.conditional.append((if_none_match, if_modified_since))
+        try:
+            time.sleep(server.latency)
+            self.send_response(304 if not_modified else 200)
+            if server.etag:
+                self.send_header('ETag', etag)
+            if not not_modified:
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Last-Modified', LAST_MODIFIED)
+            self.end_headers()
+            if not not_modified:
+                self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    Local server for the fixture pages, running on a background thread.
+    Counts downloads and 304s, the most requests it served at once and the
+    validators each request sent.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, etag=True):
+        super().__init__(('127.0.0.1', 0), FixtureHandler)
+        self.latency = latency
+        self.etag = etag
+        self.lock = threading.Lock()
+        self.requests = {'200': 0, '304': 0}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # (If-None-Match, If-Modified-Since) of every request
+        self.conditional = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+class FixtureFetcher(PageFetcher):
+    """Sends every listing URL to the fixture server, keeping the site in the path."""
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def resolve(self, url):
+        parsed = urlparse(url)
+        return f"{self.base_url}/{listing_domain(url)}{parsed.path}"
+
+def ambiguous_page_results(site, count):
+    """Tavily-like results whose snippets lack the fields the page has."""
+    listing_type = PAGE_FIXTURES[site][0]
+    results = []
+    for index in range(count):
+        result = {'url': PAGE_URLS[site].format(id=200000 + index), 'title': 'Lejlighed', 'content': 'Se annoncen.'}
+        results.append(dict(result, match=AMBIGUOUS, extracted=extract_fields(result, listing_type)))
+    return {'results': results}
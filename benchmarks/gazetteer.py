@@ -0,0 +1,152 @@
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.gazetteer import AREAS, Gazetteer, spelling_variants
+
+DEFAULT_SNIPPETS = [1000, 10000]
+
+# The alias table and regex loop area tagging used before the gazetteer, as the baseline
+REGEX_ALIASES = {
+    "Vesterbro": ["vesterbro", "københavn v", "kobenhavn v", "1620", "1650", "1660", "1670"],
+    "Østerbro": ["østerbro", "oesterbro", "osterbro", "københavn ø", "kobenhavn o", "2100"],
+    "Frederiksberg": ["frederiksberg", "2000"],
+    "Indre by": ["indre by", "københavn k", "kobenhavn k", "1050", "1100", "1150", "1200", "1300", "1400"],
+    "Nørrebro": ["nørrebro", "noerrebro", "norrebro", "københavn n", "kobenhavn n", "2200"],
+    "Valby": ["valby", "2500"],
+    "Christianshavn": ["christianshavn", "1401", "1409", "1411", "1416"],
+}
+REGEX_RES = {
+    area: re.compile(r'\b(?:' + '|'.join(re.escape(alias) for alias in aliases) + r')\b', re.IGNORECASE)
+    for area, aliases in REGEX_ALIASES.items()
+}
+
+# Mentions of districts outside the target areas and the district they are tagged with
+OTHER_AREAS = [("Amager", "Amager"), ("Brønshøj", "Brønshøj"), ("Vanløse", "Vanløse"), ("Nordvest", "Nordvest"),
+               ("Sydhavnen", "Sydhavn"), ("Hellerup", "Hellerup"), ("2300 København S", "Amager")]
+
+# Texts that have been tagged wrong before, with the expected tag
+HARD_CASES = [
+    ("Klassisk lejlighed, opført i 1932", None),
+    ("Ejendommen er bygget 1905 og renoveret fra 1998", None),
+    ("Istandsat i år, 1850 kr i aconto", None),
+    ("Husleje 2100 kr. pr. md.", None),
+    ("2100 København Ø", "Østerbro"),
+    ("DK-1850 Frederiksberg C", "Frederiksberg"),
+    ("1620 Kbh. V, opført i 1890", "Vesterbro"),
+    ("Lejlighed på Amager, 10 min til Christianshavn", "Amager"),
+    ("Lys bolig, 10 min til Christianshavn", None),
+    ("Tæt på Amager Strandpark", None),
+    ("Hellerup, tæt på Østerbro", "Hellerup"),
+    ("2900 Hellerup", "Hellerup"),
+    ("Brønshøj nær Nørrebro", "Brønshøj"),
+    ("Rækkehus i Vanløse", "Vanløse"),
+    ("København NV, gåafstand til Nørrebro", "Nordvest"),
+    ("Sydhavn ved siden af Valby", "Sydhavn"),
+    ("Valby på grænsen til Vanløse", "Valby"),
+    ("Grænsen mellem Valby og Vanløse", None),
+    ("Lejlighed på Christianshavn", "Christianshavn"),
+]
+
+FILLER = [
+    "Lys lejlighed med altan og nyt køkken.", "Tæt på metro og indkøb.", "Kontakt os for fremvisning.",
+    "Husdyr er tilladt.", "Vaskekælder i ejendommen.", "Ledig fra 1. marts.",
+]
+
+def _mentions(area, rng):
+    """Ways a listing names the area: the name in some spelling, a postcode, a neighbourhood."""
+    entry = AREAS[area]
+    alias = rng.choice(entry['aliases'])
+    first, last = rng.choice(entry['postcodes'])
+    postcode = rng.randint(first, last)
+    return [
+        rng.choice(sorted(spelling_variants(alias.lower()))),
+        f"{postcode} {rng.choice(['København', 'Kbh.', 'Frederiksberg'])}",
+        area,
+        area.upper(),
+    ]
+
+def synthetic_snippets(count, seed=0):
+    """
+    (text, area) pairs like listing titles and descriptions. Some name no target area
+    or only one they are near, some carry amounts and years that look like postcodes
+    ("Husleje 2100 kr", "Opført i 1932").
+    """
+    rng = random.Random(seed)
+    areas = list(AREAS)
+    snippets = []
+    for _ in range(count):
+        sqm = rng.randint(35, 150)
+        rent = rng.choice([2000, 2100, 2200, 2500, rng.randint(60, 250) * 100])
+        if rng.random() < 0.8:
+            area = rng.choice(areas)
+            place = rng.choice(_mentions(area, rng))
+        else:
+            place, area = rng.choice(OTHER_AREAS)
+        filler = " ".join(rng.sample(FILLER, rng.randint(1, 4)))
+        if rng.random() < 0.3:
+            filler += f" Opført i {rng.randint(1850, 1999)}."
+        if area not in AREAS and rng.random() < 0.3:
+            filler += f" {rng.randint(5, 20)} min til {rng.choice(areas)}."
+        text = f"{rng.randint(1, 5)} værelses lejlighed på {sqm} m² i {place}\n{filler} Husleje {rent} kr. pr. md."
+        snippets.append((text, area))
+    return snippets
+
+def check_hard_cases(gazetteer):
+    wrong = [(text, area, gazetteer.tag(text)) for text, area in HARD_CASES if gazetteer.tag(text) != area]
+    if wrong:
+        raise AssertionError(f"Gazetteer tagger forkert: {wrong}")
+
+def regex_tag(text):
+    for area, pattern in REGEX_RES.items():
+        if pattern.search(text):
+            return area
+    return None
+
+def benchmark(count, args):
+    snippets = synthetic_snippets(count, args.seed)
+    texts = [text for text, _ in snippets]
+    expected = [area for _, area in snippets]
+
+    start = time.perf_counter()
+    gazetteer = Gazetteer()
+    build = time.perf_counter() - start
+    check_hard_cases(gazetteer)
+
+    start = time.perf_counter()
+    tagged = [gazetteer.tag(text) for text in texts]
+    gazetteer_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    baseline = [regex_tag(text) for text in texts]
+    regex_seconds = time.perf_counter() - start
+
+    gazetteer_correct = sum(a == b for a, b in zip(tagged, expected)) / count
+    regex_correct = sum(a == b for a, b in zip(baseline, expected)) / count
+    print(f"{count:>7} snippets  build {build * 1000:6.1f} ms  "
+          f"gazetteer {gazetteer_seconds / count * 1e6:6.1f} us/snippet {gazetteer_correct:6.1%} correct  "
+          f"regex {regex_seconds / count * 1e6:6.1f} us/snippet {regex_correct:6.1%} correct")
+    if gazetteer_correct < args.min_accuracy:
+        wrong = [(text, area, got) for (text, area), got in zip(snippets, tagged) if area != got]
+        raise AssertionError(f"Gazetteer ramte kun {gazetteer_correct:.1%}, fx {wrong[:3]}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Area tagging with the gazetteer against the old regex loop")
+    parser.add_argument('--snippets', type=int, nargs='+', default=DEFAULT_SNIPPETS)
+    parser.add_argument('--min-accuracy', type=float, default=0.99,
+                        help="fail if the gazetteer tags fewer snippets than this correctly")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    for count in args.snippets:
+        benchmark(count, args)
+
+if __name__ == "__main__":
+    main()
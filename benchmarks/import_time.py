@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Modules to time, each imported in a fresh interpreter
+MODULES = [
+    'utils.filter',
+    'utils.report',
+    'utils.search',
+    'main',
+]
+
+def time_import(module, repeat=5):
+    """
+    Returns the best wall-clock time in seconds to import module in a new process
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-c', f'import {module}'],
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    baseline = time_import('sys')
+    print(f"{'interpreter':<16} {baseline * 1000:8.1f} ms")
+    for module in MODULES:
+        try:
+            elapsed = time_import(module)
+        except subprocess.CalledProcessError:
+            print(f"{module:<16} {'failed':>8}")
+            continue
+        print(f"{module:<16} {elapsed * 1000:8.1f} ms  (+{(elapsed - baseline) * 1000:.1f} ms)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import random
+import argparse
+import itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.fakes import STREETS, FEATURES, SOURCES
+from utils.filter import TARGET_AREAS, extract_fields
+from utils.neardup import NearDuplicateIndex, collapse_duplicates, fingerprint_result
+
+DEFAULT_SIZES = [1000, 10000]
+
+# How each portal words the same apartment
+TITLES = [
+    "{rooms} værelses lejlighed på {sqm} m² - {street} {number}, {area}",
+    "Lejlighed {sqm} m2 {rooms} vær. {area}",
+    "{street} {number} - {rooms} vær., {sqm} kvm udlejes",
+]
+
+def synthetic_postings(count, seed=0, repost_ratio=0.4):
+    """
+    Rental results where about repost_ratio of the apartments are posted again on
+    another portal with other wording. Returns (results, apartment id per result).
+    """
+    rng = random.Random(seed)
+    results, apartments = [], []
+    apartment = 0
+    while len(results) < count:
+        apartment += 1
+        sqm, rooms = rng.randint(35, 150), rng.randint(1, 5)
+        rent = rng.randint(60, 250) * 100
+        street, number = rng.choice(STREETS), rng.randint(1, 120)
+        area = rng.choice(TARGET_AREAS)
+        features = rng.sample(FEATURES, 4)
+        postings = 1 + (rng.random() < repost_ratio) + (rng.random() < repost_ratio / 4)
+        for posting in range(postings):
+            title = rng.choice(TITLES).format(rooms=rooms, sqm=sqm, street=street, number=number, area=area)
+            rng.shuffle(features)
+            content = (f"Husleje {rent:,} kr. pr. md. ".replace(',', '.') if rng.random() < 0.8 else "") + \
+                f"Dejlig lejlighed på {street} {number} med {', '.join(features)}. " + \
+                "Kontakt udlejer for fremvisning. " * rng.randint(1, 3)
+            url_template, _ = rng.choice(SOURCES['lejebolig'])
+            result = {'url': url_template.format(id=f"{apartment}{posting}", sqm=sqm, rooms=rooms),
+                      'title': title, 'content': content}
+            result['extracted'] = extract_fields(result, 'lejebolig')
+            results.append(result)
+            apartments.append(apartment)
+    return results[:count], apartments[:count]
+
+def naive_collapse(results):
+    """Compares every result with every kept one, the quadratic baseline."""
+    index = NearDuplicateIndex()
+    kept = []
+    for result in results:
+        fingerprint = fingerprint_result(result, 'lejebolig')
+        if not any(index.threshold <= _pair_similarity(fingerprint, other) and not fingerprint.conflicts(other)
+                   for other in kept):
+            kept.append(fingerprint)
+    return kept
+
+def _pair_similarity(fingerprint, other):
+    return sum(a == b for a, b in zip(fingerprint.signature, other.signature)) / len(fingerprint.signature)
+
+def benchmark(size, args):
+    results, apartments = synthetic_postings(size, args.seed, args.repost_ratio)
+    by_url = {result['url']: apartment for result, apartment in zip(results, apartments)}
+
+    start = time.perf_counter()
+    collapsed, duplicates = collapse_duplicates({'results': results}, 'lejebolig')
+    seconds = time.perf_counter() - start
+
+    true_pairs = sum(len(list(group)) - 1 for _, group in itertools.groupby(sorted(apartments)))
+    found = 0
+    wrong = 0
+    for result in collapsed['results']:
+        for url in result.get('duplicate_urls', []):
+            if by_url[url] == by_url[result['url']]:
+                found += 1
+            else:
+                wrong += 1
+
+    naive_results = results[:args.naive_listings]
+    start = time.perf_counter()
+    naive_collapse(naive_results)
+    naive_seconds = time.perf_counter() - start
+
+    per_listing = seconds / size * 1e6
+    per_naive = naive_seconds / max(1, len(naive_results)) * 1e6
+    print(f"{size:>7} listings  {per_listing:7.1f} us/listing  "
+          f"pairwise {per_naive:8.1f} us/listing (first {len(naive_results)})  "
+          f"{duplicates} duplicates, recall {found / max(1, true_pairs):6.1%}, "
+          f"precision {found / max(1, found + wrong):6.1%}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Cross-portal near-duplicate detection on synthetic reposts")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repost-ratio', type=float, default=0.4,
+                        help="share of apartments posted on a second portal")
+    parser.add_argument('--naive-listings', type=int, default=1000,
+                        help="listings collapsed with the pairwise comparison for timing")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    from utils import clients
+    clients.disable_env_file()
+    for size in args.sizes:
+        benchmark(size, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Run against the fakes only: no caches, no token budget, no listing store
+os.environ.setdefault('SEARCH_CACHE_DISABLED', '1')
+os.environ.setdefault('EXTRACTION_CACHE_DISABLED', '1')
+os.environ.setdefault('LLM_TOKEN_BUDGET', '0')
+os.environ.setdefault('GMAIL_SENDS_PER_SECOND', '1000')
+os.environ.setdefault('TAVILY_REQUESTS_PER_SECOND', '1000')
+os.environ.setdefault('OPENAI_REQUESTS_PER_SECOND', '1000')
+os.environ.setdefault('EMAIL_ADDRESS', 'benchmark@example.com')
+
+from utils import clients
+from utils import search
+from benchmarks.fakes import (
+    LatencyProfile,
+    FakeTavilyClient,
+    FakeOpenAIClient,
+    FakeGmailSender,
+    synthetic_listings,
+)
+
+DEFAULT_SIZES = [10, 100, 1000]
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of values, 0.0 for an empty list
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def _format_latencies(values):
+    return (
+        f"p50 {percentile(values, 0.5) * 1000:7.1f} ms  "
+        f"p95 {percentile(values, 0.95) * 1000:7.1f} ms  "
+        f"p99 {percentile(values, 0.99) * 1000:7.1f} ms"
+    )
+
+def install_fakes(size, args):
+    """
+    Build fakes for one scale and register them as the memoized clients
+    """
+    queries = {'andelsbolig': search.ANDELSBOLIG_QUERIES, 'lejebolig': search.RENTAL_QUERIES}
+    andel_count = size // 4
+    listings = {
+        'andelsbolig': synthetic_listings(andel_count, 'andelsbolig', args.seed, args.ambiguous_ratio),
+        'lejebolig': synthetic_listings(size - andel_count, 'lejebolig', args.seed, args.ambiguous_ratio),
+    }
+    fakes = {
+        'tavily': FakeTavilyClient(listings, queries, LatencyProfile(args.tavily_latency, error_rate=args.error_rate, seed=args.seed)),
+        'openai': FakeOpenAIClient(LatencyProfile(args.openai_latency, error_rate=args.error_rate, seed=args.seed + 1)),
+        'gmail_sender': FakeGmailSender(LatencyProfile(args.gmail_latency, error_rate=args.error_rate, seed=args.seed + 2)),
+    }
+    clients.reset_clients()
+    for name, fake in fakes.items():
+        clients.set_client(name, fake)
+    return fakes
+
+def run_once(recipients):
+    """
+    Run the pipeline stages once and return the duration of each
+    """
+    timings = {}
+    start = time.perf_counter()
+    andelsbolig_results = search.search_andelsbolig()
+    rental_results = search.search_rental()
+    timings['search'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    processed = search.process_search_results(andelsbolig_results, rental_results)
+    timings['process'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if processed:
+        search.send_email_reports(processed, recipients)
+    timings['send'] = time.perf_counter() - start
+
+    timings['total'] = sum(timings.values())
+    return timings
+
+def benchmark(size, args):
+    fakes = install_fakes(size, args)
+    recipients = [{'name': f'Modtager {i}', 'email': f'modtager{i}@example.com'} for i in range(args.recipients)]
+
+    runs = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(args.repeat):
+            runs.append(run_once(recipients))
+
+    print(f"\n== {size} listings, {args.repeat} runs, {args.recipients} recipients ==")
+    for stage in ('search', 'process', 'send', 'total'):
+        durations = [run[stage] for run in runs]
+        throughput = size / percentile(durations, 0.5) if percentile(durations, 0.5) else 0.0
+        print(f"{stage:<10} {_format_latencies(durations)}  {throughput:10.0f} listings/s")
+    for name, fake in fakes.items():
+        calls = len(fake.latency.latencies)
+        print(f"{name + ' call':<10} {_format_latencies(fake.latency.latencies)}  {calls:6d} calls")
+    for stat in clients.guard_stats():
+        print(f"{stat['provider']:<10} {stat['retries']} retries, {stat['failures']} failures, "
+              f"{stat['rejected']} rejected by circuit breaker, {stat['throttled_seconds']} s throttled")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the search pipeline against local fakes")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="number of listings Tavily returns per run (e.g. 10 100 1000 10000)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--recipients', type=int, default=5)
+    parser.add_argument('--tavily-latency', type=float, default=0.05, help="mean seconds per search")
+    parser.add_argument('--openai-latency', type=float, default=0.2, help="mean seconds per completion")
+    parser.add_argument('--gmail-latency', type=float, default=0.1, help="mean seconds per send")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of fake calls that fail")
+    parser.add_argument('--ambiguous-ratio', type=float, default=0.5,
+                        help="fraction of listings without a price, which need the model")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    clients.disable_env_file()
+    # Simulated failures are logged by the pipeline, keep them out of the report
+    logging.disable(logging.CRITICAL)
+    for size in args.sizes:
+        benchmark(size, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.filter import Criteria, TARGET_AREAS, record_fields
+from utils.subscriptions import SubscriptionIndex
+
+DEFAULT_SUBSCRIPTIONS = [100, 1000, 10000]
+LISTING_TYPES = ('andelsbolig', 'lejebolig')
+
+def synthetic_subscriptions(count, seed=0):
+    """
+    Random saved searches: a few areas, a sqm range, price caps and sometimes room counts
+    """
+    rng = random.Random(seed)
+    subscriptions = []
+    for index in range(count):
+        min_sqm = rng.randrange(30, 90, 5)
+        criteria = Criteria(
+            areas=rng.sample(TARGET_AREAS, rng.randint(1, 4)),
+            min_sqm=min_sqm,
+            max_sqm=min_sqm + rng.randrange(20, 80, 5),
+            max_price=rng.randrange(1_000_000, 4_000_000, 100_000),
+            max_rent=rng.randrange(8_000, 25_000, 500),
+            rooms=rng.sample(range(1, 6), rng.randint(1, 3)) if rng.random() < 0.5 else None,
+        )
+        listing_types = rng.choice([LISTING_TYPES, ('andelsbolig',), ('lejebolig',)])
+        subscriptions.append((f"sub-{index}", criteria, listing_types))
+    return subscriptions
+
+def synthetic_records(count, seed=0):
+    """
+    Random (listing_type, record) pairs, some fields unknown like model output
+    """
+    rng = random.Random(f"{seed}-records")
+    records = []
+    for _ in range(count):
+        listing_type = rng.choice(LISTING_TYPES)
+        price_field = 'price_dkk' if listing_type == 'andelsbolig' else 'rent_dkk'
+        price = rng.randrange(500_000, 4_500_000, 50_000) if listing_type == 'andelsbolig' else rng.randrange(5_000, 30_000, 100)
+        records.append((listing_type, {
+            'sqm': rng.randint(30, 160) if rng.random() < 0.9 else None,
+            price_field: price if rng.random() < 0.8 else None,
+            'area': rng.choice(TARGET_AREAS) if rng.random() < 0.9 else None,
+            'rooms': rng.randint(1, 5) if rng.random() < 0.7 else None,
+        }))
+    return records
+
+def naive_match(subscriptions, record, listing_type):
+    return [
+        key for key, criteria, listing_types in subscriptions
+        if listing_type in listing_types and criteria.matches(*record_fields(record, listing_type), listing_type)
+    ]
+
+def benchmark(count, args):
+    subscriptions = synthetic_subscriptions(count, args.seed)
+    records = synthetic_records(args.listings, args.seed)
+
+    start = time.perf_counter()
+    index = SubscriptionIndex()
+    for key, criteria, listing_types in subscriptions:
+        index.add(key, criteria, listing_types)
+    index.match(None, None, None, None, 'lejebolig')
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [index.match_record(record, listing_type) for listing_type, record in records]
+    indexed_seconds = time.perf_counter() - start
+
+    naive_records = records[:args.naive_listings]
+    start = time.perf_counter()
+    naive = [naive_match(subscriptions, record, listing_type) for listing_type, record in naive_records]
+    naive_seconds = time.perf_counter() - start
+
+    if naive != indexed[:len(naive)]:
+        raise AssertionError("Index og lineær matching er uenige")
+
+    matches = sum(len(keys) for keys in indexed) / max(1, len(indexed))
+    per_indexed = indexed_seconds / max(1, len(records)) * 1e6
+    per_naive = naive_seconds / max(1, len(naive_records)) * 1e6
+    print(f"{count:>7} subscriptions  build {build * 1000:8.1f} ms  "
+          f"index {per_indexed:9.1f} us/listing  linear {per_naive:10.1f} us/listing  "
+          f"{per_naive / per_indexed if per_indexed else 0:7.1f}x  {matches:8.1f} matches/listing")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Matching cost of listings against many saved searches")
+    parser.add_argument('--subscriptions', type=int, nargs='+', default=DEFAULT_SUBSCRIPTIONS)
+    parser.add_argument('--listings', type=int, default=2000)
+    parser.add_argument('--naive-listings', type=int, default=200,
+                        help="listings matched with the linear scan, which is also used to check the index")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    for count in args.subscriptions:
+        benchmark(count, args)
+
+if __name__ == "__main__":
+    main()
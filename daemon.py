@@ -0,0 +1,110 @@
+from utils.search import (
+    run_queries_per_query,
+    merge_query_results,
+)
+from utils.scheduler import (
+    PollJob,
+    AdaptivePollingScheduler,
+    SOURCE_INTERVALS,
+    DEFAULT_INTERVAL,
+    HOURLY_CALL_BUDGET,
+)
+from utils.store import ListingStore
+from utils.clients import configure_logging, load_env, env_int, guard_stats
+from utils.metrics import metrics
+from main import load_plan, process_and_send, parse_args
+import signal
+import logging
+
+logger = logging.getLogger('daemon')
+
+def build_jobs(plan):
+    """
+    One polling job per planned query, with the interval of its source.
+    An interval can be overridden with e.g. POLL_INTERVAL_BOLIGPORTAL=600.
+    """
+    jobs = []
+    for listing_type, queries in plan.queries.items():
+        for label, query in queries:
+            env_name = 'POLL_INTERVAL_' + label.upper().replace('.', '_')
+            interval = env_int(env_name, SOURCE_INTERVALS.get(label, DEFAULT_INTERVAL))
+            jobs.append(PollJob(label, query, listing_type, interval))
+    return jobs
+
+def make_runner(plan, listing_store):
+    """
+    Returns the callback that searches the due jobs and processes their new listings
+    """
+    def run_due(jobs):
+        metrics.reset()
+        try:
+            _run_due(jobs)
+        finally:
+            metrics.write()
+
+    def _run_due(jobs):
+        results = {'andelsbolig': None, 'lejebolig': None}
+        for listing_type in results:
+            typed_jobs = [job for job in jobs if job.listing_type == listing_type]
+            if not typed_jobs:
+                continue
+            # Polling wants fresh results, the response cache is for reruns
+            per_query, _ = run_queries_per_query(
+                [(job.label, job.query) for job in typed_jobs], listing_type, use_cache=False,
+                criteria=plan.criteria,
+            )
+            # Count the listings each query found that we have not seen, to adapt its interval
+            for job, found in zip(typed_jobs, per_query):
+                if found and listing_store:
+                    job.last_new = len(listing_store.diff({'results': found})['results'])
+                elif found:
+                    job.last_new = len(found)
+            results[listing_type] = {'results': merge_query_results(per_query, listing_type)}
+
+        logger.info("Polling: %s", ', '.join(job.label for job in jobs))
+        process_and_send(
+            results['andelsbolig'],
+            results['lejebolig'],
+            plan,
+            listing_store,
+            send_empty=False,
+        )
+    return run_due
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_env()
+    configure_logging(verbose=args.verbose)
+
+    plan = load_plan()
+    if not plan:
+        print("No recipients found in mapping.json")
+        return
+
+    listing_store = ListingStore()
+    scheduler = AdaptivePollingScheduler(
+        build_jobs(plan),
+        make_runner(plan, listing_store),
+        hourly_budget=env_int('POLL_HOURLY_CALL_BUDGET', HOURLY_CALL_BUDGET),
+    )
+
+    def shutdown(signum, frame):
+        logger.info("Modtog signal %d, stopper daemon", signum)
+        scheduler.stop()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    logger.info("Starter daemon med %d forespørgsler", len(scheduler.jobs))
+    try:
+        scheduler.run_forever()
+    finally:
+        for stat in scheduler.stats():
+            logger.info("Polling-statistik", extra={'fields': stat})
+        for stat in guard_stats():
+            logger.info("API-statistik", extra={'fields': stat})
+        listing_store.close()
+        logger.info("Daemon stoppet")
+
+if __name__ == "__main__":
+    main()
@@ -2,72 +2,197 @@ from utils.search import (
     search_andelsbolig,
     search_rental,
     process_search_results,
-    send_email_report
+    send_email_reports
 )
+from utils.store import ListingStore
+from utils.filter import canonical_url
+from utils.enrich import enrich_results
+from utils.neardup import collapse_duplicates
+from utils.profiles import load_profiles, plan_searches, match_profiles
+from utils.clients import configure_logging, load_env, replay_mode, guard_stats, env_int
+from utils.metrics import metrics
+from utils.logs import dump_payload
 import os
 import json
 import logging
+import argparse
 
-def load_recipients():
+logger = logging.getLogger('main')
+
+def load_mapping():
     """
-    Load recipient emails from mapping.json
+    Load mapping.json
     """
     try:
         with open('mapping.json', 'r') as f:
-            mapping = json.load(f)
-            return mapping.get('recipients', [])
+            return json.load(f)
     except Exception as e:
         print(f"Error loading mapping.json: {str(e)}")
-        return []
+        return {}
+
+def load_plan():
+    """
+    Build the search plan for the recipients and profiles in mapping.json,
+    or None if there are no recipients
+    """
+    groups = load_profiles(load_mapping())
+    if not groups:
+        return None
+    return plan_searches(groups)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Search for apartments and email the matches")
+    parser.add_argument('-v', '--verbose', action='store_true', default=None,
+                        help="log at DEBUG with the raw search results, prompts and model output (env LOG_VERBOSE)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_env()
+    configure_logging(verbose=args.verbose)
+    metrics.reset()
 
-def main():
-    # Load recipients from mapping
-    recipients = load_recipients()
-    if not recipients:
+    # Load recipients and their search profiles from mapping
+    plan = load_plan()
+    if not plan:
         print("No recipients found in mapping.json")
         return
+    logger.info("%d søgeprofiler, %d forespørgsler", len(plan.groups), plan.query_count())
     
     # Log search start
     print("Starter boligsøgning...")
     
     # Perform Andelsbolig search
     print("\nSøger efter andelsboliger...")
-    andelsbolig_results = search_andelsbolig()
+    andelsbolig_results = search_andelsbolig(plan.queries['andelsbolig'], plan.criteria)
     
     # Perform rental search
     print("\nSøger efter lejeboliger...")
-    rental_results = search_rental()
+    rental_results = search_rental(plan.queries['lejebolig'], plan.criteria)
+
+    # Recorded and replayed runs both reprocess everything, so the store diff and the
+    # seen index cannot make the replayed requests differ from the recorded ones.
+    # A replayed run must not touch the real mailboxes either.
+    mode = replay_mode()
+    replaying = mode == 'replay'
+    listing_store = None if os.getenv('FULL_RUN') or mode else ListingStore()
+    if replaying:
+        logger.info("Replay: sender ikke email")
+        plan = plan.without_recipients()
+    try:
+        process_and_send(andelsbolig_results, rental_results, plan, listing_store)
+    finally:
+        for stat in guard_stats():
+            logger.info("API-statistik", extra={'fields': stat})
+        metrics.write()
+
+def _count_listings(processed_results):
+    results_json = json.loads(processed_results)
+    return len(results_json.get('andelsboliger') or []) + len(results_json.get('lejeboliger') or [])
+
+def process_and_send(andelsbolig_results, rental_results, plan, listing_store=None, send_empty=True):
+    """
+    Diff the search results against the listing store, process the new ones
+    once and email every profile's recipients the listings matching that profile
+    """
+    # Only pass listings that are new or changed since the last run on
+    if listing_store:
+        listing_store.touch(andelsbolig_results)
+        listing_store.touch(rental_results)
+        andelsbolig_results = listing_store.diff(andelsbolig_results)
+        rental_results = listing_store.diff(rental_results)
+        if not (andelsbolig_results and andelsbolig_results['results']) and \
+                not (rental_results and rental_results['results']):
+            logger.info("Ingen nye boliger siden sidste kørsel")
+            return
     
     if andelsbolig_results or rental_results:
         print("\nBehandler søgeresultater...")
+        # The same apartment on several portals is processed once, reposts of seen listings not at all
+        andel_unique = collapse_listing_duplicates(andelsbolig_results, 'andelsbolig', listing_store)
+        rental_unique = collapse_listing_duplicates(rental_results, 'lejebolig', listing_store)
+        if listing_store and not (andel_unique and andel_unique['results']) and \
+                not (rental_unique and rental_unique['results']):
+            logger.info("Kun dubletter af kendte boliger siden sidste kørsel")
+            listing_store.mark_seen(andelsbolig_results, 'andelsbolig')
+            listing_store.mark_seen(rental_results, 'lejebolig')
+            return
+        # Fill in what the snippets lack from the listing pages, the store keeps the raw results
+        andel_enriched = enrich_results(andel_unique, 'andelsbolig', plan.criteria)
+        rental_enriched = enrich_results(rental_unique, 'lejebolig', plan.criteria)
         # Process results with OpenAI
-        processed_results = process_search_results(andelsbolig_results, rental_results)
+        pending = []
+        processed_results = process_search_results(andel_enriched, rental_enriched, criteria=plan.criteria,
+                                                   pending=pending)
         
         if processed_results:
+            if listing_store:
+                # Listings the model never answered for stay unseen, so the next run tries them again
+                retry = _result_urls(pending)
+                listing_store.mark_seen(_without_urls(andelsbolig_results, retry), 'andelsbolig')
+                listing_store.mark_seen(_without_urls(rental_results, retry), 'lejebolig')
+                if pending:
+                    logger.warning("%d boliger blev ikke behandlet og prøves igen næste kørsel", len(pending))
+
             # Log results
-            logging.info("Søgning gennemført med succes")
-            logging.info(f"Resultater:\n{processed_results}")
-            print(f"Resultater:\n{processed_results}")
+            summary = json.loads(processed_results).get('summary')
+            logger.info("Søgning gennemført med succes: %s", summary)
+            print(summary)
+            dump_payload(logger, "Resultater", processed_results)
             
-            # Send email to each recipient
-            for recipient in recipients:
-                try:
-                    email = recipient.get('email')
-                    name = recipient.get('name', 'Unknown')
-                    if email:
-                        print(f"\nSender email til {name} ({email})...")
-                        send_email_report(processed_results, email)
-                        print(f"Email sendt med succes til {email}")
-                    else:
-                        print(f"Manglende email for modtager: {name}")
-                except Exception as e:
-                    print(f"Fejl ved afsendelse af email til {email}: {str(e)}")
+            send_profile_reports(processed_results, plan, send_empty)
         else:
-            print("Kunne ikke behandle søgeresultater")
-            logging.error("Kunne ikke behandle søgeresultater")
+            logger.error("Kunne ikke behandle søgeresultater")
     else:
-        print("Ingen søgeresultater fundet eller der opstod en fejl under søgningen")
-        logging.error("Ingen søgeresultater fundet eller der opstod en fejl under søgningen")
+        logger.error("Ingen søgeresultater fundet eller der opstod en fejl under søgningen")
+
+def _result_urls(results):
+    """Canonical URLs of the results and of the duplicates collapsed into them."""
+    urls = set()
+    for result in results:
+        for url in [result.get('url')] + result.get('duplicate_urls', []):
+            if url:
+                urls.add(canonical_url(url))
+    return urls
+
+def _without_urls(results, urls):
+    if not results or not urls:
+        return results
+    return {'results': [r for r in results['results'] if canonical_url(r.get('url', '')) not in urls]}
+
+def collapse_listing_duplicates(results, listing_type, listing_store=None):
+    """
+    Collapse near-duplicate results, also against the listings the store has seen
+    within DUPLICATE_WINDOW_DAYS (default 30)
+    """
+    seen = None
+    if listing_store and results and results.get('results'):
+        seen = listing_store.seen_index(listing_type, env_int('DUPLICATE_WINDOW_DAYS', 30) * 24 * 3600)
+    unique, duplicates = collapse_duplicates(results, listing_type, seen)
+    if duplicates:
+        logger.info("Fjernede %d %s-dubletter på tværs af portaler", duplicates, listing_type)
+    return unique
+
+def send_profile_reports(processed_results, plan, send_empty=True):
+    """
+    Match the processed listings against each profile locally and email the
+    profile's recipients, one rendered report per profile
+    """
+    by_profile = match_profiles(processed_results, [profile for profile, _ in plan.groups])
+    for profile, recipients in plan.groups:
+        if not recipients:
+            continue
+        profile_results = by_profile[profile.name]
+        if not send_empty and _count_listings(profile_results) == 0:
+            logger.info("Ingen matchende boliger for profil %s, sender ikke email", profile.name)
+            continue
+
+        statuses = send_email_reports(profile_results, recipients)
+        for status in statuses:
+            if status['ok']:
+                print(f"Email sendt med succes til {status['email']}")
+            else:
+                print(f"Fejl ved afsendelse af email til {status['email'] or status['name']}: {status['error']}")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -10,6 +10,9 @@ source venv/bin/activate
 LOG_FILE="logs/apartment_search_$(date +\%Y\%m\%d).log"
 mkdir -p logs
 
+# The application log rotates by size next to the daily stdout log (LOG_VERBOSE=1 adds raw payloads)
+export LOG_PATH="logs/apartment_search.log"
+
 # Run the script and redirect both stdout and stderr to log file
 python main.py >> "$LOG_FILE" 2>&1
 
@@ -0,0 +1,32 @@
+from utils.filter import Criteria, normalize_area, classify_fields, REJECTED, AMBIGUOUS
+from utils.search import _tag_record_areas
+
+def test_outside_district_is_rejected():
+    assert normalize_area("Vanløse") == "Vanløse"
+    assert normalize_area("København S") == "Amager"
+    assert not Criteria().matches(60, 9000, normalize_area("Amager"), None, 'lejebolig')
+
+    fields = {'sqm': 60, 'rent_dkk': 9000, 'area': normalize_area("2300 København S"), 'rooms': 2, 'excluded': None}
+    assert classify_fields(fields, 'lejebolig') == REJECTED
+
+def test_mixed_mentions_are_left_to_the_model():
+    area = normalize_area("Grænsen mellem Valby og Vanløse")
+    assert area is None
+    fields = {'sqm': 60, 'rent_dkk': 9000, 'area': area, 'rooms': 2, 'excluded': None}
+    assert classify_fields(fields, 'lejebolig') == AMBIGUOUS
+
+def test_model_records_need_a_target_area():
+    records = [
+        {'url': 'https://www.dba.dk/lejebolig/id-1', 'area': 'København Ø'},
+        {'url': 'https://www.dba.dk/lejebolig/id-2', 'area': None},
+        {'url': 'https://www.dba.dk/lejebolig/id-3', 'area': 'Vanløse'},
+        {'url': 'https://www.dba.dk/lejebolig/id-4', 'area': 'tæt på Amager'},
+        {'url': 'https://www.dba.dk/lejebolig/id-5', 'area': None},
+    ]
+    results = [{'url': 'https://www.dba.dk/lejebolig/id-5', 'extracted': {'area': 'Valby'}}]
+    kept = _tag_record_areas(records, results)
+    assert [(record['url'][-4:], record['area']) for record in kept] == [('id-1', 'Østerbro'), ('id-5', 'Valby')]
+
+def test_record_area_must_be_in_the_profile_areas():
+    records = [{'url': 'https://www.dba.dk/lejebolig/id-1', 'area': 'Valby'}]
+    assert _tag_record_areas(records, [], Criteria(areas=["Vesterbro"])) == []
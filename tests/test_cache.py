@@ -0,0 +1,19 @@
+from utils import clients
+from utils.cache import SearchCache, DEFAULT_TTL, MAX_ENTRIES
+
+def test_search_cache_reads_env_when_created(tmp_path, monkeypatch):
+    clients.disable_env_file()
+    cache = SearchCache(str(tmp_path / 'defaults.sqlite'))
+    assert (cache.max_entries, cache.default_ttl) == (MAX_ENTRIES, DEFAULT_TTL)
+    cache.close()
+
+    # Set after utils.cache was imported, as a daemon or test would
+    monkeypatch.setenv('SEARCH_CACHE_TTL', '120')
+    monkeypatch.setenv('SEARCH_CACHE_MAX_ENTRIES', '7')
+    cache = SearchCache(str(tmp_path / 'env.sqlite'))
+    assert (cache.max_entries, cache.default_ttl) == (7, 120)
+    cache.close()
+
+    cache = SearchCache(str(tmp_path / 'explicit.sqlite'), max_entries=3, default_ttl=60)
+    assert (cache.max_entries, cache.default_ttl) == (3, 60)
+    cache.close()
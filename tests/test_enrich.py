@@ -0,0 +1,125 @@
+import time
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.fakes import (
+    PAGE_FIXTURES,
+    PAGE_URLS,
+    LAST_MODIFIED,
+    FixtureServer,
+    FixtureFetcher,
+    ambiguous_page_results,
+)
+from utils import clients
+from utils.cache import PageCache
+from utils.enrich import EXTRACTORS, enrich_results
+from utils.filter import CONFIRMED, canonical_url
+
+@pytest.fixture(autouse=True)
+def no_env_file():
+    clients.disable_env_file()
+
+@pytest.fixture
+def page_cache(tmp_path):
+    cache = PageCache(str(tmp_path / 'pages.sqlite'))
+    yield cache
+    cache.close()
+
+def serve(request, **kwargs):
+    server = FixtureServer(**kwargs)
+    request.addfinalizer(server.close)
+    return server
+
+def fetcher_for(request, server, **kwargs):
+    fetcher = FixtureFetcher(server.base_url, **kwargs)
+    request.addfinalizer(fetcher.close)
+    return fetcher
+
+def enrich_all(fetcher, listings):
+    return {
+        site: enrich_results(ambiguous_page_results(site, listings), listing_type, fetcher=fetcher)
+        for site, (listing_type, _, _) in PAGE_FIXTURES.items()
+    }
+
+@pytest.mark.parametrize('site', sorted(PAGE_FIXTURES))
+def test_site_extractor_reads_fixture_fields(site):
+    listing_type, html, expected = PAGE_FIXTURES[site]
+    fields = EXTRACTORS[site].extract(html, listing_type)
+    assert {field: fields.get(field) for field in expected} == expected
+
+def test_enriched_results_are_confirmed(request, page_cache):
+    server = serve(request)
+    enriched = enrich_all(fetcher_for(request, server, cache=page_cache), 3)
+    for site, results in enriched.items():
+        expected = PAGE_FIXTURES[site][2]
+        assert len(results['results']) == 3
+        for result in results['results']:
+            assert result['match'] == CONFIRMED
+            assert {field: result['extracted'].get(field) for field in expected} == expected
+
+def test_revalidation_with_etag(request, page_cache):
+    server = serve(request)
+    fetcher = fetcher_for(request, server, cache=page_cache)
+    enrich_all(fetcher, 4)
+    pages = 4 * len(PAGE_FIXTURES)
+    assert server.requests == {'200': pages, '304': 0}
+    assert all(validators == (None, None) for validators in server.conditional)
+
+    server.conditional.clear()
+    enriched = enrich_all(fetcher, 4)
+    assert server.requests == {'200': pages, '304': pages}
+    assert all(etag and modified == LAST_MODIFIED for etag, modified in server.conditional)
+    # The cached body gives the same fields as the download
+    assert all(result['match'] == CONFIRMED for results in enriched.values() for result in results['results'])
+
+def test_revalidation_with_last_modified_only(request, page_cache):
+    server = serve(request, etag=False)
+    fetcher = fetcher_for(request, server, cache=page_cache)
+    url = PAGE_URLS['dba.dk'].format(id=1)
+    first = fetcher.fetch(url)
+    second = fetcher.fetch(url)
+
+    assert second == first
+    assert server.requests == {'200': 1, '304': 1}
+    assert server.conditional[-1] == (None, LAST_MODIFIED)
+
+def test_changed_page_is_downloaded_again(request, page_cache):
+    server = serve(request)
+    fetcher = fetcher_for(request, server, cache=page_cache)
+    url = PAGE_URLS['dba.dk'].format(id=1)
+    fetcher.fetch(url)
+    page_cache.put(canonical_url(url), 'old', '"stale"', None)
+    fetcher.fetch(url)
+    assert server.requests == {'200': 2, '304': 0}
+
+@pytest.mark.parametrize('host_concurrency', [1, 3])
+def test_host_concurrency_limits_requests_per_host(request, host_concurrency):
+    server = serve(request, latency=0.05)
+    fetcher = fetcher_for(request, server, host_concurrency=host_concurrency)
+    urls = [PAGE_URLS['boligportal.dk'].format(id=index) for index in range(12)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(fetcher.fetch, urls))
+    assert server.max_in_flight == host_concurrency
+
+def test_hosts_do_not_share_a_slot(request):
+    servers = [serve(request, latency=0.1), serve(request, latency=0.1)]
+
+    class TwoHostFetcher(FixtureFetcher):
+        def resolve(self, url):
+            server = servers[int(url.rsplit('/', 1)[-1]) % 2]
+            return f"{server.base_url}{urlparse(super().resolve(url)).path}"
+
+    fetcher = TwoHostFetcher(servers[0].base_url, host_concurrency=1)
+    request.addfinalizer(fetcher.close)
+    urls = [PAGE_URLS['lejebolig.dk'].format(id=index) for index in range(8)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(fetcher.fetch, urls))
+    elapsed = time.perf_counter() - start
+
+    assert [server.max_in_flight for server in servers] == [1, 1]
+    assert [sum(server.requests.values()) for server in servers] == [4, 4]
+    # Four pages one at a time per host, the two hosts in parallel (eight in a row would take 0.8 s)
+    assert elapsed < 0.7
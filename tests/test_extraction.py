@@ -0,0 +1,55 @@
+import pytest
+
+from benchmarks.fakes import FakeOpenAIClient, LatencyProfile, synthetic_listings
+from utils import clients
+from utils.cache import ExtractionCache
+from utils.filter import filter_tavily_results
+from utils.search import process_search_results, prompt_fingerprint, _extraction_key
+
+class StoppedOpenAIClient(FakeOpenAIClient):
+    """Streams the first chunks of the answer, then the run is stopped."""
+
+    def __init__(self, chunks):
+        super().__init__(LatencyProfile(mean=0.0))
+        self.chunks = chunks
+
+    def complete(self, model, messages, stream=False):
+        for index, chunk in enumerate(super().complete(model, messages, stream)):
+            if index == self.chunks:
+                raise KeyboardInterrupt
+            yield chunk
+
+@pytest.fixture
+def extraction_cache(tmp_path):
+    clients.disable_env_file()
+    clients.reset_clients()
+    cache = ExtractionCache(str(tmp_path / 'extraction.sqlite'))
+    clients.set_client('extraction_cache', cache)
+    yield cache
+    clients.reset_clients()
+    cache.close()
+
+def ambiguous_rentals(count):
+    listings = synthetic_listings(count, 'lejebolig', ambiguous_ratio=1.0)
+    return filter_tavily_results({'results': listings}, 'lejebolig')
+
+def cached_count(cache, results):
+    fingerprint = prompt_fingerprint()
+    return sum(cache.get(_extraction_key(r, 'lejebolig', fingerprint))[0] for r in results['results'])
+
+def test_listings_are_cached_as_they_stream(extraction_cache):
+    rentals = ambiguous_rentals(12)
+    assert rentals['results']
+    clients.set_client('openai', StoppedOpenAIClient(chunks=20))
+    with pytest.raises(KeyboardInterrupt):
+        process_search_results(None, rentals)
+
+    # The listings parsed before the run stopped are kept, the rest are asked again
+    cached = cached_count(extraction_cache, rentals)
+    assert 0 < cached < len(rentals['results'])
+
+def test_complete_output_caches_every_result(extraction_cache):
+    rentals = ambiguous_rentals(12)
+    clients.set_client('openai', FakeOpenAIClient(LatencyProfile(mean=0.0)))
+    assert process_search_results(None, rentals) is not None
+    assert cached_count(extraction_cache, rentals) == len(rentals['results'])
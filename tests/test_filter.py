@@ -0,0 +1,43 @@
+from utils.filter import build_local_record, extract_fields, find_address
+from utils.search import _dedupe_records
+
+def local_record(title, content, url):
+    result = {'title': title, 'content': content, 'url': url}
+    return build_local_record(result, 'lejebolig', extract_fields(result, 'lejebolig'))
+
+def test_local_record_address_is_a_street_address():
+    record = local_record("Lejlighed på Istedgade 12", "65 m², husleje 9.500 kr.", 'https://www.boligportal.dk/lejlighed/id-1')
+    assert record['address'] == "Istedgade 12"
+    assert record['key_features'] == "Lejlighed på Istedgade 12"
+
+    record = local_record("2 værelses lejlighed", "65 m², husleje 9.500 kr.", 'https://www.boligportal.dk/lejlighed/id-2')
+    assert record['address'] is None
+
+def test_same_title_is_not_the_same_apartment():
+    records = [
+        local_record("2 værelses lejlighed", "65 m², husleje 9.500 kr. på Vesterbro", 'https://www.boligportal.dk/lejlighed/id-1'),
+        local_record("2 værelses lejlighed", "65 m², husleje 9.800 kr. på Nørrebro", 'https://www.boligportal.dk/lejlighed/id-2'),
+    ]
+    assert len(_dedupe_records(records)) == 2
+
+def test_same_street_address_and_sqm_is_deduped():
+    records = [
+        {'url': 'https://www.dba.dk/lejebolig/id-1', 'address': "Istedgade 12, 2. th", 'sqm': 65},
+        {'url': 'https://www.boligportal.dk/lejlighed/id-2', 'address': "istedgade 12", 'sqm': 65},
+        {'url': 'https://www.boligportal.dk/lejlighed/id-3', 'address': "Istedgade 12", 'sqm': 80},
+    ]
+    assert [record['url'][-4:] for record in _dedupe_records(records)] == ['id-1', 'id-3']
+    assert find_address("Lys 3-værelses på Vesterbro") is None
+
+def andel_price(content):
+    return extract_fields({'title': "Andelsbolig", 'content': content}, 'andelsbolig')['price_dkk']
+
+def test_andelsbolig_price_is_the_labelled_amount():
+    assert andel_price("Pris 1.950.000 kr. Ejendommen er vurderet til 45 mio. kr.") == 1_950_000
+    assert andel_price("Ejendomsværdi 12.000.000 kr. Pris 1.950.000 kr.") == 1_950_000
+    assert andel_price("Kontantpris: 2,1 mio. kr., boligafgift 4.300 kr. pr. md.") == 2_100_000
+    assert andel_price("Andelspris 1.500.000 kr. Prisen er 1.500.000 kr. inkl. forbedringer") == 1_500_000
+
+def test_unclear_andelsbolig_price_is_left_to_the_model():
+    assert andel_price("Flot andel, 1.950.000 kr.") is None
+    assert andel_price("Pris 1.950.000 kr., tidligere pris 2.300.000 kr.") is None
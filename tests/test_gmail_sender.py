@@ -0,0 +1,67 @@
+import sys
+import time
+from types import ModuleType, SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.gmail_sender import GmailSender
+
+class FakeService:
+    """Records how many sends use it at the same time."""
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.in_use = 0
+
+    def users(self):
+        return SimpleNamespace(messages=lambda: SimpleNamespace(send=self.send))
+
+    def send(self, userId, body):
+        return SimpleNamespace(execute=self.execute)
+
+    def execute(self):
+        self.in_use += 1
+        self.owner.max_in_use = max(self.owner.max_in_use, self.in_use)
+        time.sleep(0.01)
+        self.in_use -= 1
+        return {'id': 'sent'}
+
+@pytest.fixture
+def sender(monkeypatch):
+    discovery = ModuleType('googleapiclient.discovery')
+    discovery.built = []
+    discovery.max_in_use = 0
+
+    def build(name, version, credentials=None, cache_discovery=True):
+        service = FakeService(discovery)
+        discovery.built.append(service)
+        return service
+
+    discovery.build = build
+    monkeypatch.setitem(sys.modules, 'googleapiclient', ModuleType('googleapiclient'))
+    monkeypatch.setitem(sys.modules, 'googleapiclient.discovery', discovery)
+    sender = GmailSender()
+    creds = object()
+    monkeypatch.setattr(sender, 'get_credentials', lambda: creds)
+    sender.discovery = discovery
+    return sender
+
+def send_all(sender, count, workers):
+    message = sender.prepare_message("Boliger", "<p>Nye boliger</p>")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda i: sender.send_prepared(f"modtager{i}@example.com", message), range(count)))
+
+def test_services_are_reused_across_worker_pools(sender):
+    for _ in range(3):
+        send_all(sender, 12, workers=4)
+    assert len(sender.discovery.built) <= 4
+    assert sender.discovery.max_in_use == 1
+
+def test_services_of_replaced_credentials_are_dropped(sender, monkeypatch):
+    send_all(sender, 4, workers=1)
+    assert len(sender.discovery.built) == 1
+    new_creds = object()
+    monkeypatch.setattr(sender, 'get_credentials', lambda: new_creds)
+    send_all(sender, 4, workers=1)
+    assert len(sender.discovery.built) == 2
@@ -0,0 +1,65 @@
+import threading
+
+from utils.resilience import CircuitBreaker, TRIAL_WAIT
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def open_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10.0, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+def test_open_breaker_rejects_until_reset():
+    clock = FakeClock()
+    breaker = open_breaker(clock)
+    clock.now = 4.0
+    assert breaker.state == 'open'
+    assert breaker.allow() == 6.0
+
+def test_half_open_admits_exactly_one_trial():
+    clock = FakeClock()
+    breaker = open_breaker(clock)
+    clock.now = 25.0
+    assert breaker.state == 'half_open'
+    waits = [breaker.allow() for _ in range(5)]
+    assert waits == [0.0] + [TRIAL_WAIT] * 4
+
+def test_half_open_admits_one_of_concurrent_callers():
+    clock = FakeClock()
+    breaker = open_breaker(clock)
+    clock.now = 25.0
+    waits = []
+    start = threading.Barrier(8)
+
+    def caller():
+        start.wait()
+        waits.append(breaker.allow())
+
+    threads = [threading.Thread(target=caller) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(1 for wait in waits if not wait) == 1
+
+def test_trial_success_closes_and_failure_reopens():
+    clock = FakeClock()
+    breaker = open_breaker(clock)
+    clock.now = 25.0
+    assert breaker.allow() == 0.0
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow() == 0.0
+
+    breaker = open_breaker(clock)
+    clock.now = 40.0
+    assert breaker.allow() == 0.0
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.allow() == 10.0
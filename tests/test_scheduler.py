@@ -0,0 +1,63 @@
+import pytest
+
+from utils.scheduler import AdaptivePollingScheduler, PollJob, MAX_INTERVAL, MIN_INTERVAL
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def make_scheduler(jobs, new_per_run, hourly_budget=1000):
+    clock = FakeClock()
+
+    def run_due(due):
+        for job in due:
+            job.last_new = new_per_run.get(job.label, 0)
+
+    return AdaptivePollingScheduler(jobs, run_due, hourly_budget=hourly_budget, jitter=0.0, clock=clock), clock
+
+def run_until(scheduler, clock, seconds):
+    while clock.now < seconds:
+        scheduler.run_once()
+        clock.now = min(job.next_run for job in scheduler.jobs)
+
+def test_interval_follows_churn():
+    busy = PollJob('busy', 'q1', 'lejebolig', 1800)
+    steady = PollJob('steady', 'q2', 'lejebolig', 1800)
+    quiet = PollJob('quiet', 'q3', 'lejebolig', 1800)
+    scheduler, clock = make_scheduler([busy, steady, quiet], {'busy': 4, 'steady': 1})
+    run_until(scheduler, clock, 24 * 3600)
+
+    # Four times the target churn polls four times as often
+    assert busy.interval == pytest.approx(450)
+    assert steady.interval == pytest.approx(1800)
+    assert quiet.interval == MAX_INTERVAL
+
+def test_interval_is_clamped():
+    job = PollJob('busy', 'q', 'lejebolig', 1800)
+    scheduler, clock = make_scheduler([job], {'busy': 50})
+    run_until(scheduler, clock, 6 * 3600)
+    assert job.interval == MIN_INTERVAL
+
+def test_one_busy_run_does_not_reset_a_quiet_job():
+    job = PollJob('quiet', 'q', 'lejebolig', 1800)
+    scheduler, _ = make_scheduler([job], {})
+    for _ in range(5):
+        job.interval = scheduler.next_interval(job)
+    quiet = job.interval
+    job.last_new = 1
+    job.interval = scheduler.next_interval(job)
+    # Churn is an average, so one listing shortens the interval without jumping back to the minimum
+    assert MIN_INTERVAL < job.interval < quiet
+
+def test_budget_stretches_all_jobs_together():
+    jobs = [PollJob(f'job{i}', f'q{i}', 'lejebolig', 600) for i in range(10)]
+    scheduler, clock = make_scheduler(jobs, {f'job{i}': 10 for i in range(10)}, hourly_budget=30)
+    run_until(scheduler, clock, 3 * 3600)
+
+    assert scheduler.calls_per_hour() <= 30 + 1e-9
+    assert len({job.interval for job in jobs}) == 1
+    # Waiting runs are moved as well, no job keeps a slot from before the stretch
+    assert all(job.next_run - clock.now <= job.interval + 1e-9 for job in jobs)
@@ -0,0 +1,18 @@
+from benchmarks.subscriptions import synthetic_subscriptions, synthetic_records, naive_match
+from utils.subscriptions import SubscriptionIndex
+
+def test_index_agrees_with_the_criteria():
+    subscriptions = synthetic_subscriptions(200, seed=1)
+    index = SubscriptionIndex()
+    for key, criteria, listing_types in subscriptions:
+        index.add(key, criteria, listing_types)
+
+    records = synthetic_records(500, seed=1)
+    # Aliases, outside districts and unknown names go through the same area projection
+    records += [
+        (listing_type, {'sqm': 70, 'rent_dkk': 12_000, 'price_dkk': 2_000_000, 'area': area, 'rooms': 3})
+        for listing_type in ('andelsbolig', 'lejebolig')
+        for area in ("København Ø", "2000 Frederiksberg", "Vanløse", "Amager", "Ukendt sted", None)
+    ]
+    for listing_type, record in records:
+        assert index.match_record(record, listing_type) == naive_match(subscriptions, record, listing_type)
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from .clients import env_int
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'cache')
+
+# Time-to-live in seconds per source label, DEFAULT_TTL (env SEARCH_CACHE_TTL) is used for unknown sources
+DEFAULT_TTL = 3600
+SOURCE_TTLS = {
+    "Boligportal": 30 * 60,
+    "Facebook": 30 * 60,
+    "Lejebolig.dk": 60 * 60,
+    "DBA": 3 * 60 * 60,
+}
+
+# Maximum number of stored responses before the least recently used are evicted (env SEARCH_CACHE_MAX_ENTRIES)
+MAX_ENTRIES = 500
+
+class SearchCache:
+    """
+    SQLite-backed cache of Tavily search responses with TTL and LRU eviction.
+    max_entries and default_ttl default to the env when the cache is created.
+    """
+
+    def __init__(self, path=None, max_entries=None, source_ttls=None, default_ttl=None):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, 'search_cache.sqlite')
+        self.path = path
+        self.max_entries = env_int('SEARCH_CACHE_MAX_ENTRIES', MAX_ENTRIES) if max_entries is None else max_entries
+        self.source_ttls = SOURCE_TTLS if source_ttls is None else source_ttls
+        self.default_ttl = env_int('SEARCH_CACHE_TTL', DEFAULT_TTL) if default_ttl is None else default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS search_cache (
+                key TEXT PRIMARY KEY,
+                source TEXT,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_access ON search_cache (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(query, search_depth, max_results):
+        """Builds the cache key for a Tavily request."""
+        raw = json.dumps([query, search_depth, max_results], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def ttl_for(self, source):
+        return self.source_ttls.get(source, self.default_ttl)
+
+    def get(self, source, query, search_depth, max_results):
+        """Returns the cached response or None if missing or expired."""
+        key = self.make_key(query, search_depth, max_results)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_for(source):
+                if row is not None:
+                    self._conn.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE search_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, source, query, search_depth, max_results, response):
+        """Stores a response and evicts the least recently used entries above max_entries."""
+        key = self.make_key(query, search_depth, max_results)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, source, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, source, json.dumps(response, ensure_ascii=False), now, now)
+            )
+            self._conn.execute(
+                "DELETE FROM search_cache WHERE key IN ("
+                "SELECT key FROM search_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ExtractionCache:
+    """
+    SQLite-backed cache of the record the model extracted for a single listing.
+    A stored None means the model excluded the listing.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, 'extraction_cache.sqlite')
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                key TEXT PRIMARY KEY,
+                record TEXT,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(listing_type, url, title, content, fingerprint):
+        """Builds a content address from the normalized listing and the prompt fingerprint."""
+        normalized = [
+            listing_type,
+            (url or '').strip().lower(),
+            ' '.join((title or '').split()).lower(),
+            ' '.join((content or '').split()).lower(),
+            fingerprint,
+        ]
+        raw = json.dumps(normalized, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns (found, record)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT record FROM extraction_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+        return True, json.loads(row[0]) if row[0] is not None else None
+
+    def put(self, key, record):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extraction_cache (key, record, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(record, ensure_ascii=False) if record is not None else None, time.time())
+            )
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Listing pages kept for revalidation
+PAGE_MAX_ENTRIES = 2000
+
+class PageCache:
+    """
+    SQLite-backed cache of fetched listing pages with their ETag and
+    Last-Modified validators, used for conditional requests
+    """
+
+    def __init__(self, path=None, max_entries=PAGE_MAX_ENTRIES):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, 'page_cache.sqlite')
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS page_cache (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_page_cache_fetched ON page_cache (fetched_at)")
+        self._conn.commit()
+
+    def get(self, url):
+        """Returns {'etag', 'last_modified', 'body', 'fetched_at'} or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, body, fetched_at FROM page_cache WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'body': row[2], 'fetched_at': row[3]}
+
+    def put(self, url, body, etag=None, last_modified=None):
+        """Stores a page and evicts the least recently fetched above max_entries."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO page_cache (url, etag, last_modified, body, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, etag, last_modified, body, time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM page_cache WHERE url IN ("
+                "SELECT url FROM page_cache ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def revalidated(self, url, hit):
+        """Marks a cached page as confirmed fresh by a 304, or counts a full download."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self._conn.execute("UPDATE page_cache SET fetched_at = ? WHERE url = ?", (time.time(), url))
+                self._conn.commit()
+            else:
+                self.misses += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
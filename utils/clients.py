@@ -0,0 +1,184 @@
+import os
+import threading
+
+# Clients are created the first time they are needed, so importing the
+# pipeline modules does not import SDKs, read .env or touch disk
+_lock = threading.RLock()
+_instances = {}
+_env_loaded = False
+
+def load_env():
+    """Loads .env once per process."""
+    global _env_loaded
+    with _lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _env_loaded = True
+
+def disable_env_file():
+    """Skips reading .env, so benchmarks never pick up real API keys."""
+    global _env_loaded
+    with _lock:
+        _env_loaded = True
+
+def configure_logging(verbose=None):
+    """
+    Configures logging once per process: a queue to a rotating log file
+    written off the calling threads, see utils.logs
+    """
+    load_env()
+    from .logs import setup_logging
+    setup_logging(verbose=verbose)
+
+def env_str(name, default=None):
+    load_env()
+    return os.getenv(name, default)
+
+def env_int(name, default):
+    value = env_str(name)
+    return int(value) if value else default
+
+def env_float(name, default):
+    value = env_str(name)
+    return float(value) if value else default
+
+def _memoized(name, factory):
+    with _lock:
+        if name not in _instances:
+            _instances[name] = factory()
+        return _instances[name]
+
+# Default snapshot for REPLAY_MODE=record|replay, override with REPLAY_FILE
+DEFAULT_REPLAY_FILE = os.path.join(os.path.dirname(__file__), '..', 'cache', 'replay', 'snapshot.bin')
+
+def replay_mode():
+    """Returns 'record', 'replay' or None from REPLAY_MODE."""
+    mode = (env_str('REPLAY_MODE') or '').strip().lower()
+    if mode and mode not in ('record', 'replay'):
+        raise ValueError(f"Unknown REPLAY_MODE {mode!r}, expected 'record' or 'replay'")
+    return mode or None
+
+def get_snapshot_writer():
+    def create():
+        from .replay import SnapshotWriter
+        return SnapshotWriter(env_str('REPLAY_FILE') or DEFAULT_REPLAY_FILE)
+    return _memoized('snapshot_writer', create)
+
+def get_snapshot_reader():
+    def create():
+        from .replay import SnapshotReader
+        return SnapshotReader(env_str('REPLAY_FILE') or DEFAULT_REPLAY_FILE)
+    return _memoized('snapshot_reader', create)
+
+def get_openai_client():
+    def create():
+        mode = replay_mode()
+        if mode == 'replay':
+            from .replay import ReplayOpenAIClient
+            return ReplayOpenAIClient(get_snapshot_reader())
+        from openai import OpenAI
+        # Retries are done by the provider guard, not by the SDK
+        client = OpenAI(api_key=env_str('OPENAI_API_KEY'), max_retries=0)
+        if mode == 'record':
+            from .replay import RecordingOpenAIClient
+            return RecordingOpenAIClient(client, get_snapshot_writer())
+        return client
+    return _memoized('openai', create)
+
+def get_tavily_client():
+    def create():
+        mode = replay_mode()
+        if mode == 'replay':
+            from .replay import ReplayTavilyClient
+            return ReplayTavilyClient(get_snapshot_reader())
+        from tavily import TavilyClient
+        client = TavilyClient(api_key=env_str('TAVILY_API_KEY'))
+        if mode == 'record':
+            from .replay import RecordingTavilyClient
+            return RecordingTavilyClient(client, get_snapshot_writer())
+        return client
+    return _memoized('tavily', create)
+
+def get_gmail_sender():
+    def create():
+        from .gmail_sender import GmailSender
+        return GmailSender()
+    return _memoized('gmail_sender', create)
+
+def get_search_cache():
+    """Returns the Tavily response cache, or None if SEARCH_CACHE_DISABLED is set."""
+    def create():
+        # Record and replay runs must hit the clients so every request is captured or served
+        if env_str('SEARCH_CACHE_DISABLED') or replay_mode():
+            return None
+        from .cache import SearchCache
+        return SearchCache()
+    return _memoized('search_cache', create)
+
+def get_extraction_cache():
+    """Returns the model extraction cache, or None if EXTRACTION_CACHE_DISABLED is set."""
+    def create():
+        if env_str('EXTRACTION_CACHE_DISABLED') or replay_mode():
+            return None
+        from .cache import ExtractionCache
+        return ExtractionCache()
+    return _memoized('extraction_cache', create)
+
+def get_page_fetcher():
+    """Returns the listing page fetcher, or None if ENRICH_DISABLED is set or in record/replay runs."""
+    def create():
+        # Pages are not part of a snapshot, a replayed run must not depend on the live sites
+        if env_str('ENRICH_DISABLED') or replay_mode():
+            return None
+        from .enrich import PageFetcher, HOST_CONCURRENCY
+        from .cache import PageCache
+        return PageFetcher(
+            cache=PageCache(),
+            host_concurrency=env_int('ENRICH_HOST_CONCURRENCY', HOST_CONCURRENCY),
+            guard=get_guard('pages'),
+        )
+    return _memoized('page_fetcher', create)
+
+# Env var overriding the request rate of each provider
+RATE_ENV = {
+    'tavily': 'TAVILY_REQUESTS_PER_SECOND',
+    'openai': 'OPENAI_REQUESTS_PER_SECOND',
+    'gmail': 'GMAIL_SENDS_PER_SECOND',
+    'pages': 'PAGE_REQUESTS_PER_SECOND',
+}
+
+def get_guard(provider):
+    """Returns the rate limiter, retry policy and circuit breaker shared by all calls to provider."""
+    def create():
+        from .resilience import build_guard, CircuitBreaker, MAX_ATTEMPTS, FAILURE_THRESHOLD, RESET_TIMEOUT
+        return build_guard(
+            provider,
+            rate=env_float(RATE_ENV[provider], None),
+            max_attempts=env_int('RETRY_MAX_ATTEMPTS', MAX_ATTEMPTS),
+            breaker=CircuitBreaker(
+                failure_threshold=env_int('CIRCUIT_FAILURE_THRESHOLD', FAILURE_THRESHOLD),
+                reset_timeout=env_float('CIRCUIT_RESET_TIMEOUT', RESET_TIMEOUT),
+            ),
+        )
+    return _memoized(f'guard_{provider}', create)
+
+def guard_stats():
+    """Retry and throttle statistics of the guards created so far."""
+    with _lock:
+        guards = [instance for name, instance in _instances.items() if name.startswith('guard_')]
+    return [guard.stats() for guard in guards]
+
+def set_client(name, instance):
+    """
+    Replaces a memoized instance, e.g. with a local stand-in for benchmarks.
+    name is one of 'openai', 'tavily', 'gmail_sender', 'search_cache',
+    'extraction_cache', 'page_fetcher', 'snapshot_writer', 'snapshot_reader' or 'guard_<provider>'.
+    """
+    with _lock:
+        _instances[name] = instance
+
+def reset_clients():
+    """Drops all memoized instances, used by tests and benchmarks."""
+    with _lock:
+        _instances.clear()
@@ -0,0 +1,176 @@
+import re
+import json
+import logging
+import threading
+from .filter import SQM_RE, AMOUNT_RE, MILLION_RE, ROOMS_RE, EXCLUDED_STATUS
+from .gazetteer import area_spans
+
+logger = logging.getLogger(__name__)
+
+# Fields of a Tavily result the extraction needs, everything else is dropped
+PROMPT_FIELDS = ('url', 'title', 'content')
+
+# Characters kept around each sqm/price/area/status mention, and the cap per listing
+SNIPPET_WINDOW = 80
+MAX_CONTENT_CHARS = 600
+
+# Rough characters per token, used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+MARKDOWN_RE = re.compile(r'[#*_`>|]+')
+LINK_RE = re.compile(r'https?://\S+')
+WHITESPACE_RE = re.compile(r'\s+')
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def count_tokens(text):
+    """
+    Count tokens with tiktoken if it is installed, otherwise estimate from the length
+    """
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding('o200k_base')
+            except Exception:
+                _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def clean_text(text):
+    """
+    Strip links, markdown markup and repeated whitespace
+    """
+    text = LINK_RE.sub(' ', text or '')
+    text = MARKDOWN_RE.sub(' ', text)
+    return WHITESPACE_RE.sub(' ', text).strip()
+
+def _mention_spans(text, listing_type):
+    patterns = [SQM_RE, AMOUNT_RE, ROOMS_RE, EXCLUDED_STATUS[listing_type]]
+    if listing_type == 'andelsbolig':
+        patterns.append(MILLION_RE)
+
+    mentions = [match.span() for pattern in patterns for match in pattern.finditer(text)]
+    mentions.extend(area_spans(text))
+    spans = [(max(0, start - SNIPPET_WINDOW), min(len(text), end + SNIPPET_WINDOW)) for start, end in mentions]
+    spans.sort()
+
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def truncate_content(text, listing_type, max_chars=MAX_CONTENT_CHARS):
+    """
+    Keep the parts of the content around sqm, price, area and status mentions
+    """
+    text = clean_text(text)
+    if len(text) <= max_chars:
+        return text
+
+    spans = _mention_spans(text, listing_type)
+    if not spans:
+        return text[:max_chars]
+
+    snippets = []
+    length = 0
+    for start, end in spans:
+        snippet = text[start:end].strip()
+        if length + len(snippet) > max_chars:
+            snippet = snippet[:max_chars - length]
+        if snippet:
+            snippets.append(snippet)
+            length += len(snippet)
+        if length >= max_chars:
+            break
+    return ' … '.join(snippets)
+
+def project_result(result, listing_type):
+    """
+    Reduce a Tavily result to the fields the extraction needs
+    """
+    projected = {field: result.get(field) for field in PROMPT_FIELDS if result.get(field)}
+    projected['title'] = clean_text(projected.get('title'))
+    projected['content'] = truncate_content(projected.get('content'), listing_type)
+    # The area the gazetteer tagged, the model copies it instead of guessing from spellings
+    area = (result.get('extracted') or {}).get('area')
+    if area:
+        projected['area'] = area
+    return projected
+
+def compact_results(results, listing_type):
+    """
+    Project and truncate every result in a {'results': [...]} dict
+    """
+    if not results or 'results' not in results:
+        return results
+    return {'results': [project_result(r, listing_type) for r in results['results']]}
+
+class BudgetExceeded(Exception):
+    """A call was not made because its prompt would exceed the token budget."""
+
+class TokenBudget:
+    """
+    Thread-safe per-run budget and accounting of prompt tokens
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.rejected = 0
+        self.raw_input_tokens = 0
+        self.compact_input_tokens = 0
+        # Usage reported by the API
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens):
+        """Reserves tokens and returns True, or returns False if the budget would be exceeded."""
+        with self._lock:
+            if self.limit and self.used + tokens > self.limit:
+                self.rejected += 1
+                return False
+            self.used += tokens
+            return True
+
+    def record_compaction(self, raw_results, compact_results):
+        """Adds the listing input size before and after compaction."""
+        before = count_tokens(json.dumps(raw_results, ensure_ascii=False))
+        after = count_tokens(json.dumps(compact_results, ensure_ascii=False))
+        with self._lock:
+            self.raw_input_tokens += before
+            self.compact_input_tokens += after
+
+    def record_usage(self, usage):
+        """Adds prompt, cached prompt and completion tokens from a chat completion's usage."""
+        if usage is None:
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached = getattr(details, 'cached_tokens', 0) or 0
+        with self._lock:
+            self.prompt_tokens += getattr(usage, 'prompt_tokens', 0) or 0
+            self.cached_tokens += cached
+            self.completion_tokens += getattr(usage, 'completion_tokens', 0) or 0
+
+    def log(self):
+        message = (
+            f"Tokens: {self.raw_input_tokens} input før komprimering, {self.compact_input_tokens} efter; "
+            f"{self.used} prompt-tokens brugt af budget {self.limit or 'ubegrænset'}"
+        )
+        if self.prompt_tokens:
+            message += (
+                f"; API: {self.prompt_tokens} prompt-tokens "
+                f"({self.cached_tokens} cachet, {self.prompt_tokens - self.cached_tokens} ucachet), "
+                f"{self.completion_tokens} completion-tokens"
+            )
+        if self.rejected:
+            message += f", {self.rejected} kald afvist af budgettet"
+        logger.info(message)
@@ -0,0 +1,297 @@
+import re
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from .filter import (
+    AMBIGUOUS,
+    REJECTED,
+    MILLION_RE,
+    DEFAULT_CRITERIA,
+    extract_fields,
+    classify_fields,
+    listing_domain,
+    canonical_url,
+)
+from .gazetteer import tag_area
+from .metrics import metrics, timed
+from .clients import env_int, get_page_fetcher
+
+logger = logging.getLogger(__name__)
+
+# Listing pages fetched at the same time, and per host (env ENRICH_CONCURRENCY, ENRICH_HOST_CONCURRENCY)
+ENRICH_CONCURRENCY = 8
+HOST_CONCURRENCY = 2
+FETCH_TIMEOUT = 10
+USER_AGENT = "Mozilla/5.0 (compatible; apartment-search/1.0)"
+
+NUMBER_RE = re.compile(r'\d{1,3}(?:[. ]\d{3})+|\d+')
+
+class PageFetcher:
+    """
+    Fetches listing pages over one pooled keep-alive session.
+    At most host_concurrency requests run per host, pages are revalidated
+    with If-None-Match / If-Modified-Since against the page cache.
+    """
+
+    def __init__(self, cache=None, host_concurrency=HOST_CONCURRENCY, pool_size=ENRICH_CONCURRENCY,
+                 timeout=FETCH_TIMEOUT, guard=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        # Retries are done by the guard, the adapter only pools connections per host
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'User-Agent': USER_AGENT, 'Accept-Language': 'da,en;q=0.8'})
+        self.cache = cache
+        self.host_concurrency = max(1, host_concurrency)
+        self.timeout = timeout
+        self.guard = guard
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _host_slot(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            slot = self._hosts.setdefault(host, threading.BoundedSemaphore(self.host_concurrency))
+        with slot:
+            yield
+
+    def resolve(self, url):
+        """URL actually requested for a listing URL, overridden to point at fixtures."""
+        return url
+
+    def _get(self, url, headers):
+        with self._host_slot(url):
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    def fetch(self, url):
+        """Returns the page HTML, from the cache if the server says it has not changed."""
+        key = canonical_url(url)
+        cached = self.cache.get(key) if self.cache is not None else None
+        headers = {}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        target = self.resolve(url)
+        if self.guard is not None:
+            response = self.guard.call(self._get, target, headers)
+        else:
+            response = self._get(target, headers)
+
+        if response.status_code == 304 and cached:
+            self.cache.revalidated(key, True)
+            metrics.inc('page_fetches', status='not_modified')
+            return cached['body']
+
+        body = response.text
+        if self.cache is not None:
+            self.cache.put(key, body, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            self.cache.revalidated(key, False)
+        metrics.inc('page_fetches', status='downloaded')
+        metrics.inc('page_bytes', len(response.content))
+        return body
+
+    def close(self):
+        self.session.close()
+
+def _parse_number(text):
+    match = NUMBER_RE.search(text or '')
+    return int(re.sub(r'[. ]', '', match.group(0))) if match else None
+
+def _parse_price(text):
+    match = MILLION_RE.search(text or '')
+    if match:
+        return round(float(match.group(1).replace(',', '.')) * 1_000_000)
+    return _parse_number(text)
+
+def _find_area(*texts):
+    for text in texts:
+        area = tag_area(text)
+        if area:
+            return area
+    return None
+
+class SiteExtractor:
+    """
+    Reads the structured fields of one site's listing pages: the label/value
+    facts table (labels per site) and schema.org JSON-LD where the site has it
+    """
+
+    def __init__(self, labels):
+        # Lowercase label text -> 'sqm', 'rooms', 'price', 'rent' or 'address'
+        self.labels = labels
+
+    def _facts(self, soup):
+        facts = {}
+        for node in soup.find_all(string=True):
+            label = ' '.join(node.strip().rstrip(':').split()).lower()
+            field = self.labels.get(label)
+            if field is None or field in facts:
+                continue
+            value = node.find_next(string=lambda text: text.strip() and text.strip().rstrip(':').lower() != label)
+            if value is not None:
+                facts[field] = value.strip()
+        return facts
+
+    def _json_ld(self, soup):
+        facts = {}
+        for script in soup.find_all('script', type='application/ld+json'):
+            try:
+                data = json.loads(script.string or '')
+            except ValueError:
+                continue
+            for item in data if isinstance(data, list) else [data]:
+                if not isinstance(item, dict):
+                    continue
+                floor_size = item.get('floorSize')
+                if isinstance(floor_size, dict) and floor_size.get('value') is not None:
+                    facts.setdefault('sqm', str(floor_size['value']))
+                if item.get('numberOfRooms') is not None:
+                    facts.setdefault('rooms', str(item['numberOfRooms']))
+                offers = item.get('offers')
+                if isinstance(offers, dict) and offers.get('price') is not None:
+                    facts.setdefault('price', str(offers['price']))
+                address = item.get('address')
+                if isinstance(address, dict):
+                    parts = [address.get('streetAddress'), address.get('postalCode'), address.get('addressLocality')]
+                    facts.setdefault('address', ' '.join(str(p) for p in parts if p))
+        return facts
+
+    def extract(self, html, listing_type):
+        """
+        Returns the fields found on the page (sqm, rooms, area, price_dkk or rent_dkk),
+        fields the page does not state are None
+        """
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, 'html.parser')
+        facts = self._json_ld(soup)
+        for field, value in self._facts(soup).items():
+            facts.setdefault(field, value)
+
+        title = soup.find('meta', property='og:title')
+        title = title.get('content') if title else (soup.title.string if soup.title else '')
+        description = soup.find('meta', attrs={'name': 'description'})
+        description = description.get('content') if description else ''
+
+        price_field = 'price_dkk' if listing_type == 'andelsbolig' else 'rent_dkk'
+        price = facts.get('price') if listing_type == 'andelsbolig' else facts.get('rent') or facts.get('price')
+        fields = {
+            'sqm': _parse_number(facts.get('sqm')),
+            'rooms': _parse_number(facts.get('rooms')),
+            'area': _find_area(facts.get('address'), title),
+            price_field: _parse_price(price),
+        }
+        if fields['sqm'] is not None and not 10 <= fields['sqm'] <= 500:
+            fields['sqm'] = None
+
+        # Whatever the facts did not state, try the page title and description like a snippet
+        fallback = extract_fields({'title': title, 'content': description}, listing_type)
+        for field in fields:
+            if fields[field] is None:
+                fields[field] = fallback.get(field)
+        return fields
+
+DBA_LABELS = {
+    'boligstørrelse': 'sqm', 'boligareal': 'sqm', 'størrelse': 'sqm', 'areal': 'sqm',
+    'antal værelser': 'rooms', 'værelser': 'rooms',
+    'pris': 'price', 'kontantpris': 'price', 'andelspris': 'price',
+    'husleje': 'rent', 'månedlig leje': 'rent', 'leje pr. måned': 'rent',
+    'adresse': 'address', 'beliggenhed': 'address',
+}
+
+BOLIGPORTAL_LABELS = {
+    'størrelse': 'sqm', 'boligareal': 'sqm',
+    'værelser': 'rooms', 'antal værelser': 'rooms',
+    'månedlig leje': 'rent', 'husleje': 'rent', 'leje': 'rent',
+    'adresse': 'address',
+}
+
+LEJEBOLIG_LABELS = {
+    'areal': 'sqm', 'boligareal': 'sqm', 'størrelse': 'sqm',
+    'værelser': 'rooms', 'antal værelser': 'rooms',
+    'husleje': 'rent', 'månedlig husleje': 'rent', 'leje': 'rent',
+    'adresse': 'address', 'by': 'address',
+}
+
+# Sites whose listing pages are fetched, by normalized host
+EXTRACTORS = {
+    'dba.dk': SiteExtractor(DBA_LABELS),
+    'boligportal.dk': SiteExtractor(BOLIGPORTAL_LABELS),
+    'lejebolig.dk': SiteExtractor(LEJEBOLIG_LABELS),
+}
+
+def _page_note(fields, listing_type):
+    """Short line with the page facts, prepended to the content the model sees."""
+    price = fields.get('price_dkk' if listing_type == 'andelsbolig' else 'rent_dkk')
+    parts = []
+    if fields.get('sqm') is not None:
+        parts.append(f"{fields['sqm']} m²")
+    if fields.get('rooms') is not None:
+        parts.append(f"{fields['rooms']} vær.")
+    if price is not None:
+        parts.append(f"{price:,} kr.".replace(',', '.'))
+    if fields.get('area'):
+        parts.append(fields['area'])
+    return f"Fra annoncesiden: {', '.join(parts)}." if parts else ''
+
+def _fetch_fields(fetcher, result, listing_type):
+    url = result['url']
+    try:
+        html = fetcher.fetch(url)
+        return EXTRACTORS[listing_domain(url)].extract(html, listing_type)
+    except Exception as e:
+        metrics.inc('page_errors', site=listing_domain(url))
+        logger.warning("Kunne ikke hente annoncesiden %s: %s", url, e)
+        return None
+
+@timed('enrich_listings')
+def enrich_results(results, listing_type, criteria=DEFAULT_CRITERIA, fetcher=None):
+    """
+    Fetch the listing pages of ambiguous results from the supported sites and
+    fill in the fields the snippet lacked. Results are re-classified: some are
+    confirmed or rejected locally and never reach the model.
+    """
+    if not results or not results.get('results'):
+        return results
+    fetcher = fetcher or get_page_fetcher()
+    if fetcher is None:
+        return results
+
+    items = list(results['results'])
+    targets = [
+        index for index, result in enumerate(items)
+        if result.get('match') == AMBIGUOUS and listing_domain(result.get('url', '')) in EXTRACTORS
+    ]
+    if not targets:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(1, env_int('ENRICH_CONCURRENCY', ENRICH_CONCURRENCY))) as executor:
+        page_fields = list(executor.map(lambda index: _fetch_fields(fetcher, items[index], listing_type), targets))
+
+    for index, fields in zip(targets, page_fields):
+        if not fields:
+            continue
+        result = items[index]
+        merged = dict(result.get('extracted') or {})
+        for field, value in fields.items():
+            if merged.get(field) is None and value is not None:
+                merged[field] = value
+        status = classify_fields(merged, listing_type, criteria)
+        metrics.inc('listings_enriched', status=status)
+        note = _page_note(fields, listing_type)
+        content = f"{note} {result.get('content') or ''}".strip() if note else result.get('content')
+        items[index] = dict(result, content=content, match=status, extracted=merged)
+
+    kept = [result for result in items if result.get('match') != REJECTED]
+    logger.info("Berigede %d annoncer fra annoncesiderne, %d fravalgt", len(targets), len(items) - len(kept))
+    return {'results': kept}
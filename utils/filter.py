@@ -1,4 +1,155 @@
-from urllib.parse import urlparse
+import re
+from urllib.parse import urlparse, unquote, parse_qsl, urlencode
+from .gazetteer import AREAS, tag_area
+
+# Define target areas
+TARGET_AREAS = ["Vesterbro", "Østerbro", "Frederiksberg", "Indre by", "Nørrebro", "Valby", "Christianshavn"]
+
+# Search criteria
+MIN_SQM = 45
+MAX_SQM = 140
+MAX_ANDELSBOLIG_PRICE = 3_000_000
+MAX_RENT = 20_000
+
+# Words in the description that mean the listing is no longer available
+EXCLUDED_STATUS = {
+    'andelsbolig': re.compile(r'\b(solgt|reserveret|overtaget)\b', re.IGNORECASE),
+    'lejebolig': re.compile(r'\b(udlejet)\b', re.IGNORECASE),
+}
+
+SQM_RE = re.compile(r'(?<!\d)(\d{2,3})\s*(?:m2|m²|kvm|kvadratmeter)', re.IGNORECASE)
+ROOMS_RE = re.compile(r'(?<!\d)(\d{1,2})\s*[-.]?\s*(?:værelses|værelser|vær|vaer|rum)', re.IGNORECASE)
+MILLION_RE = re.compile(r'(?<![\d.,])(\d{1,2}(?:[.,]\d{1,3})?)\s*(?:mio|million)', re.IGNORECASE)
+AMOUNT_RE = re.compile(r'(?<![\d.,])(\d{1,3}(?:[. ]\d{3})+|\d{4,7})(?:,-|,00)?\s*(?:kr|dkk|,-)', re.IGNORECASE)
+
+# What an amount is, from the last label before it: rent, or a one-off or extra
+# payment. "3 mdr. husleje" is a deposit counted in months of rent.
+RENT_LABEL_RE = re.compile(
+    r'\b(depositum|forudbetalt(?:\s+leje)?|a\s?conto|indskud|\d+\s*(?:mdr\.?|måneders)\s+(?:hus)?leje|husleje|leje)\b',
+    re.IGNORECASE
+)
+NOT_RENT_LABELS = ('depositum', 'forudbetalt', 'aconto', 'a conto', 'indskud')
+PER_MONTH_RE = re.compile(r'\.?\s*(?:pr\.?\s*(?:md|mdr|måned)\b|/\s*(?:md|mdr|måned)\b|om\s+måneden|månedlig)', re.IGNORECASE)
+# What an andelsbolig amount is, from the last label before it: the price or
+# another value of the property or a monthly cost
+PRICE_LABEL_RE = re.compile(
+    r'\b(kontantpris|andelspris|udbudspris|pris(?:en)?|vurder\w*|ejendomsværdi|boligafgift|ydelse|fællesgæld)\b',
+    re.IGNORECASE
+)
+PRICE_LABELS = ('kontantpris', 'andelspris', 'udbudspris', 'pris')
+# How far before an amount its label may be
+LABEL_WINDOW = 40
+
+# A street name and house number like "Istedgade 12" or "Nørrebrogade 7B"
+ADDRESS_RE = re.compile(
+    r'\b([a-zæøå]+(?:gade|vej|allé|alle|boulevard|stræde|straede|plads|torv|vænge|have|park|kaj))\s+(\d{1,3}[a-z]?)\b',
+    re.IGNORECASE
+)
+
+# Domains we accept listings from per listing type
+VALID_DOMAINS = {
+    'andelsbolig': ['dba.dk', 'facebook.com', 'andelsbolig.dk'],
+    'lejebolig': ['boligportal.dk', 'lejebolig.dk', 'dba.dk', 'facebook.com'],
+}
+
+# Host prefixes that point to the same site
+HOST_PREFIXES = ('www.', 'm.', 'mobile.', 'web.')
+
+# Query parameters that identify a listing, everything else is tracking or paging noise
+LISTING_QUERY_PARAMS = {'id', 'aid', 'listingid'}
+
+class Criteria:
+    """
+    Search criteria of one profile: allowed areas, sqm range, price and rent caps
+    and optionally allowed room counts. Unknown listing fields never fail a criterion.
+    """
+
+    __slots__ = ('areas', 'min_sqm', 'max_sqm', 'max_price', 'max_rent', 'rooms')
+
+    def __init__(self, areas=None, min_sqm=MIN_SQM, max_sqm=MAX_SQM,
+                 max_price=MAX_ANDELSBOLIG_PRICE, max_rent=MAX_RENT, rooms=None):
+        unknown = [area for area in areas or [] if area not in AREAS]
+        if unknown:
+            raise ValueError(f"Ukendte områder: {', '.join(unknown)}")
+        self.areas = tuple(areas or TARGET_AREAS)
+        self.min_sqm = min_sqm
+        self.max_sqm = max_sqm
+        self.max_price = max_price
+        self.max_rent = max_rent
+        self.rooms = tuple(sorted(set(rooms))) if rooms else None
+
+    def _key(self):
+        return (self.areas, self.min_sqm, self.max_sqm, self.max_price, self.max_rent, self.rooms)
+
+    def __eq__(self, other):
+        return isinstance(other, Criteria) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return f"Criteria{self._key()!r}"
+
+    def price_limit(self, listing_type):
+        return self.max_price if listing_type == 'andelsbolig' else self.max_rent
+
+    @classmethod
+    def union(cls, criteria):
+        """The loosest criteria that let through every listing any of criteria would."""
+        criteria = list(criteria)
+        if not criteria:
+            return cls()
+        areas = [area for area in AREAS if any(area in c.areas for c in criteria)]
+        rooms = None
+        if all(c.rooms for c in criteria):
+            rooms = {room for c in criteria for room in c.rooms}
+        return cls(
+            areas=areas,
+            min_sqm=min(c.min_sqm for c in criteria),
+            max_sqm=max(c.max_sqm for c in criteria),
+            max_price=max(c.max_price for c in criteria),
+            max_rent=max(c.max_rent for c in criteria),
+            rooms=rooms,
+        )
+
+    def matches(self, sqm, price, area, rooms, listing_type):
+        """Checks known values against the criteria, None always passes."""
+        if sqm is not None and not self.min_sqm <= sqm <= self.max_sqm:
+            return False
+        if price is not None and price > self.price_limit(listing_type):
+            return False
+        if area is not None and area not in self.areas:
+            return False
+        if rooms is not None and self.rooms and rooms not in self.rooms:
+            return False
+        return True
+
+def record_fields(record, listing_type):
+    """
+    The (sqm, price, area, rooms) of an output record (local or from the model)
+    as Criteria.matches and SubscriptionIndex.match take them
+    """
+    price_field = 'price_dkk' if listing_type == 'andelsbolig' else 'rent_dkk'
+    return record.get('sqm'), record.get(price_field), normalize_area(record.get('area')), record.get('rooms')
+
+def normalize_area(name):
+    """
+    Maps an area name or alias (e.g. "København Ø") to its target area, a district
+    outside them (e.g. "Vanløse") to that district so the criteria reject it,
+    and unknown names to None.
+    """
+    if not name:
+        return None
+    if name in AREAS:
+        return name
+    return tag_area(name)
+
+DEFAULT_CRITERIA = Criteria()
+
+# Results of the local rule engine
+REJECTED = 'rejected'
+CONFIRMED = 'confirmed'
+AMBIGUOUS = 'ambiguous'
 
 def validate_listing_url(url, listing_type):
     """
@@ -6,35 +157,223 @@ def validate_listing_url(url, listing_type):
     """
     # Invalid patterns that indicate search pages or invalid listings
     invalid_patterns = [
-        '/search', '/soeg', '?soeg=', '/item/',
-        'boligportal.dk/lejeboliger/',  # Main category page
-        'lejebolig.dk/lejebolig/',      # Main category page
-        'dba.dk/andelsbolig/',          # Main category page
+        '/search', '/soeg', '?soeg=',
         '/marketplace/search/',          # Facebook search page
         'category', 'categories',
         'side-', 'page-'
     ]
-    
+
+    # Main category pages, only invalid when they are the whole path
+    category_pages = [
+        'boligportal.dk/lejeboliger',
+        'boligportal.dk/lejligheder',
+        'boligportal.dk/lejligheder/københavn',
+        'lejebolig.dk/lejebolig',
+        'dba.dk/andelsbolig',
+        'dba.dk/lejebolig',
+        'facebook.com/marketplace',
+    ]
+
     # Check for invalid patterns
     if any(pattern in url.lower() for pattern in invalid_patterns):
         return False
-        
+
+    if canonical_url(url) in category_pages:
+        return False
+
     # Verify the URL matches the listing type
+    return listing_domain(url) in VALID_DOMAINS[listing_type]
+
+def _parse_amount(text):
+    return int(re.sub(r'[. ]', '', text))
+
+def _find_rent(text):
+    """
+    The monthly rent: an amount labelled husleje/leje or followed by "pr. md."/"/md".
+    Amounts labelled depositum, forudbetalt leje or aconto are skipped. None if no
+    amount is labelled as rent or the labelled amounts disagree, so an unclear text
+    is left to the model instead of failing the rent cap.
+    """
+    rents = set()
+    previous_end = 0
+    for match in AMOUNT_RE.finditer(text):
+        window = text[max(previous_end, match.start() - LABEL_WINDOW):match.start()]
+        previous_end = match.end()
+        labels = RENT_LABEL_RE.findall(window)
+        label = re.sub(r'\s+', ' ', labels[-1].lower()) if labels else None
+        if label is not None and (label.startswith(NOT_RENT_LABELS) or label[0].isdigit()):
+            continue
+        if label is None and not PER_MONTH_RE.match(text, match.end()):
+            continue
+        amount = _parse_amount(match.group(1))
+        if 2_000 <= amount < 100_000:
+            rents.add(amount)
+    return rents.pop() if len(rents) == 1 else None
+
+def _find_price(text):
+    """
+    The andelsbolig price: an amount labelled pris, kontantpris or andelspris, in
+    text order. Amounts labelled vurdering, ejendomsværdi or boligafgift and
+    unlabelled amounts are skipped. None if no amount is labelled as the price or
+    the labelled amounts disagree, so an unclear text is left to the model.
+    """
+    amounts = [(m.start(), m.end(), _parse_amount(m.group(1))) for m in AMOUNT_RE.finditer(text)]
+    amounts += [
+        (m.start(), m.end(), round(float(m.group(1).replace(',', '.')) * 1_000_000))
+        for m in MILLION_RE.finditer(text)
+    ]
+    prices = set()
+    previous_end = 0
+    for start, end, amount in sorted(amounts):
+        window = text[max(previous_end, start - LABEL_WINDOW):start]
+        previous_end = end
+        labels = PRICE_LABEL_RE.findall(window)
+        if not labels or not labels[-1].lower().startswith(PRICE_LABELS):
+            continue
+        if amount >= 100_000:
+            prices.add(amount)
+    return prices.pop() if len(prices) == 1 else None
+
+def find_address(text):
+    """
+    The first street name and house number in the text, as written, or None
+    """
+    match = ADDRESS_RE.search(text or '')
+    return ' '.join(match.groups()) if match else None
+
+def extract_fields(result, listing_type):
+    """
+    Extract sqm, price/rent, rooms, area and status from a Tavily result's title and content
+    """
+    text = f"{result.get('title', '')}\n{result.get('content', '')}"
+    fields = {'sqm': None, 'rooms': None, 'area': None, 'excluded': None}
+
+    for match in SQM_RE.finditer(text):
+        sqm = int(match.group(1))
+        if 10 <= sqm <= 500:
+            fields['sqm'] = sqm
+            break
+
+    match = ROOMS_RE.search(text)
+    if match:
+        fields['rooms'] = int(match.group(1))
+
     if listing_type == 'andelsbolig':
-        valid_domains = ['dba.dk', 'facebook.com', 'andelsbolig.dk']
-    else:  # lejebolig
-        valid_domains = ['boligportal.dk', 'lejebolig.dk', 'dba.dk', 'facebook.com']
-    
-    # Extract domain from URL
-    domain = urlparse(url).netloc.replace('www.', '')
-    
-    return domain in valid_domains
+        fields['price_dkk'] = _find_price(text)
+    else:
+        fields['rent_dkk'] = _find_rent(text)
+
+    # The first area mentioned, so the title wins over areas named in the description
+    fields['area'] = tag_area(text)
+
+    match = EXCLUDED_STATUS[listing_type].search(text)
+    if match:
+        fields['excluded'] = match.group(1).lower()
+
+    return fields
 
-def filter_tavily_results(results, listing_type):
+def classify_result(result, listing_type, criteria=DEFAULT_CRITERIA):
     """
-    Pre-filter Tavily results before sending to OpenAI
+    Check a Tavily result against the search criteria.
+    Returns (status, fields) where status is REJECTED, CONFIRMED or AMBIGUOUS.
+    """
+    if not validate_listing_url(result.get('url', ''), listing_type):
+        return REJECTED, {}
+
+    fields = extract_fields(result, listing_type)
+    return classify_fields(fields, listing_type, criteria), fields
+
+def classify_fields(fields, listing_type, criteria=DEFAULT_CRITERIA):
+    """
+    Check extracted fields against the search criteria, returns REJECTED, CONFIRMED or AMBIGUOUS
+    """
+    if fields.get('excluded'):
+        return REJECTED
+
+    sqm = fields.get('sqm')
+    price = fields.get('price_dkk') if listing_type == 'andelsbolig' else fields.get('rent_dkk')
+    if not criteria.matches(sqm, price, fields.get('area'), fields.get('rooms'), listing_type):
+        return REJECTED
+
+    if sqm is None or price is None or fields.get('area') is None:
+        return AMBIGUOUS
+    return CONFIRMED
+
+def build_local_record(result, listing_type, fields):
+    """
+    Build an output record for a confirmed listing without asking the model
+    """
+    title = (result.get('title') or '').strip()
+    record = {
+        # Only a real street address, a title is no key for spotting the same apartment
+        "address": find_address(f"{title}\n{result.get('content') or ''}"),
+        "sqm": fields['sqm'],
+        "url": result.get('url'),
+        "source": listing_domain(result.get('url', '')),
+        "area": fields['area'],
+        "rooms": fields['rooms'],
+        "key_features": title,
+        "missing_fields": [],
+    }
+    if listing_type == 'andelsbolig':
+        record["price_dkk"] = fields['price_dkk']
+    else:
+        record["rent_dkk"] = fields['rent_dkk']
+    return record
+
+def filter_tavily_results(results, listing_type, criteria=DEFAULT_CRITERIA):
+    """
+    Pre-filter Tavily results before sending to OpenAI.
+    Drops listings that clearly fail the criteria and tags the rest with
+    'match' (confirmed or ambiguous) and the locally 'extracted' fields.
     """
     if not results or 'results' not in results:
         return results
-        
-    return results  # Return all results without filtering
\ No newline at end of file
+
+    filtered_results = []
+    for result in results['results']:
+        status, fields = classify_result(result, listing_type, criteria)
+        if status == REJECTED:
+            continue
+        filtered_results.append(dict(result, match=status, extracted=fields))
+
+    return {'results': filtered_results}
+
+def split_by_match(results):
+    """
+    Split filtered results into (confirmed, ambiguous) lists
+    """
+    confirmed, ambiguous = [], []
+    for result in (results or {}).get('results', []):
+        if result.get('match') == CONFIRMED:
+            confirmed.append(result)
+        else:
+            ambiguous.append(result)
+    return confirmed, ambiguous
+
+def listing_domain(url):
+    """
+    Return the normalized host of a URL, without www./m. prefixes and port
+    """
+    host = urlparse(url.strip()).netloc.lower().split('@')[-1].split(':')[0]
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    return host
+
+def canonical_url(url):
+    """
+    Normalize a listing URL so the same listing maps to the same key.
+    Drops scheme, host prefixes, fragments, trailing slashes and query
+    parameters that do not identify the listing.
+    """
+    parsed = urlparse(url.strip())
+    path = unquote(parsed.path).lower().rstrip('/')
+    params = sorted(
+        (key.lower(), value)
+        for key, value in parse_qsl(parsed.query)
+        if key.lower() in LISTING_QUERY_PARAMS
+    )
+    query = f"?{urlencode(params)}" if params else ''
+    return f"{listing_domain(url)}{path}{query}"
@@ -0,0 +1,239 @@
+import re
+from collections import deque
+from functools import lru_cache
+
+# Postcodes, district names and neighbourhoods per target area. Street names
+# are left out since many streets run through several areas. Spelling variants
+# (ø/oe/o, æ/ae, å/aa) and the "kbh"/"cph" short forms are generated.
+AREAS = {
+    "Vesterbro": {
+        'postcodes': [(1500, 1799)],
+        'aliases': ["vesterbro", "københavn v", "kødbyen", "enghave plads", "halmtorvet", "vesterbros torv",
+                    "skydebanehaven", "carlsberg byen"],
+    },
+    "Østerbro": {
+        'postcodes': [(2100, 2100), (2150, 2150)],
+        'aliases': ["østerbro", "københavn ø", "nordhavn", "svanemøllen", "trianglen", "kartoffelrækkerne",
+                    "fælledparken", "sankt jakobs plads"],
+    },
+    "Frederiksberg": {
+        'postcodes': [(1800, 1999), (2000, 2000)],
+        'aliases': ["frederiksberg", "frederiksberg c", "flintholm", "frederiksberg have"],
+    },
+    "Indre by": {
+        'postcodes': [(1050, 1399), (1450, 1499)],
+        'aliases': ["indre by", "københavn k", "nyhavn", "latinerkvarteret", "kongens nytorv",
+                    "nørreport", "pisserenden", "middelalderbyen"],
+    },
+    "Nørrebro": {
+        'postcodes': [(2200, 2200)],
+        'aliases': ["nørrebro", "københavn n", "nørrebros runddel", "blågårds plads", "sankt hans torv",
+                    "assistens kirkegård", "superkilen"],
+    },
+    "Valby": {
+        'postcodes': [(2500, 2500)],
+        'aliases': ["valby", "toftegårds plads", "ny ellebjerg"],
+    },
+    "Christianshavn": {
+        'postcodes': [(1400, 1449)],
+        'aliases': ["christianshavn", "christiania", "holmen", "christianshavns torv", "overgaden"],
+    },
+}
+
+# Districts next to the target areas. A listing that only names these is tagged
+# with the district and rejected; one that also names a target area is left to
+# the model.
+OUTSIDE_AREAS = {
+    "Amager": {
+        'postcodes': [(2300, 2300)],
+        'aliases': ["amager", "amagerbro", "københavn s", "islands brygge", "ørestad"],
+    },
+    "Hellerup": {
+        'postcodes': [(2900, 2900)],
+        'aliases': ["hellerup"],
+    },
+    "Brønshøj": {
+        'postcodes': [(2700, 2700)],
+        'aliases': ["brønshøj", "husum"],
+    },
+    "Vanløse": {
+        'postcodes': [(2720, 2720)],
+        'aliases': ["vanløse"],
+    },
+    "Nordvest": {
+        'postcodes': [(2400, 2400)],
+        'aliases': ["nordvest", "københavn nv", "bispebjerg"],
+    },
+    "Sydhavn": {
+        'postcodes': [(2450, 2450)],
+        'aliases': ["sydhavn", "sydhavnen", "københavn sv"],
+    },
+}
+
+# "København V" is also written "Kbh. V", "Kbh V" and "Cph V"
+CITY_FORMS = ("københavn", "kbh.", "kbh", "cph")
+
+# Danish letters and their ASCII spellings
+LETTER_VARIANTS = {'ø': ('oe', 'o'), 'æ': ('ae',), 'å': ('aa', 'a'), 'é': ('e',)}
+
+# A number is only read as a postcode when the next word is a city or district
+# ("2100 København Ø", "1850 Frederiksberg C") or it is written "DK-2100"
+POSTCODE_CITIES = CITY_FORMS + ("copenhagen",)
+NEXT_WORD_RE = re.compile(r'\s+(\w+)')
+
+# Words before a number that make it a year ("opført i 1932"), not a postcode
+YEAR_WORDS = ("opført", "opført i", "bygget", "bygget i", "fra", "i år")
+
+# Words before an area that place the listing near it, not in it ("10 min til Christianshavn")
+NEAR_WORDS = ("til", "tæt på", "nær", "nærheden af", "ved siden af")
+
+def spelling_variants(alias):
+    """The alias with every combination of Danish letters and their ASCII spellings."""
+    variants = {''}
+    for char in alias:
+        options = (char,) + LETTER_VARIANTS.get(char, ())
+        variants = {variant + option for variant in variants for option in options}
+    return variants
+
+def _alias_variants(alias):
+    forms = {alias}
+    for city in CITY_FORMS[1:]:
+        if alias.startswith(CITY_FORMS[0] + ' '):
+            forms.add(city + alias[len(CITY_FORMS[0]):])
+    return {variant for form in forms for variant in spelling_variants(form)}
+
+def _is_word_char(char):
+    return char.isalnum()
+
+def _preceded_by(text, start, phrases):
+    """True if one of phrases is the whole word(s) right before text[start:]."""
+    before = text[max(0, start - 24):start].rstrip()
+    for phrase in phrases:
+        if before.endswith(phrase) and (len(before) == len(phrase) or not _is_word_char(before[-len(phrase) - 1])):
+            return True
+    return False
+
+class Gazetteer:
+    """
+    Aho–Corasick automaton over every alias and postcode of the areas and the
+    districts outside them. One pass over a lowercased text finds all
+    whole-word mentions.
+    """
+
+    def __init__(self, areas=AREAS, outside=OUTSIDE_AREAS):
+        self.areas = list(areas)
+        self.outside = set(outside)
+        # Trie as parallel lists: goto transitions, failure links, outputs (length, area, is_postcode)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        cities = set(POSTCODE_CITIES)
+        for area, entry in list(areas.items()) + list(outside.items()):
+            for alias in entry['aliases']:
+                for variant in _alias_variants(alias):
+                    self._add(variant, area, False)
+                    cities.add(variant.split()[0])
+            for first, last in entry['postcodes']:
+                for postcode in range(first, last + 1):
+                    self._add(str(postcode), area, True)
+        self._cities = frozenset(cities)
+        self._near_words = {variant for phrase in NEAR_WORDS for variant in spelling_variants(phrase)}
+        self._link()
+
+    def _add(self, pattern, area, is_postcode):
+        node = 0
+        for char in pattern:
+            following = self._goto[node].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto[node][char] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = following
+        if all(output[0] != len(pattern) for output in self._out[node]):
+            self._out[node].append((len(pattern), area, is_postcode))
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, following in self._goto[node].items():
+                queue.append(following)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[following] = target if target != following else 0
+                self._out[following] = self._out[following] + self._out[self._fail[following]]
+        # Fold the failure links into the transitions (a DFA), so matching is one lookup per character
+        self._delta = [dict(transitions) for transitions in self._goto]
+        order = deque(self._goto[0].values())
+        while order:
+            node = order.popleft()
+            order.extend(self._goto[node].values())
+            for char, following in self._delta[self._fail[node]].items():
+                self._delta[node].setdefault(char, following)
+
+    def find_all(self, text):
+        """
+        All whole-word mentions of the areas and the districts outside them in
+        text as (start, end, area), in text order. Numbers that are not written
+        as a postcode ("2100 kr", "opført i 1932") and areas the listing is only
+        near ("10 min til Christianshavn") are skipped.
+        """
+        text = (text or '').lower()
+        delta, out = self._delta, self._out
+        mentions = []
+        node = 0
+        for index, char in enumerate(text):
+            node = delta[node].get(char, 0)
+            if not out[node]:
+                continue
+            for length, area, is_postcode in out[node]:
+                start, end = index - length + 1, index + 1
+                if start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if end < len(text) and _is_word_char(text[end]):
+                    continue
+                if is_postcode and not self._is_postcode(text, start, end):
+                    continue
+                if _preceded_by(text, start, self._near_words):
+                    continue
+                mentions.append((start, end, area))
+        mentions.sort(key=lambda mention: (mention[0], mention[0] - mention[1]))
+        return mentions
+
+    def _is_postcode(self, text, start, end):
+        if text[max(0, start - 3):start] == 'dk-':
+            return True
+        if start > 0 and text[start - 1] in '.,' or _preceded_by(text, start, YEAR_WORDS):
+            return False
+        following = NEXT_WORD_RE.match(text, end)
+        return following is not None and following.group(1) in self._cities
+
+    def tag(self, text):
+        """
+        The area of the first mention in text (longest at that position). That is
+        a district outside the target areas if only those are mentioned, so the
+        criteria reject it, and None if there is no mention or a mix of both.
+        """
+        mentions = self.find_all(text)
+        if not mentions:
+            return None
+        outside = [area in self.outside for _, _, area in mentions]
+        if any(outside) and not all(outside):
+            return None
+        return mentions[0][2]
+
+@lru_cache(maxsize=1)
+def get_gazetteer():
+    """The gazetteer of AREAS, compiled on first use."""
+    return Gazetteer()
+
+def tag_area(text):
+    return get_gazetteer().tag(text)
+
+def area_spans(text):
+    """(start, end) of every area mention, for keeping those parts of a snippet."""
+    return [(start, end) for start, end, _ in get_gazetteer().find_all(text)]
@@ -1,69 +1,127 @@
 import os
 import base64
 import pickle
+import logging
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from email.message import EmailMessage
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from email.header import Header
+
+logger = logging.getLogger(__name__)
 
 class GmailSender:
     def __init__(self):
         self.SCOPES = ['https://www.googleapis.com/auth/gmail.send']
         self.credentials_path = os.path.join(os.path.dirname(__file__), '..', 'credentials')
-        os.makedirs(self.credentials_path, exist_ok=True)
         self.token_path = os.path.join(self.credentials_path, 'token.pickle')
         self.credentials_file = os.path.join(self.credentials_path, 'credentials.json')
+        self._creds = None
+        self._creds_lock = threading.Lock()
+        # googleapiclient services are not thread-safe, so a send checks one out of
+        # this pool and returns it. Built services outlive the senders' worker threads.
+        self._services = []
+        self._services_lock = threading.Lock()
 
-    def get_gmail_service(self):
-        """Gets Gmail API service using stored credentials or new OAuth flow."""
-        creds = None
-        
-        # Load existing token if it exists
-        if os.path.exists(self.token_path):
-            with open(self.token_path, 'rb') as token:
-                creds = pickle.load(token)
-        
-        # If credentials don't exist or are invalid, get new ones
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                if not os.path.exists(self.credentials_file):
-                    raise FileNotFoundError(
-                        f"Missing credentials.json file. Please download it from Google Cloud Console "
-                        f"and place it in {self.credentials_file}"
-                    )
-                flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, self.SCOPES)
-                creds = flow.run_local_server(port=0)
-            
-            # Save the credentials for future use
-            with open(self.token_path, 'wb') as token:
-                pickle.dump(creds, token)
-
-        return build('gmail', 'v1', credentials=creds)
+    def get_credentials(self):
+        """Returns cached credentials, loading or refreshing them only when needed."""
+        # The Google client libraries are slow to import, so only pay for them when sending
+        from google.auth.transport.requests import Request
+        from google_auth_oauthlib.flow import InstalledAppFlow
 
-    def send_email(self, to_email, subject, html_content):
-        """Sends an email using Gmail API."""
+        with self._creds_lock:
+            creds = self._creds
+
+            # Load existing token if it exists
+            if creds is None and os.path.exists(self.token_path):
+                with open(self.token_path, 'rb') as token:
+                    creds = pickle.load(token)
+
+            # If credentials don't exist or are invalid, get new ones
+            if not creds or not creds.valid:
+                if creds and creds.expired and creds.refresh_token:
+                    creds.refresh(Request())
+                else:
+                    if not os.path.exists(self.credentials_file):
+                        raise FileNotFoundError(
+                            f"Missing credentials.json file. Please download it from Google Cloud Console "
+                            f"and place it in {self.credentials_file}"
+                        )
+                    flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, self.SCOPES)
+                    creds = flow.run_local_server(port=0)
+
+                # Save the credentials for future use
+                os.makedirs(self.credentials_path, exist_ok=True)
+                with open(self.token_path, 'wb') as token:
+                    pickle.dump(creds, token)
+
+            self._creds = creds
+            return creds
+
+    def get_gmail_service(self, creds=None):
+        """Builds a Gmail API service using stored credentials or new OAuth flow."""
+        from googleapiclient.discovery import build
+
+        return build('gmail', 'v1', credentials=creds or self.get_credentials(), cache_discovery=False)
+
+    @contextmanager
+    def checkout_service(self):
+        """
+        Lends a Gmail API service to one caller at a time, building one only when
+        all are in use. Services built with replaced credentials are dropped.
+        """
+        creds = self.get_credentials()
+        service = None
+        with self._services_lock:
+            while self._services and service is None:
+                pooled, pooled_creds = self._services.pop()
+                if pooled_creds is creds:
+                    service = pooled
+        if service is None:
+            service = self.get_gmail_service(creds)
         try:
-            service = self.get_gmail_service()
-            
-            message = EmailMessage()
-            message["To"] = to_email
-            message["From"] = os.getenv('EMAIL_ADDRESS')
-            message["Subject"] = subject
-            message.add_alternative(html_content, subtype='html')
-
-            encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-            
-            sent_message = service.users().messages().send(
-                userId="me",
-                body={"raw": encoded_message}
-            ).execute()
-            
-            print(f"Email sent successfully to {to_email}")
+            yield service
+        finally:
+            with self._services_lock:
+                self._services.append((service, creds))
+
+    def prepare_message(self, subject, html_content):
+        """
+        Serializes the message once without a To header, so it can be reused
+        for every recipient by prepending the header bytes.
+        """
+        message = EmailMessage()
+        message["From"] = os.getenv('EMAIL_ADDRESS')
+        message["Subject"] = subject
+        message.add_alternative(html_content, subtype='html')
+        return message.as_bytes()
+
+    @staticmethod
+    def format_recipient(to_email, name=None):
+        """Formats the To header value, encoding non-ASCII display names."""
+        if not name:
+            return to_email
+        return f"{Header(name, 'utf-8').encode()} <{to_email}>"
+
+    def send_prepared(self, to_email, message_bytes, name=None):
+        """Sends a message from prepare_message to a single recipient."""
+        try:
+            to_header = f"To: {self.format_recipient(to_email, name)}\n".encode('utf-8')
+            encoded_message = base64.urlsafe_b64encode(to_header + message_bytes).decode()
+
+            with self.checkout_service() as service:
+                sent_message = service.users().messages().send(
+                    userId="me",
+                    body={"raw": encoded_message}
+                ).execute()
+
+            logger.debug("Gmail API: email sendt til %s", to_email)
             return sent_message
-            
+
         except Exception as e:
-            print(f"Error sending email via Gmail API: {str(e)}")
-            raise 
\ No newline at end of file
+            logger.error("Error sending email via Gmail API: %s", e)
+            raise
+
+    def send_email(self, to_email, subject, html_content):
+        """Sends an email using Gmail API."""
+        return self.send_prepared(to_email, self.prepare_message(subject, html_content))
@@ -0,0 +1,63 @@
+from .filter import canonical_url
+
+class Listing:
+    """
+    Compact record of a single search result
+    """
+    __slots__ = ('key', 'url', 'title', 'content', 'listing_type', 'match', 'extracted')
+
+    def __init__(self, url, title='', content='', listing_type=None, match=None, extracted=None):
+        self.key = canonical_url(url)
+        self.url = url
+        self.title = title or ''
+        self.content = content or ''
+        self.listing_type = listing_type
+        self.match = match
+        self.extracted = extracted
+
+    @classmethod
+    def from_result(cls, result, listing_type=None):
+        """Creates a Listing from a filtered Tavily result dict."""
+        return cls(
+            result.get('url', ''),
+            result.get('title'),
+            result.get('content'),
+            listing_type,
+            result.get('match'),
+            result.get('extracted'),
+        )
+
+    def to_result(self):
+        """Returns the result dict used by the rest of the pipeline."""
+        result = {'url': self.url, 'title': self.title, 'content': self.content}
+        if self.match is not None:
+            result['match'] = self.match
+            result['extracted'] = self.extracted
+        return result
+
+    def __repr__(self):
+        return f"Listing({self.key!r})"
+
+def dedupe_results(results, listing_type=None):
+    """
+    Collapse results that point to the same listing, keeping the first occurrence
+    in order and the result with the longest content for it.
+    Returns (unique_results, duplicate_count).
+    """
+    index = {}
+    for result in results:
+        if not result.get('url'):
+            continue
+        listing = Listing.from_result(result, listing_type)
+        existing = index.get(listing.key)
+        if existing is None:
+            index[listing.key] = listing
+        elif len(listing.content) > len(existing.content):
+            existing.url = listing.url
+            existing.title = listing.title
+            existing.content = listing.content
+            existing.match = listing.match
+            existing.extracted = listing.extracted
+
+    unique = [listing.to_result() for listing in index.values()]
+    return unique, len(results) - len(unique)
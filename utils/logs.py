@@ -0,0 +1,135 @@
+import os
+import copy
+import json
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Log file and its rotation (env LOG_PATH, LOG_MAX_BYTES, LOG_BACKUP_COUNT)
+LOG_FILE = 'apartment_search.log'
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+
+# Loggers of this application, the ones verbose mode turns to DEBUG (SDKs stay at the root level)
+APP_LOGGERS = ('main', 'daemon', 'utils')
+
+_lock = threading.Lock()
+_listener = None
+_handler = None
+_verbose = False
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger and message, plus the
+    fields passed as extra={'fields': {...}} and the traceback if any
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """The plain text format with the extra fields appended as key=value."""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queues records as they are, so the message is formatted on the listener
+    thread and not by the caller. Arguments must not be changed after logging.
+    """
+
+    def prepare(self, record):
+        return copy.copy(record)
+
+class LazyJson:
+    """Serializes value to indented JSON only when the log record is formatted."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        if isinstance(self.value, str):
+            return self.value
+        return json.dumps(self.value, indent=2, ensure_ascii=False, default=str)
+
+def setup_logging(path=None, level=None, verbose=None, json_format=None):
+    """
+    Sends all logging through a queue to a size-rotated file written by a
+    background thread. level, verbose and json_format default to the env
+    LOG_LEVEL (INFO), LOG_VERBOSE and LOG_FORMAT=json. Verbose logs the
+    application at DEBUG including the raw payload dumps. Returns the listener.
+    """
+    global _listener, _handler, _verbose
+    with _lock:
+        if _listener is not None:
+            return _listener
+        if verbose is None:
+            verbose = os.getenv('LOG_VERBOSE', '').lower() in ('1', 'true', 'yes')
+        _verbose = verbose
+        level = level or os.getenv('LOG_LEVEL', 'INFO').upper()
+        if json_format is None:
+            json_format = os.getenv('LOG_FORMAT', '').lower() == 'json'
+
+        path = path or os.getenv('LOG_PATH', LOG_FILE)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file_handler = RotatingFileHandler(
+            path,
+            maxBytes=int(os.getenv('LOG_MAX_BYTES', LOG_MAX_BYTES)),
+            backupCount=int(os.getenv('LOG_BACKUP_COUNT', LOG_BACKUP_COUNT)),
+            encoding='utf-8',
+        )
+        file_handler.setFormatter(JsonFormatter() if json_format else TextFormatter(TEXT_FORMAT))
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        root.setLevel(level)
+        _handler = DeferredQueueHandler(log_queue)
+        root.addHandler(_handler)
+        if _verbose:
+            for name in APP_LOGGERS:
+                logging.getLogger(name).setLevel(logging.DEBUG)
+        _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        return _listener
+
+def stop_logging():
+    """Writes the queued records and stops the listener thread."""
+    global _listener, _handler
+    with _lock:
+        if _listener is None:
+            return
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+def dump_payload(logger, label, payload):
+    """Logs a raw payload (search results, prompts, model output) in verbose mode only."""
+    if _verbose and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s:\n%s", label, LazyJson(payload))
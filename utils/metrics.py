@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import uuid
+import threading
+import functools
+from contextlib import contextmanager
+
+METRICS_DIR = os.path.join(os.path.dirname(__file__), '..', 'metrics')
+METRIC_PREFIX = 'apartment_search'
+
+class RunMetrics:
+    """
+    Thread-safe per-run collection of stage timings and counters
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.run_id = uuid.uuid4().hex[:12]
+            self.started = time.time()
+            # stage -> [count, total seconds, max seconds]
+            self.timings = {}
+            # (name, sorted label items) -> value
+            self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            timing = self.timings.setdefault(stage, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Returns the run as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                'run_id': self.run_id,
+                'started': self.started,
+                'finished': time.time(),
+                'stages': {
+                    stage: {'count': count, 'seconds': round(total, 6), 'max_seconds': round(longest, 6)}
+                    for stage, (count, total, longest) in self.timings.items()
+                },
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in self.counters.items()
+                ],
+            }
+
+    def to_prometheus(self, snapshot=None):
+        """Renders the run in the Prometheus text exposition format."""
+        snapshot = snapshot or self.snapshot()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds End time of the last run.",
+            f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+            f"{METRIC_PREFIX}_last_run_timestamp_seconds {snapshot['finished']:.3f}",
+            f"# HELP {METRIC_PREFIX}_stage_duration_seconds Total time spent per stage in the last run.",
+            f"# TYPE {METRIC_PREFIX}_stage_duration_seconds gauge",
+        ]
+        for stage, timing in sorted(snapshot['stages'].items()):
+            lines.append(f'{METRIC_PREFIX}_stage_duration_seconds{{stage="{stage}"}} {timing["seconds"]}')
+        lines.append(f"# TYPE {METRIC_PREFIX}_stage_calls gauge")
+        for stage, timing in sorted(snapshot['stages'].items()):
+            lines.append(f'{METRIC_PREFIX}_stage_calls{{stage="{stage}"}} {timing["count"]}')
+
+        by_name = {}
+        for counter in snapshot['counters']:
+            by_name.setdefault(counter['name'], []).append(counter)
+        for name, counters in sorted(by_name.items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+            for counter in counters:
+                labels = ','.join(f'{key}="{_escape(value)}"' for key, value in sorted(counter['labels'].items()))
+                labels = f"{{{labels}}}" if labels else ''
+                lines.append(f"{METRIC_PREFIX}_{name}{labels} {counter['value']}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory=None):
+        """
+        Appends the run to runs.jsonl and replaces the Prometheus textfile
+        (written to a temp file and renamed so the exporter never reads half a file)
+        """
+        directory = directory or os.getenv('METRICS_DIR') or METRICS_DIR
+        os.makedirs(directory, exist_ok=True)
+        snapshot = self.snapshot()
+
+        with open(os.path.join(directory, 'runs.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(snapshot, ensure_ascii=False) + '\n')
+
+        prom_path = os.path.join(directory, f'{METRIC_PREFIX}.prom')
+        tmp_path = f"{prom_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus(snapshot))
+        os.replace(tmp_path, prom_path)
+        return snapshot
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Metrics of the current run, shared by all pipeline stages
+metrics = RunMetrics()
+
+def timed(stage):
+    """
+    Decorator that records the duration of every call under stage
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics.timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
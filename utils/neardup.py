@@ -0,0 +1,237 @@
+import re
+import zlib
+import random
+from array import array
+from .filter import canonical_url, extract_fields, find_address
+from .compact import clean_text
+from .metrics import metrics, timed
+
+# MinHash signature length and LSH banding: 8 bands of 4 rows make pairs with
+# a Jaccard similarity around 0.6 collide in at least one band
+NUM_PERM = 32
+BANDS = 8
+SHINGLE_SIZE = 3
+
+# Estimated shingle similarity at which two listings are the same apartment,
+# and the lower bar for listings that already share sqm, price and area
+SIMILARITY_THRESHOLD = 0.6
+BLOCK_SIMILARITY = 0.2
+
+# Known values further apart than this belong to different apartments
+SQM_TOLERANCE = 2
+PRICE_TOLERANCE = 0.03
+
+MASK_64 = (1 << 64) - 1
+
+TOKEN_RE = re.compile(r'\w+')
+
+def shingles(text, size=SHINGLE_SIZE):
+    """CRC32 hashes of the word size-grams of the normalized text."""
+    tokens = TOKEN_RE.findall(clean_text(text).lower())
+    if len(tokens) < size:
+        return {zlib.crc32(' '.join(tokens).encode('utf-8'))} if tokens else set()
+    return {
+        zlib.crc32(' '.join(tokens[i:i + size]).encode('utf-8'))
+        for i in range(len(tokens) - size + 1)
+    }
+
+class MinHasher:
+    """
+    MinHash over 32-bit shingle hashes with num_perm multiply-shift hash functions.
+    The seed is fixed so signatures stored in earlier runs stay comparable.
+    """
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._params = [(rng.getrandbits(64) | 1, rng.getrandbits(64)) for _ in range(num_perm)]
+
+    def signature(self, hashes):
+        if not hashes:
+            return (0,) * self.num_perm
+        return tuple(min(((a * h + b) & MASK_64) >> 32 for h in hashes) for a, b in self._params)
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return sum(a == b for a, b in zip(signature, other)) / len(signature)
+
+def _close(a, b, tolerance):
+    return a is None or b is None or abs(a - b) <= tolerance
+
+class ListingFingerprint:
+    """
+    What near-duplicate detection knows about one listing: its MinHash signature
+    and the sqm, price, area, rooms and street address found in the snippet
+    """
+    __slots__ = ('key', 'signature', 'sqm', 'price', 'area', 'rooms', 'address')
+
+    FIELDS = ('sqm', 'price', 'area', 'rooms', 'address')
+
+    def __init__(self, key, signature, sqm=None, price=None, area=None, rooms=None, address=None):
+        self.key = key
+        self.signature = tuple(signature)
+        self.sqm = sqm
+        self.price = price
+        self.area = area
+        self.rooms = rooms
+        self.address = address
+
+    @classmethod
+    def from_result(cls, result, listing_type, hasher):
+        text = f"{result.get('title') or ''}\n{result.get('content') or ''}"
+        fields = result.get('extracted') or extract_fields(result, listing_type)
+        address = find_address(text)
+        return cls(
+            canonical_url(result.get('url', '')),
+            hasher.signature(shingles(text)),
+            fields.get('sqm'),
+            fields.get('price_dkk' if listing_type == 'andelsbolig' else 'rent_dkk'),
+            fields.get('area'),
+            fields.get('rooms'),
+            address.lower() if address else None,
+        )
+
+    def blocks(self):
+        """Exact keys shared by listings that are very likely the same apartment."""
+        keys = []
+        if self.address and self.sqm is not None:
+            keys.append(('address', self.address, self.sqm))
+        if self.sqm is not None and self.price is not None and self.area:
+            keys.append(('fields', self.sqm, self.price, self.area))
+        return keys
+
+    def conflicts(self, other):
+        """True if a value known for both listings differs, so they cannot be the same apartment."""
+        if not _close(self.sqm, other.sqm, SQM_TOLERANCE):
+            return True
+        if self.price is not None and other.price is not None and \
+                abs(self.price - other.price) > PRICE_TOLERANCE * max(self.price, other.price):
+            return True
+        for field in ('area', 'rooms', 'address'):
+            mine, theirs = getattr(self, field), getattr(other, field)
+            if mine is not None and theirs is not None and mine != theirs:
+                return True
+        return False
+
+    def to_row(self):
+        """(signature bytes, fields) for the listing store."""
+        return array('I', self.signature).tobytes(), {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_row(cls, key, signature, fields):
+        values = array('I')
+        values.frombytes(signature)
+        return cls(key, values, **{field: fields.get(field) for field in cls.FIELDS})
+
+class NearDuplicateIndex:
+    """
+    Finds an indexed listing that is a near-duplicate of a new one without
+    comparing against every listing. Candidates are the listings sharing an
+    LSH band of the MinHash signature or an address/sqm or sqm/price/area
+    block; only those are compared, so lookups stay cheap as the index grows.
+    """
+
+    def __init__(self, bands=BANDS, threshold=SIMILARITY_THRESHOLD, block_threshold=BLOCK_SIMILARITY):
+        self.bands = bands
+        self.threshold = threshold
+        self.block_threshold = block_threshold
+        self._fingerprints = {}
+        # (band, band values) or block key -> listing keys
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+    def _band_keys(self, signature):
+        # Listings without text would all share every band
+        if not any(signature):
+            return []
+        rows = len(signature) // self.bands
+        return [(band, signature[band * rows:(band + 1) * rows]) for band in range(self.bands)]
+
+    def add(self, fingerprint):
+        self._fingerprints[fingerprint.key] = fingerprint
+        for bucket in self._band_keys(fingerprint.signature) + fingerprint.blocks():
+            self._buckets.setdefault(bucket, []).append(fingerprint.key)
+
+    def find(self, fingerprint):
+        """Key of the most similar indexed near-duplicate of fingerprint, or None."""
+        blocked = {}
+        for block in fingerprint.blocks():
+            for key in self._buckets.get(block, ()):
+                blocked.setdefault(key, block[0])
+        candidates = set(blocked)
+        for bucket in self._band_keys(fingerprint.signature):
+            candidates.update(self._buckets.get(bucket, ()))
+        candidates.discard(fingerprint.key)
+
+        best, best_similarity = None, -1.0
+        for key in candidates:
+            other = self._fingerprints[key]
+            if fingerprint.conflicts(other):
+                continue
+            score = similarity(fingerprint.signature, other.signature)
+            if blocked.get(key) == 'address':
+                # Same street address and sqm: the same apartment however it is worded
+                score = max(score, self.threshold)
+            needed = self.block_threshold if key in blocked else self.threshold
+            if score >= needed and score > best_similarity:
+                best, best_similarity = key, score
+        return best
+
+    @classmethod
+    def from_rows(cls, rows, **kwargs):
+        """Index of (key, signature bytes, fields) rows from the listing store."""
+        index = cls(**kwargs)
+        for key, signature, fields in rows:
+            index.add(ListingFingerprint.from_row(key, signature, fields))
+        return index
+
+_hasher = MinHasher()
+
+def fingerprint_result(result, listing_type):
+    return ListingFingerprint.from_result(result, listing_type, _hasher)
+
+def _completeness(result):
+    extracted = result.get('extracted') or {}
+    return (sum(value is not None for value in extracted.values()), len(result.get('content') or ''))
+
+@timed('collapse_duplicates')
+def collapse_duplicates(results, listing_type, seen=None):
+    """
+    Cluster results that describe the same apartment, e.g. one flat posted on
+    DBA, Boligportal and Facebook. Each cluster keeps its most complete result,
+    with the URLs of the others in 'duplicate_urls'. Results that duplicate a
+    listing in seen (a NearDuplicateIndex of earlier runs) are dropped.
+    Returns (results, duplicate_count).
+    """
+    if not results or not results.get('results'):
+        return results, 0
+    index = NearDuplicateIndex()
+    kept = {}
+    dropped_seen = dropped_run = 0
+
+    for result in results['results']:
+        if not result.get('url'):
+            continue
+        fingerprint = fingerprint_result(result, listing_type)
+        if seen is not None and seen.find(fingerprint) is not None:
+            dropped_seen += 1
+            continue
+        match = index.find(fingerprint)
+        if match is None:
+            index.add(fingerprint)
+            kept[fingerprint.key] = result
+            continue
+
+        dropped_run += 1
+        current = kept[match]
+        urls = current.get('duplicate_urls', []) + [result['url']]
+        if _completeness(result) > _completeness(current):
+            urls = [current['url'] if url == result['url'] else url for url in urls]
+            current = result
+        kept[match] = dict(current, duplicate_urls=urls)
+
+    metrics.inc('near_duplicates', dropped_run, listing_type=listing_type, scope='run')
+    metrics.inc('near_duplicates', dropped_seen, listing_type=listing_type, scope='seen')
+    return {'results': list(kept.values())}, dropped_run + dropped_seen
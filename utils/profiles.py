@@ -0,0 +1,151 @@
+import json
+import logging
+from .filter import Criteria
+from .subscriptions import SubscriptionIndex
+from .search import (
+    ANDELSBOLIG_QUERIES,
+    RENTAL_QUERIES,
+    BOLIGPORTAL_AREA_TERMS,
+    BOLIGPORTAL_ROOMS,
+    boligportal_query,
+    format_results,
+)
+
+logger = logging.getLogger(__name__)
+
+LISTING_TYPES = ('andelsbolig', 'lejebolig')
+DEFAULT_PROFILE = 'standard'
+
+# Keys of a profile in mapping.json that are passed on to Criteria
+CRITERIA_FIELDS = ('areas', 'min_sqm', 'max_sqm', 'max_price', 'max_rent', 'rooms')
+
+class SearchProfile:
+    """
+    What one or more recipients are looking for: listing types and criteria
+    """
+
+    __slots__ = ('name', 'listing_types', 'criteria')
+
+    def __init__(self, name, listing_types=LISTING_TYPES, criteria=None):
+        unknown = [t for t in listing_types if t not in LISTING_TYPES]
+        if unknown:
+            raise ValueError(f"Ukendte boligtyper i profil {name}: {', '.join(unknown)}")
+        self.name = name
+        self.listing_types = tuple(listing_types)
+        self.criteria = criteria or Criteria()
+
+    @classmethod
+    def from_dict(cls, name, data):
+        """
+        Build a profile from its mapping.json entry, omitted keys use the defaults, e.g.
+        {"listing_types": ["lejebolig"], "areas": ["Valby"], "max_rent": 15000, "rooms": [3, 4]}
+        """
+        unknown = set(data) - set(CRITERIA_FIELDS) - {'listing_types'}
+        if unknown:
+            raise ValueError(f"Ukendte felter i profil {name}: {', '.join(sorted(unknown))}")
+        criteria = Criteria(**{key: data[key] for key in CRITERIA_FIELDS if key in data})
+        return cls(name, data.get('listing_types', LISTING_TYPES), criteria)
+
+    def wants(self, listing_type):
+        return listing_type in self.listing_types
+
+class SearchPlan:
+    """
+    The deduplicated queries and loosest criteria covering all profiles, run
+    once per search, and the profiles with their recipients for local matching
+    """
+
+    __slots__ = ('queries', 'criteria', 'groups')
+
+    def __init__(self, queries, criteria, groups):
+        self.queries = queries
+        self.criteria = criteria
+        self.groups = groups
+
+    def without_recipients(self):
+        """Same searches, nobody to email (used by replay runs)."""
+        return SearchPlan(self.queries, self.criteria, [(profile, []) for profile, _ in self.groups])
+
+    def query_count(self):
+        return sum(len(queries) for queries in self.queries.values())
+
+def load_profiles(mapping):
+    """
+    Group the recipients of mapping.json by search profile.
+    A recipient's "profile" is the name of an entry in "profiles" or an inline
+    profile; recipients without one share the default profile.
+    Returns [(profile, recipients)] in the order the profiles are first used.
+    """
+    named = {
+        name: SearchProfile.from_dict(name, data)
+        for name, data in (mapping.get('profiles') or {}).items()
+    }
+    groups = {}
+    for recipient in mapping.get('recipients') or []:
+        spec = recipient.get('profile')
+        if isinstance(spec, dict):
+            profile = SearchProfile.from_dict(recipient.get('email') or recipient.get('name', 'inline'), spec)
+        elif spec is None:
+            profile = named.get(DEFAULT_PROFILE) or SearchProfile(DEFAULT_PROFILE)
+        elif spec in named:
+            profile = named[spec]
+        else:
+            raise ValueError(f"Ukendt profil {spec!r} for {recipient.get('email')}")
+        groups.setdefault(profile.name, (profile, []))[1].append(recipient)
+    return list(groups.values())
+
+def plan_queries(profiles):
+    """
+    The minimal set of (label, query) pairs per listing type that covers every profile.
+    Site-wide queries run once if any profile wants the listing type, Boligportal
+    queries once per (rooms, area) combination some profile asks for.
+    """
+    plan = {listing_type: [] for listing_type in LISTING_TYPES}
+
+    if any(profile.wants('andelsbolig') for profile in profiles):
+        plan['andelsbolig'] = list(ANDELSBOLIG_QUERIES)
+
+    renters = [profile for profile in profiles if profile.wants('lejebolig')]
+    if renters:
+        combinations = set()
+        for profile in renters:
+            rooms = profile.criteria.rooms or BOLIGPORTAL_ROOMS
+            areas = [area for area in profile.criteria.areas if area in BOLIGPORTAL_AREA_TERMS]
+            combinations.update((room, area) for room in rooms for area in areas)
+        area_order = list(BOLIGPORTAL_AREA_TERMS)
+        ordered = sorted(combinations, key=lambda c: (-c[0], area_order.index(c[1])))
+        plan['lejebolig'] = [("Boligportal", boligportal_query(rooms, area)) for rooms, area in ordered]
+        plan['lejebolig'] += [(label, query) for label, query in RENTAL_QUERIES if label != "Boligportal"]
+
+    return plan
+
+def plan_searches(groups):
+    """
+    Build the SearchPlan for [(profile, recipients)] groups
+    """
+    profiles = [profile for profile, _ in groups]
+    queries = plan_queries(profiles)
+    criteria = Criteria.union(profile.criteria for profile in profiles)
+    plan = SearchPlan(queries, criteria, groups)
+    logger.info("Søgeplan: %d profiler, %d forespørgsler", len(profiles), plan.query_count())
+    return plan
+
+def match_profiles(processed_results, profiles):
+    """
+    Split the processed listings by profile in one pass over the listings.
+    Returns {profile name: results JSON string} with the listings each profile matches.
+    """
+    results_json = json.loads(processed_results) if isinstance(processed_results, str) else processed_results
+    index = SubscriptionIndex()
+    for profile in profiles:
+        index.add(profile.name, profile.criteria, profile.listing_types)
+
+    matched = {profile.name: {'andelsboliger': [], 'lejeboliger': []} for profile in profiles}
+    for key, listing_type in (('andelsboliger', 'andelsbolig'), ('lejeboliger', 'lejebolig')):
+        for record in results_json.get(key) or []:
+            for name in index.match_record(record, listing_type):
+                matched[name][key].append(record)
+    return {
+        name: format_results(listings['andelsboliger'], listings['lejeboliger'])
+        for name, listings in matched.items()
+    }
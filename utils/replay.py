@@ -0,0 +1,236 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+import hashlib
+import threading
+from types import SimpleNamespace
+
+# Each record in a snapshot is a 4-byte big-endian length followed by zlib-compressed JSON
+HEADER = struct.Struct('>I')
+
+def request_key(kind, payload):
+    """
+    Stable key for a request, payload must be JSON-serializable
+    """
+    raw = json.dumps([kind, payload], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class SnapshotMiss(KeyError):
+    """
+    A request that was never recorded: the replayed run has diverged from the
+    recorded one, so it must stop instead of being retried or dropped
+    """
+
+class SnapshotWriter:
+    """
+    Appends compressed request/response records to a snapshot file and
+    their offsets to an index file next to it (<snapshot>.idx)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        self._index = open(self.index_path, 'a', encoding='utf-8')
+
+    def append(self, kind, key, request, response):
+        record = json.dumps({'kind': kind, 'key': key, 'request': request, 'response': response},
+                            ensure_ascii=False).encode('utf-8')
+        data = zlib.compress(record)
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(HEADER.pack(len(data)))
+            self._file.write(data)
+            self._file.flush()
+            self._index.write(f"{kind}\t{key}\t{offset}\t{len(data)}\n")
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._index.close()
+
+class SnapshotReader:
+    """
+    Serves recorded responses from a memory-mapped snapshot.
+    Only the index is held in memory, records are decompressed on lookup.
+    Repeated identical requests are served in the order they were recorded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._offsets = {}
+        self._served = {}
+        if os.path.exists(f"{path}.idx"):
+            self._load_index(f"{path}.idx")
+        else:
+            self._scan()
+
+    def _load_index(self, index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                kind, key, offset, length = line.rstrip('\n').split('\t')
+                self._offsets.setdefault(key, []).append((int(offset), int(length)))
+
+    def _scan(self):
+        """Rebuilds the index by walking the record headers."""
+        offset = 0
+        while offset + HEADER.size <= len(self._map):
+            (length,) = HEADER.unpack_from(self._map, offset)
+            record = self._read(offset, length)
+            self._offsets.setdefault(record['key'], []).append((offset, length))
+            offset += HEADER.size + length
+
+    def _read(self, offset, length):
+        start = offset + HEADER.size
+        return json.loads(zlib.decompress(self._map[start:start + length]))
+
+    def __len__(self):
+        return sum(len(offsets) for offsets in self._offsets.values())
+
+    def lookup(self, key):
+        """Returns the recorded response for key, or raises SnapshotMiss if it was never recorded."""
+        with self._lock:
+            offsets = self._offsets.get(key)
+            if not offsets:
+                raise SnapshotMiss(f"Ingen optagelse af request {key} i {self.path}")
+            position = self._served.get(key, 0)
+            self._served[key] = position + 1
+            offset, length = offsets[min(position, len(offsets) - 1)]
+        return self._read(offset, length)['response']
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+def _tavily_request(query, search_depth, max_results):
+    return {'query': query, 'search_depth': search_depth, 'max_results': max_results}
+
+class RecordingTavilyClient:
+    """
+    Wraps a TavilyClient and records every search
+    """
+
+    def __init__(self, inner, writer):
+        self.inner = inner
+        self.writer = writer
+
+    def search(self, query, search_depth="basic", max_results=5, **kwargs):
+        response = self.inner.search(query=query, search_depth=search_depth, max_results=max_results, **kwargs)
+        request = _tavily_request(query, search_depth, max_results)
+        self.writer.append('tavily', request_key('tavily', request), request, response)
+        return response
+
+class ReplayTavilyClient:
+    """
+    Serves recorded Tavily searches without calling the API
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def search(self, query, search_depth="basic", max_results=5, **kwargs):
+        return self.reader.lookup(request_key('tavily', _tavily_request(query, search_depth, max_results)))
+
+def _usage_to_dict(usage):
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+        'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+        'cached_tokens': getattr(details, 'cached_tokens', 0) or 0,
+    }
+
+def _usage_from_dict(usage):
+    usage = usage or {}
+    return SimpleNamespace(
+        prompt_tokens=usage.get('prompt_tokens', 0),
+        completion_tokens=usage.get('completion_tokens', 0),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=usage.get('cached_tokens', 0)),
+    )
+
+def _completion_to_dict(response):
+    return {
+        'content': response.choices[0].message.content,
+        'usage': _usage_to_dict(getattr(response, 'usage', None)),
+    }
+
+def _completion_from_dict(data):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=data['content']))],
+        usage=_usage_from_dict(data.get('usage')),
+    )
+
+def completion_chunks(content, usage=None, chunk_size=64):
+    """
+    Yields content as streamed chat completion chunks, followed by a
+    final chunk without choices that carries the usage (like include_usage)
+    """
+    for start in range(0, len(content), chunk_size):
+        delta = SimpleNamespace(content=content[start:start + chunk_size])
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+    yield SimpleNamespace(choices=[], usage=usage)
+
+def _record_stream(stream, on_done):
+    """
+    Passes a streamed completion through and calls on_done with the
+    full content and usage once it has been consumed
+    """
+    parts = []
+    usage = None
+    for chunk in stream:
+        if getattr(chunk, 'usage', None) is not None:
+            usage = chunk.usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+        yield chunk
+    on_done({'content': ''.join(parts), 'usage': _usage_to_dict(usage)})
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+class RecordingOpenAIClient:
+    """
+    Wraps an OpenAI client and records every chat completion
+    """
+
+    def __init__(self, inner, writer):
+        self.inner = inner
+        self.writer = writer
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    def _create(self, model, messages, **kwargs):
+        response = self.inner.chat.completions.create(model=model, messages=messages, **kwargs)
+        request = {'model': model, 'messages': messages}
+        key = request_key('openai', request)
+        if kwargs.get('stream'):
+            # Only streams that were read to the end are recorded
+            return _record_stream(response, lambda data: self.writer.append('openai', key, request, data))
+        self.writer.append('openai', key, request, _completion_to_dict(response))
+        return response
+
+class ReplayOpenAIClient:
+    """
+    Serves recorded chat completions without calling the API
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    def _create(self, model, messages, **kwargs):
+        request = {'model': model, 'messages': messages}
+        data = self.reader.lookup(request_key('openai', request))
+        if kwargs.get('stream'):
+            return completion_chunks(data['content'], _usage_from_dict(data.get('usage')))
+        return _completion_from_dict(data)
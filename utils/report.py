@@ -0,0 +1,108 @@
+import json
+from datetime import datetime
+from .filter import listing_domain
+
+EMAIL_CSS = """
+            body { font-family: Arial, sans-serif; line-height: 1.6; margin: 0; padding: 20px; }
+            h2, h3 { color: #2c3e50; margin-top: 20px; }
+            .container { max-width: 800px; margin: 0 auto; padding: 20px; }
+            .listing { margin-bottom: 20px; padding: 15px; border: 1px solid #ddd; border-radius: 5px; background-color: #fff; }
+            a { color: #3498db; text-decoration: none; }
+            a:hover { text-decoration: underline; }
+            p { margin: 8px 0; }
+            .footer { margin-top: 30px; color: #7f8c8d; border-top: 1px solid #eee; padding-top: 20px; }
+        """
+
+# Document shell, rendered once per run with the listings filled in
+EMAIL_TEMPLATE = """
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="utf-8">
+            <style>{css}</style>
+        </head>
+        <body>
+            <div class="container">
+                <h2>Boligsøgning Resultater (Under udvikling - Cest la vie)</h2>
+                {body}
+                <div class="footer">
+                    <p>Med Venlig Hilsen,<br>Mikkel</p>
+                </div>
+            </div>
+        </body>
+        </html>
+        """
+
+LISTING_TEMPLATE = (
+    '<div class="listing">'
+    "<p><strong>Adresse:</strong> {address}</p>"
+    "<p><strong>{price_label}:</strong> {price}</p>"
+    "<p><strong>Størrelse:</strong> {sqm} m²</p>"
+    "<p><strong>Område:</strong> {area}</p>"
+    "<p><strong>Beskrivelse:</strong> {key_features}</p>"
+    "<p><strong>Link:</strong> <a href='{url}'>{source}</a></p>"
+    "{also}"
+    "</div>"
+)
+
+# The same listing posted on other portals
+ALSO_TEMPLATE = "<p><strong>Også på:</strong> {links}</p>"
+
+# (section heading, results key, price field, price label)
+SECTIONS = [
+    ("Andelsboliger", 'andelsboliger', 'price_dkk', "Pris"),
+    ("Lejeboliger", 'lejeboliger', 'rent_dkk', "Månedlig leje"),
+]
+
+def _format_price(amount):
+    if not amount:
+        return "Ikke angivet"
+    return f"{amount:,} DKK".replace(',', '.')
+
+def _render_also(urls):
+    if not urls:
+        return ""
+    links = ", ".join(f"<a href='{url}'>{listing_domain(url) or 'Link'}</a>" for url in urls)
+    return ALSO_TEMPLATE.format(links=links)
+
+def render_listing(bolig, price_field, price_label):
+    """
+    Render a single listing as an HTML block
+    """
+    return LISTING_TEMPLATE.format(
+        address=bolig.get('address') or 'Ikke angivet',
+        price_label=price_label,
+        price=_format_price(bolig.get(price_field)),
+        sqm=bolig.get('sqm', 'Ikke angivet'),
+        area=bolig.get('area', 'Ikke angivet'),
+        key_features=bolig.get('key_features', 'Ingen beskrivelse'),
+        url=bolig.get('url', '#'),
+        source=bolig.get('source', 'Link'),
+        also=_render_also(bolig.get('duplicate_urls')),
+    )
+
+def render_email_report(results):
+    """
+    Render the report once per run.
+    Returns a dict with the email 'subject' and 'html' body.
+    """
+    # Parse the results as JSON to ensure proper formatting
+    results_json = json.loads(results) if isinstance(results, str) else results
+
+    formatted_results = []
+
+    # Add summary
+    if 'summary' in results_json:
+        formatted_results.append("<h3>Oversigt</h3>")
+        formatted_results.append(f"<p>{results_json['summary']}</p>")
+
+    for heading, key, price_field, price_label in SECTIONS:
+        if key in results_json:
+            formatted_results.append(f"<h3>{heading}</h3>")
+            formatted_results.extend(
+                render_listing(bolig, price_field, price_label) for bolig in results_json[key]
+            )
+
+    subject = f"Boligsøgning Resultater - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+    html = EMAIL_TEMPLATE.format(css=EMAIL_CSS, body=''.join(formatted_results))
+    return {'subject': subject, 'html': html}
@@ -0,0 +1,248 @@
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from .ratelimit import RateLimiter
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Requests per second, burst and retry settings per provider.
+# Rates can be overridden with <PROVIDER>_REQUESTS_PER_SECOND (GMAIL_SENDS_PER_SECOND for Gmail).
+PROVIDER_LIMITS = {
+    'tavily': {'rate': 5.0, 'burst': 5},
+    'openai': {'rate': 2.0, 'burst': 4},
+    'gmail': {'rate': 2.0, 'burst': 1},
+    'pages': {'rate': 5.0, 'burst': 5},
+}
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# A Retry-After longer than this is not waited for, the call fails instead
+MAX_RETRY_AFTER = 120.0
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 60.0
+# Seconds other callers are told to wait while the half-open trial call is in flight
+TRIAL_WAIT = 1.0
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+    def __init__(self, provider, retry_in):
+        super().__init__(f"{provider} er midlertidigt slået fra efter gentagne fejl, prøver igen om {retry_in:.0f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+def status_code(exc):
+    """
+    HTTP status of an SDK exception, or None.
+    Covers openai (status_code), requests (response.status_code) and googleapiclient (resp.status).
+    """
+    for source in (exc, getattr(exc, 'response', None), getattr(exc, 'resp', None)):
+        for attr in ('status_code', 'status'):
+            value = getattr(source, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+def is_retryable(exc):
+    """Transient errors are worth retrying, client errors and exhausted quotas are not."""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    status = status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    name = type(exc).__name__
+    return any(word in name for word in ('Timeout', 'Connection', 'RateLimit'))
+
+def _headers(exc):
+    for source in (getattr(exc, 'response', None), getattr(exc, 'resp', None)):
+        headers = getattr(source, 'headers', None)
+        if headers is None and isinstance(source, dict):
+            headers = source
+        if headers is not None:
+            return headers
+    return {}
+
+def retry_after(exc):
+    """Seconds to wait from the Retry-After (or retry-after-ms) header of a failed response, or None."""
+    headers = _headers(exc)
+    try:
+        millis = headers.get('retry-after-ms')
+        if millis is not None:
+            return max(0.0, float(millis) / 1000)
+        value = headers.get('retry-after') or headers.get('Retry-After')
+    except AttributeError:
+        return None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls for
+    reset_timeout seconds. After that a single trial call is let through:
+    success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT, clock=time.monotonic):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(self.clock())
+
+    def _state(self, now):
+        if self.opened_at is None:
+            return 'closed'
+        if now - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """Returns 0 if a call may go ahead, otherwise the seconds until the next trial."""
+        with self._lock:
+            now = self.clock()
+            state = self._state(now)
+            if state == 'closed':
+                return 0.0
+            if state == 'half_open':
+                if not self._trial:
+                    self._trial = True
+                    return 0.0
+                # The reset time has passed, so its remainder would be 0 and admit everyone
+                return TRIAL_WAIT
+            return self.opened_at + self.reset_timeout - now
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        """Returns True if this failure opened the breaker."""
+        with self._lock:
+            self.failures += 1
+            was_open = self.opened_at is not None
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+                self._trial = False
+                return not was_open
+            return False
+
+class ProviderGuard:
+    """
+    Wraps every call to one provider with its token bucket, retries with
+    exponential backoff and full jitter (at least Retry-After when the provider
+    sends it) and a circuit breaker. Counts calls, retries and throttling.
+    """
+
+    def __init__(self, provider, limiter, breaker=None, max_attempts=MAX_ATTEMPTS,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, sleep=time.sleep, rng=None):
+        self.provider = provider
+        self.limiter = limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = sleep
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.throttled_seconds = 0.0
+
+    def backoff(self, attempt):
+        """Full jitter: uniform between 0 and base * 2^attempt, capped at backoff_max."""
+        with self._lock:
+            return self._rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def call(self, func, *args, **kwargs):
+        """Calls func(*args, **kwargs), retrying transient failures. Raises the last error."""
+        for attempt in range(self.max_attempts):
+            retry_in = self.breaker.allow()
+            if retry_in:
+                with self._lock:
+                    self.rejected += 1
+                metrics.inc('circuit_rejections', provider=self.provider)
+                raise CircuitOpenError(self.provider, retry_in)
+
+            waited = self.limiter.acquire()
+            with self._lock:
+                self.calls += 1
+                self.throttled_seconds += waited
+            if waited:
+                metrics.inc('throttle_seconds', round(waited, 6), provider=self.provider)
+
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The provider answered, so it is up even if the request was bad
+                    self.breaker.record_success()
+                    raise
+                with self._lock:
+                    self.failures += 1
+                if self.breaker.record_failure():
+                    metrics.inc('circuit_opened', provider=self.provider)
+                    logger.warning("%s: circuit breaker åbnet efter %d fejl i træk", self.provider, self.breaker.failures)
+                    raise
+                hint = retry_after(e)
+                if hint is not None and hint > MAX_RETRY_AFTER:
+                    raise
+                if attempt + 1 >= self.max_attempts:
+                    raise
+                delay = self.backoff(attempt)
+                if hint is not None:
+                    # Everyone else waits for the provider too, not only this call
+                    self.limiter.pause(hint)
+                    delay = max(delay, hint)
+                with self._lock:
+                    self.retries += 1
+                metrics.inc('api_retries', provider=self.provider)
+                logger.warning("%s: %s (%s), forsøg %d/%d om %.1fs",
+                               self.provider, type(e).__name__, e, attempt + 2, self.max_attempts, delay)
+                self.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'provider': self.provider,
+                'calls': self.calls,
+                'retries': self.retries,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'throttled_seconds': round(self.throttled_seconds, 3),
+                'circuit': self.breaker.state,
+            }
+
+def build_guard(provider, rate=None, burst=None, **kwargs):
+    """Guard with the default limits of provider, rate and burst override them."""
+    limits = PROVIDER_LIMITS[provider]
+    limiter = RateLimiter(rate or limits['rate'], burst or limits['burst'])
+    return ProviderGuard(provider, limiter, **kwargs)
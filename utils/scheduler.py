@@ -0,0 +1,196 @@
+import time
+import heapq
+import random
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Default polling interval in seconds per source label
+SOURCE_INTERVALS = {
+    "Boligportal": 15 * 60,
+    "Facebook": 20 * 60,
+    "Lejebolig.dk": 30 * 60,
+    "DBA": 60 * 60,
+}
+DEFAULT_INTERVAL = 30 * 60
+
+# Each run is shifted by up to this fraction of the interval to spread the calls out
+JITTER = 0.1
+
+# Adaptive polling: a query's interval is inversely proportional to its churn.
+# At this many new listings per run it is polled on its source's interval.
+TARGET_NEW_PER_RUN = 1.0
+MIN_INTERVAL = 5 * 60
+MAX_INTERVAL = 6 * 60 * 60
+# Weight of the latest run in the per-query churn average
+CHURN_ALPHA = 0.3
+# Upper bound on Tavily calls per hour across all jobs
+HOURLY_CALL_BUDGET = 60
+
+class PollJob:
+    """
+    A single query polled on its own interval
+    """
+    __slots__ = (
+        'label', 'query', 'listing_type', 'interval', 'base_interval', 'next_run', 'runs', 'last_new', 'churn',
+    )
+
+    def __init__(self, label, query, listing_type, interval):
+        self.label = label
+        self.query = query
+        self.listing_type = listing_type
+        self.interval = interval
+        # The source's interval, the one the job gets at the target churn
+        self.base_interval = interval
+        self.next_run = 0.0
+        self.runs = 0
+        # New listings found by the latest run and the moving average of it. The average
+        # starts on target so a new job keeps its source interval until it has a history.
+        self.last_new = 0
+        self.churn = TARGET_NEW_PER_RUN
+
+    def __repr__(self):
+        return f"PollJob({self.label!r}, {self.query!r}, every {self.interval:.0f}s)"
+
+class PollingScheduler:
+    """
+    Runs due jobs from a heap ordered by next run time until stop() is called.
+    run_due is called with the list of jobs that are due at the same time.
+    """
+
+    def __init__(self, jobs, run_due, jitter=JITTER, clock=time.monotonic):
+        self.jobs = list(jobs)
+        self.run_due = run_due
+        self.jitter = jitter
+        self.clock = clock
+        self._stop = threading.Event()
+        self._heap = []
+        now = self.clock()
+        for index, job in enumerate(self.jobs):
+            # Stagger the first runs a little so all sources do not fire at once
+            job.next_run = now + random.uniform(0, self.jitter * job.interval)
+            heapq.heappush(self._heap, (job.next_run, index, job))
+
+    def _reschedule(self, job, index, now):
+        delay = job.interval * (1 + random.uniform(-self.jitter, self.jitter))
+        job.next_run = now + max(1.0, delay)
+        heapq.heappush(self._heap, (job.next_run, index, job))
+
+    def next_interval(self, job):
+        """Hook for subclasses that change the interval after each run."""
+        return job.interval
+
+    def run_once(self):
+        """Runs all jobs that are due now and returns them."""
+        now = self.clock()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, index, job = heapq.heappop(self._heap)
+            due.append((index, job))
+        if not due:
+            return []
+
+        try:
+            self.run_due([job for _, job in due])
+        except Exception as e:
+            logger.error("Fejl i planlagt kørsel: %s", e)
+
+        now = self.clock()
+        for index, job in due:
+            job.runs += 1
+            job.interval = self.next_interval(job)
+            self._reschedule(job, index, now)
+        return [job for _, job in due]
+
+    def run_forever(self):
+        """Runs jobs as they become due until stop() is called."""
+        while not self._stop.is_set():
+            self.run_once()
+            if not self._heap:
+                break
+            wait = max(0.0, self._heap[0][0] - self.clock())
+            self._stop.wait(wait)
+
+    def stop(self):
+        self._stop.set()
+
+class AdaptivePollingScheduler(PollingScheduler):
+    """
+    Scheduler that adapts each job's interval to how often it finds new listings.
+    run_due is expected to set job.last_new for every job it runs.
+    A job's interval is its source interval scaled by TARGET_NEW_PER_RUN / churn,
+    churn being the moving average of new listings per run, within
+    [MIN_INTERVAL, MAX_INTERVAL]. When the jobs
+    together would exceed hourly_budget calls per hour, all of them are
+    stretched by the same factor, including the runs already scheduled.
+    """
+
+    def __init__(self, jobs, run_due, hourly_budget=HOURLY_CALL_BUDGET, min_interval=MIN_INTERVAL,
+                 max_interval=MAX_INTERVAL, **kwargs):
+        self.hourly_budget = hourly_budget
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stretch = 1.0
+        super().__init__(jobs, run_due, **kwargs)
+        self._update_stretch()
+        self._apply_stretch(self.clock())
+
+    def calls_per_hour(self):
+        return sum(3600.0 / job.interval for job in self.jobs)
+
+    def wanted_interval(self, job):
+        """The interval the job's churn asks for, before the call budget stretches it."""
+        if job.churn <= 0:
+            return self.max_interval
+        interval = job.base_interval * TARGET_NEW_PER_RUN / job.churn
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def _update_stretch(self):
+        wanted = sum(3600.0 / self.wanted_interval(job) for job in self.jobs)
+        self.stretch = max(1.0, wanted / self.hourly_budget) if self.hourly_budget > 0 else float('inf')
+
+    def _budgeted(self, job):
+        return min(self.max_interval, self.wanted_interval(job) * self.stretch)
+
+    def _apply_stretch(self, now):
+        """Moves the scheduled runs of every job to its interval under the current stretch."""
+        heap = []
+        for next_run, index, job in self._heap:
+            interval = self._budgeted(job)
+            if interval != job.interval:
+                next_run = now + max(0.0, next_run - now) * interval / job.interval
+                job.interval = interval
+                job.next_run = next_run
+            heap.append((next_run, index, job))
+        heapq.heapify(heap)
+        self._heap = heap
+
+    def next_interval(self, job):
+        job.churn = CHURN_ALPHA * job.last_new + (1 - CHURN_ALPHA) * job.churn
+        self._update_stretch()
+        interval = self._budgeted(job)
+
+        if interval != job.interval:
+            logger.info(
+                "Polling-interval for %s (%s): %.0fs -> %.0fs (nye: %d, churn: %.2f, budgetfaktor: %.2f)",
+                job.label, job.query, job.interval, interval, job.last_new, job.churn, self.stretch,
+            )
+        job.last_new = 0
+        return interval
+
+    def run_once(self):
+        stretch = self.stretch
+        due = super().run_once()
+        if self.stretch != stretch:
+            # The budget is shared, so the jobs that did not run move too
+            self._apply_stretch(self.clock())
+        return due
+
+    def stats(self):
+        """Returns the current interval and churn per job."""
+        return [
+            {'label': job.label, 'query': job.query, 'interval': job.interval,
+             'wanted_interval': self.wanted_interval(job), 'churn': round(job.churn, 3), 'runs': job.runs}
+            for job in self.jobs
+        ]
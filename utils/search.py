@@ -1,348 +1,740 @@
-import os
 import logging
 import json
-from datetime import datetime
-from openai import OpenAI
-from tavily import TavilyClient
-from dotenv import load_dotenv
-from .filter import filter_tavily_results
-from .gmail_sender import GmailSender
-
-# Configure logging
-logging.basicConfig(
-    filename='apartment_search.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+import time
+import hashlib
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .filter import (
+    filter_tavily_results,
+    split_by_match,
+    build_local_record,
+    canonical_url,
+    find_address,
+    normalize_area,
+    DEFAULT_CRITERIA,
 )
+from .listing import dedupe_results
+from .report import render_email_report
+from .cache import ExtractionCache
+from .metrics import metrics, timed
+from .stream_json import ListingStreamParser
+from .compact import compact_results, count_tokens, TokenBudget, BudgetExceeded
+from .logs import dump_payload
+from .replay import SnapshotMiss
+from .clients import (
+    env_int,
+    env_str,
+    get_openai_client,
+    get_tavily_client,
+    get_gmail_sender,
+    get_search_cache,
+    get_extraction_cache,
+    get_guard,
+)
+
+logger = logging.getLogger(__name__)
+
+# Number of Tavily queries allowed in flight at the same time (env SEARCH_CONCURRENCY)
+SEARCH_CONCURRENCY = 4
+
+OPENAI_MODEL = "gpt-4.1"
+SYSTEM_PROMPT = "Du er en hjælpsom assistent der behandler boligannoncer. Formatér informationen klart og verificér at annoncerne matcher søgekriterierne. Kommuniker på dansk."
+
+# Concurrent Gmail sends (env EMAIL_CONCURRENCY), the send rate is capped by
+# GMAIL_SENDS_PER_SECOND since messages.send costs 100 of the 250 quota units/s
+EMAIL_CONCURRENCY = 4
+
+# Listings per OpenAI request, concurrent requests and retries per failed batch
+# (env LLM_BATCH_SIZE, LLM_CONCURRENCY, LLM_BATCH_RETRIES)
+LLM_BATCH_SIZE = 10
+LLM_CONCURRENCY = 4
+LLM_BATCH_RETRIES = 1
+
+# Hard limit on prompt tokens per run, 0 disables it (env LLM_TOKEN_BUDGET)
+LLM_TOKEN_BUDGET = 100_000
+
+# (label, query) pairs per search
+ANDELSBOLIG_QUERIES = [
+    ("DBA", '("andelsbolig" OR "andelslejlighed") København "til salg" -solgt -bytte site:dba.dk/andelsbolig'),
+    ("Facebook", 'andelslejlighed København "til salg" -solgt -bytte site:facebook.com/marketplace'),
+]
+
+BOLIGPORTAL_QUERY = '{rooms} vær lejlighed {term} inurl:-id- site:boligportal.dk/lejligheder/k%C3%B8benhavn'
 
-# Load environment variables
-load_dotenv()
+# Boligportal is searched per room count and area, with these search terms per area.
+# Areas without a term are only covered by the site-wide queries.
+BOLIGPORTAL_AREA_TERMS = {
+    "Østerbro": "københavn Ø",
+    "Vesterbro": "Vesterbro",
+    "Frederiksberg": "frederiksberg",
+    "Nørrebro": "nørrebro",
+    "Indre by": "København K",
+}
+BOLIGPORTAL_ROOMS = (3, 2)
 
-# Initialize clients
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-tavily = TavilyClient(api_key=os.getenv('TAVILY_API_KEY'))
-gmail_sender = GmailSender()
+def boligportal_query(rooms, area):
+    return BOLIGPORTAL_QUERY.format(rooms=rooms, term=BOLIGPORTAL_AREA_TERMS[area])
 
-# Define target areas
-TARGET_AREAS = ["Vesterbro", "Østerbro", "Frederiksberg", "Indre by", "Nørrebro", "Valby", "Christianshavn"]
-AREAS_STRING = ", ".join(TARGET_AREAS)
+BOLIGPORTAL_QUERIES = [
+    boligportal_query(rooms, area) for rooms in BOLIGPORTAL_ROOMS for area in BOLIGPORTAL_AREA_TERMS
+]
 
-def search_andelsbolig():
+RENTAL_QUERIES = [("Boligportal", query) for query in BOLIGPORTAL_QUERIES] + [
+    ("Lejebolig.dk", 'lejlighed København "til leje" -udlejet site:lejebolig.dk/lejebolig'),
+    ("DBA", 'lejlighed København "til leje" -udlejet site:dba.dk/lejebolig'),
+    ("Facebook", 'lejlighed København "til leje" -udlejet site:facebook.com/marketplace'),
+]
+
+def cached_search(source, query, search_depth="advanced", max_results=5, use_cache=True):
     """
-    Search for Andelsbolig listings
+    Call tavily.search through the on-disk response cache
     """
+    search_cache = get_search_cache() if use_cache else None
+    if search_cache is not None:
+        cached = search_cache.get(source, query, search_depth, max_results)
+        if cached is not None:
+            metrics.inc('search_cache_hits', source=source)
+            return cached
+        metrics.inc('search_cache_misses', source=source)
+
     try:
-        all_results = []
-        
-        # DBA Search
-        dba_query = '("andelsbolig" OR "andelslejlighed") København "til salg" -solgt -bytte site:dba.dk/andelsbolig'
-        print("Søger DBA...")
-        dba_results = tavily.search(query=dba_query, search_depth="advanced", max_results=5)
-        if dba_results and 'results' in dba_results:
-            filtered_results = filter_tavily_results(dba_results, 'andelsbolig')
-            all_results.extend(filtered_results['results'])
-
-        # Facebook Search
-        fb_query = 'andelslejlighed København "til salg" -solgt -bytte site:facebook.com/marketplace'
-        print("Søger Facebook...")
-        fb_results = tavily.search(query=fb_query, search_depth="advanced", max_results=5)
-        if fb_results and 'results' in fb_results:
-            filtered_results = filter_tavily_results(fb_results, 'andelsbolig')
-            all_results.extend(filtered_results['results'])
-
-        print(f"Found {len(all_results)} results")
-        print(json.dumps(all_results, indent=4))
-        return {'results': all_results}
-    except Exception as e:
-        print(f"Fejl i andelsbolig-søgning: {str(e)}")
-        logging.error(f"Fejl i andelsbolig-søgning: {str(e)}")
+        with metrics.timer('tavily_search'):
+            results = get_guard('tavily').call(
+                get_tavily_client().search, query=query, search_depth=search_depth, max_results=max_results
+            )
+    except Exception:
+        metrics.inc('api_errors', provider='tavily')
+        raise
+    metrics.inc('api_calls', provider='tavily')
+    metrics.inc('tavily_results', len((results or {}).get('results') or []), source=source)
+    if search_cache is not None and results:
+        search_cache.put(source, query, search_depth, max_results, results)
+    return results
+
+def _search_one(label, query, listing_type, use_cache=True, criteria=DEFAULT_CRITERIA):
+    """
+    Run a single Tavily query and return its filtered results
+    """
+    logger.info("Søger %s med query: %s", label, query)
+    results = cached_search(label, query, search_depth="advanced", max_results=5, use_cache=use_cache)
+    if results and 'results' in results:
+        return filter_tavily_results(results, listing_type, criteria)['results']
+    return []
+
+def run_queries_per_query(queries, listing_type, max_workers=None, use_cache=True, criteria=DEFAULT_CRITERIA):
+    """
+    Run (label, query) pairs concurrently.
+    Returns (per_query, failed_count) where per_query[i] holds the results of
+    queries[i], or None if that query failed.
+    """
+    max_workers = max(1, max_workers or env_int('SEARCH_CONCURRENCY', SEARCH_CONCURRENCY))
+    per_query = [None for _ in queries]
+    failed = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_search_one, label, query, listing_type, use_cache, criteria): index
+            for index, (label, query) in enumerate(queries)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            label, query = queries[index]
+            try:
+                per_query[index] = future.result()
+            except SnapshotMiss:
+                raise
+            except Exception as e:
+                failed += 1
+                logger.error("Fejl i søgning (%s) for query '%s': %s", label, query, e)
+
+    search_cache = get_search_cache() if use_cache else None
+    if search_cache is not None:
+        stats = search_cache.stats()
+        logger.info("Søgecache: %d hits, %d misses", stats['hits'], stats['misses'])
+    return per_query, failed
+
+def merge_query_results(per_query, listing_type):
+    """
+    Merge per-query results in query order and drop duplicate listings
+    """
+    all_results, duplicates = dedupe_results(
+        [result for results in per_query if results for result in results], listing_type
+    )
+    if duplicates:
+        logger.info("Fjernede %d dubletter", duplicates)
+    return all_results
+
+def run_queries(queries, listing_type, max_workers=None, use_cache=True, criteria=DEFAULT_CRITERIA):
+    """
+    Run (label, query) pairs concurrently and merge the results in query order.
+    A failing query is logged and skipped, the remaining results are kept.
+    Returns (results, failed_count).
+    """
+    per_query, failed = run_queries_per_query(queries, listing_type, max_workers, use_cache, criteria)
+    return merge_query_results(per_query, listing_type), failed
+
+@timed('search_andelsbolig')
+def search_andelsbolig(queries=None, criteria=DEFAULT_CRITERIA):
+    """
+    Search for Andelsbolig listings, with the default queries unless a search plan passes its own
+    """
+    queries = ANDELSBOLIG_QUERIES if queries is None else queries
+    if not queries:
+        return {'results': []}
+    all_results, failed = run_queries(queries, 'andelsbolig', criteria=criteria)
+    if failed == len(queries):
+        logger.error("Fejl i andelsbolig-søgning: alle forespørgsler fejlede")
         return None
 
-def search_rental():
+    logger.info("Andelsbolig-søgning: %d resultater", len(all_results), extra={'fields': {'results': len(all_results)}})
+    dump_payload(logger, "Andelsbolig-resultater", all_results)
+    return {'results': all_results}
+
+@timed('search_rental')
+def search_rental(queries=None, criteria=DEFAULT_CRITERIA):
     """
-    Search for rental apartments
+    Search for rental apartments, with the default queries unless a search plan passes its own
     """
-    try:
-        all_results = []
-
-        BoligportalQueries = [
-            '3 vær lejlighed københavn Ø inurl:-id- site:boligportal.dk/lejligheder/k%C3%B8benhavn',
-            '3 vær lejlighed Vesterbro inurl:-id- site:boligportal.dk/lejligheder/k%C3%B8benhavn',
-            '3 vær lejlighed frederiksberg inurl:-id- site:boligportal.dk/lejligheder/k%C3%B8benhavn',
-            '3 vær lejlighed nørrebro inurl:-id- site:boligportal.dk/lejligheder/k%C3%B8benhavn',
-            '3 vær lejlighed København K inurl:-id- site:boligportal.dk/lejligheder/k%C3%B8benhavn',
-            '2 vær lejlighed københavn Ø inurl:-id- site:boligportal.dk/lejligheder/k%C3%B8benhavn',
-            '2 vær lejlighed Vesterbro inurl:-id- site:boligportal.dk/lejligheder/k%C3%B8benhavn',
-            '2 vær lejlighed frederiksberg inurl:-id- site:boligportal.dk/lejligheder/k%C3%B8benhavn',
-            '2 vær lejlighed nørrebro inurl:-id- site:boligportal.dk/lejligheder/k%C3%B8benhavn',
-            '2 vær lejlighed København K inurl:-id- site:boligportal.dk/lejligheder/k%C3%B8benhavn',
-        ]
-
-        for query in BoligportalQueries:
-            print(f"Søger Boligportal med query: {query}")
-            bp_results = tavily.search(query=query, search_depth="advanced", max_results=5)
-            if bp_results and 'results' in bp_results:
-                filtered_results = filter_tavily_results(bp_results, 'lejebolig')
-                all_results.extend(filtered_results['results'])
-
-        # Lejebolig.dk Search
-        lejebolig_query = 'lejlighed København "til leje" -udlejet site:lejebolig.dk/lejebolig'
-        print("Søger Lejebolig.dk...")
-        lb_results = tavily.search(query=lejebolig_query, search_depth="advanced", max_results=5)
-        if lb_results and 'results' in lb_results:
-            filtered_results = filter_tavily_results(lb_results, 'lejebolig')
-            all_results.extend(filtered_results['results'])
-
-        # DBA Search
-        dba_query = 'lejlighed København "til leje" -udlejet site:dba.dk/lejebolig'
-        print("Søger DBA...")
-        dba_results = tavily.search(query=dba_query, search_depth="advanced", max_results=5)
-        if dba_results and 'results' in dba_results:
-            filtered_results = filter_tavily_results(dba_results, 'lejebolig')
-            all_results.extend(filtered_results['results'])
-
-        # Facebook Search
-        fb_query = 'lejlighed København "til leje" -udlejet site:facebook.com/marketplace'
-        print("Søger Facebook...")
-        fb_results = tavily.search(query=fb_query, search_depth="advanced", max_results=5)
-        if fb_results and 'results' in fb_results:
-            filtered_results = filter_tavily_results(fb_results, 'lejebolig')
-            all_results.extend(filtered_results['results'])
-
-        print(f"Found {len(all_results)} results")
-        print(json.dumps(all_results, indent=4))
-        return {'results': all_results}
-    except Exception as e:
-        print(f"Fejl i lejebolig-søgning: {str(e)}")
-        logging.error(f"Fejl i lejebolig-søgning: {str(e)}")
+    queries = RENTAL_QUERIES if queries is None else queries
+    if not queries:
+        return {'results': []}
+    all_results, failed = run_queries(queries, 'lejebolig', criteria=criteria)
+    if failed == len(queries):
+        logger.error("Fejl i lejebolig-søgning: alle forespørgsler fejlede")
         return None
 
-def process_search_results(andelsbolig_results, rental_results):
+    logger.info("Lejebolig-søgning: %d resultater", len(all_results), extra={'fields': {'results': len(all_results)}})
+    dump_payload(logger, "Lejebolig-resultater", all_results)
+    return {'results': all_results}
+
+def _format_dkk(amount):
+    return f"{amount:,}".replace(',', ' ')
+
+@timed('process_search_results')
+def process_search_results(andelsbolig_results, rental_results, criteria=DEFAULT_CRITERIA, pending=None):
     """
-    Use OpenAI to process and structure both search results
+    Structure both search results. Listings the local rule engine confirmed are
+    built directly, only the ambiguous ones are sent to OpenAI.
+    criteria should be the ones the results were filtered with.
+    pending, if given, receives the results nothing was decided about (their
+    batch failed or the output stopped before them) so they can be retried.
     """
-    try:
-        print("Debug: Input to process_search_results:")
-        print(f"andelsbolig_results: {json.dumps(andelsbolig_results, indent=2)}")
-        print(f"rental_results: {json.dumps(rental_results, indent=2)}")
-        
-        prompt = f"""
-            Du er bolig-dataassistent. Svar KUN med gyldig JSON.
-
-            ############################
-            ##  INPUT                  #
-            ############################
-            {{"andelsbolig_raw": {json.dumps(andelsbolig_results)},
-            "rental_raw":      {json.dumps(rental_results)}}}
-
-            ############################
-            ##  KRITERIER              #
-            ############################
-            Fælles:
-            - Størrelse: Forsøg at udtrække fra titel (fx "93m2" eller "93 m²") eller beskrivelse
-            - STRIKT minimum 45 m² (ignorer ALT under 45)
-            - STRIKT maximum 140 m² (ignorer ALT over 140)
-            - Område skal ligge i én af: {AREAS_STRING}
-            - URL skal være direkte link til en specifik bolig (ikke søgesider)
-
-            Andelsboliger:
-            - Max pris 3 000 000 DKK hvis prisen er angivet
-            - Ignorer hvis beskrivelse indeholder: "solgt", "reserveret", "overtaget"
-
-            Lejeboliger:
-            - Max leje 20 000 DKK / md hvis lejen er angivet
-            - Ignorer hvis beskrivelse indeholder: "udlejet", "er desværre udlejet"
-
-            ############################
-            ##  PARSING REGLER         #
-            ############################
-            1. Størrelse: 
-               - Led efter mønstre som "93m2", "93 m²", "93 kvm" i titel og beskrivelse
-               - Hvis størrelse findes i titel (fx "93m2-3-vaer"), brug dette tal
-               - Hvis flere størrelser nævnes, brug den første
-
-            2. Område:
-               - Tjek for områdenavne i både titel og beskrivelse
-               - Brug fuzzy matching (fx "Østerbro" matcher også "Oesterbro" og "København Ø")
-               
-            3. URL validering:
-               - URL må ikke indeholde: "/search", "/soeg", "?soeg=", "/marketplace/search"
-               - URL skal indeholde specifikt ID eller adresse
-               - Ignorer kategori- og søgesider
-
-            ############################
-            ##  OUTPUT FORMAT          #
-            ############################
-            {{
-                "summary": "<kort dansk tekst der matcher antallet af viste boliger>",
-                "andelsboliger": [
-                    {{
-                        "address": "<string>",
-                        "price_dkk": <integer eller null>,
-                        "sqm": <integer eller null>,
-                        "url": "<string>",
-                        "source": "<domain>",
-                        "area": "<Vesterbro|Østerbro|…>",
-                        "key_features": "<kort sætning>",
-                        "missing_fields": ["price_dkk", "sqm"]
-                    }}
-                ],
-                "lejeboliger": [
-                    {{
-                        "address": "<string>",
-                        "rent_dkk": <integer eller null>,
-                        "sqm": <integer eller null>,
-                        "url": "<string>",
-                        "source": "<domain>",
-                        "area": "<Vesterbro|Østerbro|…>",
-                        "key_features": "<kort sætning>",
-                        "missing_fields": ["rent_dkk", "sqm"]
-                    }}
-                ]
-            }}
-
-            ############################
-            ##  REGLER                 #
-            ############################
-            1. Inkluder bolig hvis:
-               - URL er et direkte link til en specifik bolig
-               - Område matcher en af de tilladte områder
-               - Hvis størrelse er kendt: mellem 45-140 m²
-               - Hvis pris er kendt: under maksimum
-            2. Hvis et felt ikke kan udtrækkes, sæt det til null og tilføj i missing_fields
-            3. Fjern dubletter (samme url eller adresse+sqm)
-            4. Summary skal matche det faktiske antal viste boliger
-            """
-        
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[
-                {"role": "system", "content": "Du er en hjælpsom assistent der behandler boligannoncer. Formatér informationen klart og verificér at annoncerne matcher søgekriterierne. Kommuniker på dansk."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        result = response.choices[0].message.content
-        print("Debug: OpenAI response:")
-        print(result)
-        
-        # Clean the response - remove markdown code block if present
-        if result.startswith('```'):
-            result = result.split('```')[1]  # Get content between first and second ```
-            if result.startswith('json'):
-                result = result[4:]  # Remove 'json' prefix
-            result = result.strip()
-        
-        # Validate JSON before returning
+    started = time.perf_counter()
+    first_listing = threading.Event()
+
+    andel_confirmed, andel_ambiguous = split_by_match(andelsbolig_results)
+    rental_confirmed, rental_ambiguous = split_by_match(rental_results)
+    logger.info(
+        "Lokalt bekræftet: %d andelsboliger, %d lejeboliger; til OpenAI: %d andelsboliger, %d lejeboliger",
+        len(andel_confirmed), len(rental_confirmed), len(andel_ambiguous), len(rental_ambiguous)
+    )
+
+    metrics.inc('listings_confirmed_locally', len(andel_confirmed) + len(rental_confirmed))
+    metrics.inc('listings_ambiguous', len(andel_ambiguous) + len(rental_ambiguous))
+
+    andelsboliger = [build_local_record(r, 'andelsbolig', r['extracted']) for r in andel_confirmed]
+    lejeboliger = [build_local_record(r, 'lejebolig', r['extracted']) for r in rental_confirmed]
+
+    if andel_ambiguous or rental_ambiguous:
+        fingerprint = prompt_fingerprint(criteria)
+        andel_misses = _apply_cached_extractions(andel_ambiguous, 'andelsbolig', andelsboliger, fingerprint)
+        rental_misses = _apply_cached_extractions(rental_ambiguous, 'lejebolig', lejeboliger, fingerprint)
+        extraction_cache = get_extraction_cache()
+        if extraction_cache is not None:
+            stats = extraction_cache.stats()
+            logger.info("Udtrækscache: %d hits, %d misses", stats['hits'], stats['misses'])
+
+        misses = {
+            'andelsboliger': ('andelsbolig', {canonical_url(r['url']): r for r in andel_misses if r.get('url')}),
+            'lejeboliger': ('lejebolig', {canonical_url(r['url']): r for r in rental_misses if r.get('url')}),
+        }
+
+        def handle_listing(key, listing):
+            if not first_listing.is_set():
+                first_listing.set()
+                metrics.observe('time_to_first_model_listing', time.perf_counter() - started)
+            # Cached as soon as it is parsed, so a run stopped halfway keeps the answers it got
+            listing_type, by_url = misses[key]
+            result = by_url.get(canonical_url(listing['url'])) if listing.get('url') else None
+            if result is not None and extraction_cache is not None:
+                extraction_cache.put(_extraction_key(result, listing_type, fingerprint), listing)
+
+        if andel_misses or rental_misses:
+            budget = TokenBudget(env_int('LLM_TOKEN_BUDGET', LLM_TOKEN_BUDGET))
+            processed = _process_batches(andel_misses, rental_misses, budget, handle_listing, criteria)
+            budget.log()
+            metrics.inc('llm_prompt_tokens', budget.prompt_tokens)
+            metrics.inc('llm_cached_prompt_tokens', budget.cached_tokens)
+            metrics.inc('llm_completion_tokens', budget.completion_tokens)
+            metrics.inc('llm_input_tokens_before_compaction', budget.raw_input_tokens)
+            metrics.inc('llm_input_tokens_after_compaction', budget.compact_input_tokens)
+            if pending is not None:
+                for andel, rental, model_output in processed:
+                    pending.extend(_unanswered(andel, model_output, 'andelsboliger'))
+                    pending.extend(_unanswered(rental, model_output, 'lejeboliger'))
+            outputs = [output for _, _, output in processed if output is not None]
+            if not outputs and not (andelsboliger or lejeboliger):
+                return None
+            for andel, rental, model_output in processed:
+                if model_output is None:
+                    continue
+                andelsboliger.extend(model_output.get('andelsboliger') or [])
+                lejeboliger.extend(model_output.get('lejeboliger') or [])
+                # A truncated output says nothing about the listings it did not reach
+                if model_output.get('complete', True):
+                    _store_exclusions(andel, 'andelsbolig', model_output.get('andelsboliger'), fingerprint)
+                    _store_exclusions(rental, 'lejebolig', model_output.get('lejeboliger'), fingerprint)
+
+        andelsboliger = _tag_record_areas(andelsboliger, andel_ambiguous, criteria)
+        lejeboliger = _tag_record_areas(lejeboliger, rental_ambiguous, criteria)
+
+    _attach_duplicate_urls(andelsboliger, andel_confirmed + andel_ambiguous)
+    _attach_duplicate_urls(lejeboliger, rental_confirmed + rental_ambiguous)
+
+    andelsboliger = _dedupe_records(andelsboliger)
+    lejeboliger = _dedupe_records(lejeboliger)
+    andelsboliger.sort(key=lambda b: (b.get('price_dkk') is None, b.get('price_dkk') or 0))
+    lejeboliger.sort(key=lambda b: (b.get('rent_dkk') is None, b.get('rent_dkk') or 0))
+    metrics.inc('listings_out', len(andelsboliger), listing_type='andelsbolig')
+    metrics.inc('listings_out', len(lejeboliger), listing_type='lejebolig')
+    return format_results(andelsboliger, lejeboliger)
+
+def format_results(andelsboliger, lejeboliger):
+    """
+    Serialize the output records with a summary of the counts
+    """
+    summary = f"Fandt {len(andelsboliger)} andelsboliger og {len(lejeboliger)} lejeboliger der matcher kriterierne."
+    return json.dumps({
+        "summary": summary,
+        "andelsboliger": andelsboliger,
+        "lejeboliger": lejeboliger,
+    }, ensure_ascii=False)
+
+@lru_cache(maxsize=8)
+def prompt_fingerprint(criteria=DEFAULT_CRITERIA):
+    """
+    Hash of the model, system prompt and static prompt text including the criteria.
+    Any change to them gives a new fingerprint and invalidates cached extractions.
+    """
+    empty = {'results': []}
+    raw = "\n".join([OPENAI_MODEL, SYSTEM_PROMPT, _build_prompt(empty, empty, criteria)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def _extraction_key(result, listing_type, fingerprint):
+    return ExtractionCache.make_key(
+        listing_type, result.get('url'), result.get('title'), result.get('content'), fingerprint
+    )
+
+def _apply_cached_extractions(results, listing_type, records, fingerprint):
+    """
+    Add cached model records for the results to records and return the results that missed
+    """
+    extraction_cache = get_extraction_cache()
+    if extraction_cache is None:
+        return results
+
+    misses = []
+    for result in results:
+        found, record = extraction_cache.get(_extraction_key(result, listing_type, fingerprint))
+        if not found:
+            misses.append(result)
+        elif record is not None:
+            records.append(record)
+    return misses
+
+def _store_exclusions(results, listing_type, records, fingerprint):
+    """
+    Cache None for each result a complete output left out, the model excluded it.
+    The returned records were cached as they were parsed.
+    """
+    extraction_cache = get_extraction_cache()
+    if extraction_cache is None:
+        return
+
+    answered = {canonical_url(r['url']) for r in records or [] if r.get('url')}
+    for result in results:
+        if canonical_url(result.get('url', '')) not in answered:
+            extraction_cache.put(_extraction_key(result, listing_type, fingerprint), None)
+
+def _unanswered(results, model_output, key):
+    """
+    The results a batch output says nothing about: all of them if the batch
+    failed, those without a record if the output was truncated
+    """
+    if model_output is None:
+        return list(results)
+    if model_output.get('complete', True):
+        return []
+    answered = {canonical_url(r['url']) for r in model_output.get(key) or [] if r.get('url')}
+    return [r for r in results if canonical_url(r.get('url', '')) not in answered]
+
+def _tag_record_areas(records, results, criteria=DEFAULT_CRITERIA):
+    """
+    Set the area of model records to the gazetteer's tag of their listing,
+    or the area the model's own value names, so areas are canonical.
+    Returns the records in one of the criteria's areas; an area that is
+    missing, unknown or outside them does not pass.
+    """
+    tagged = {
+        canonical_url(r['url']): r['extracted']['area']
+        for r in results if r.get('url') and (r.get('extracted') or {}).get('area')
+    }
+    kept = []
+    for record in records:
+        area = tagged.get(canonical_url(record['url'])) if record.get('url') else None
+        record['area'] = area or normalize_area(record.get('area'))
+        if record['area'] in criteria.areas:
+            kept.append(record)
+    if len(kept) < len(records):
+        metrics.inc('records_outside_areas', len(records) - len(kept))
+        logger.info("%d boliger uden et tilladt område blev fravalgt", len(records) - len(kept))
+    return kept
+
+def _attach_duplicate_urls(records, results):
+    """
+    Copy the URLs of the other postings of each listing (found by the
+    near-duplicate collapse) to its record, so the report can link them
+    """
+    duplicates = {
+        canonical_url(r['url']): r['duplicate_urls']
+        for r in results if r.get('url') and r.get('duplicate_urls')
+    }
+    if not duplicates:
+        return
+    for record in records:
+        urls = duplicates.get(canonical_url(record['url'])) if record.get('url') else None
+        if urls:
+            record['duplicate_urls'] = list(urls)
+
+def _dedupe_records(records):
+    """
+    Remove duplicate records by canonical url or street address+sqm, keeping the first.
+    An address without a street name and house number is no key.
+    """
+    seen = set()
+    unique = []
+    for record in records:
+        keys = []
+        if record.get('url'):
+            keys.append(canonical_url(record['url']))
+        address = find_address(record.get('address'))
+        if address and record.get('sqm'):
+            keys.append((address.lower(), record['sqm']))
+        if any(key in seen for key in keys):
+            continue
+        seen.update(keys)
+        unique.append(record)
+    return unique
+
+def _make_batches(andel_results, rental_results, batch_size):
+    """
+    Split both result lists into batches of at most batch_size listings in total
+    """
+    tagged = [('andelsbolig', r) for r in andel_results] + [('lejebolig', r) for r in rental_results]
+    batches = []
+    for start in range(0, len(tagged), batch_size):
+        chunk = tagged[start:start + batch_size]
+        batches.append((
+            [r for listing_type, r in chunk if listing_type == 'andelsbolig'],
+            [r for listing_type, r in chunk if listing_type == 'lejebolig'],
+        ))
+    return batches
+
+def _process_batch(index, andel_results, rental_results, budget, on_listing=None, criteria=DEFAULT_CRITERIA):
+    """
+    Process one batch with OpenAI, retrying it on its own if it fails
+    """
+    andel_compact = compact_results({'results': andel_results}, 'andelsbolig')
+    rental_compact = compact_results({'results': rental_results}, 'lejebolig')
+    budget.record_compaction(andel_results + rental_results, andel_compact['results'] + rental_compact['results'])
+
+    retries = env_int('LLM_BATCH_RETRIES', LLM_BATCH_RETRIES)
+    for attempt in range(retries + 1):
+        if attempt:
+            metrics.inc('retries', provider='openai')
         try:
-            json.loads(result)  # Test if it's valid JSON
-            return result
-        except json.JSONDecodeError as je:
-            print(f"Debug: Invalid JSON returned from OpenAI: {je}")
+            result = _process_with_openai(andel_compact, rental_compact, budget, on_listing, criteria)
+        except BudgetExceeded:
+            # A retry would not fit either; the listings wait for the next run's budget
+            metrics.inc('listings_deferred', len(andel_results) + len(rental_results), reason='token_budget')
             return None
-            
+        if result is not None:
+            return result
+        logger.warning("Batch %d fejlede (forsøg %d)", index, attempt + 1)
+    metrics.inc('llm_batches_dropped')
+    metrics.inc('listings_deferred', len(andel_results) + len(rental_results), reason='batch_failed')
+    logger.error("Batch %d droppet efter %d forsøg", index, retries + 1)
+    return None
+
+def _process_batches(andel_results, rental_results, budget, on_listing=None, criteria=DEFAULT_CRITERIA):
+    """
+    Process the listings in parallel batches.
+    Returns (andel_results, rental_results, output) per batch in batch order,
+    output is None for a batch that failed.
+    """
+    batches = _make_batches(andel_results, rental_results, max(1, env_int('LLM_BATCH_SIZE', LLM_BATCH_SIZE)))
+    outputs = [None] * len(batches)
+
+    with ThreadPoolExecutor(max_workers=max(1, env_int('LLM_CONCURRENCY', LLM_CONCURRENCY))) as executor:
+        futures = {
+            executor.submit(_process_batch, index, andel, rental, budget, on_listing, criteria): index
+            for index, (andel, rental) in enumerate(batches)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                outputs[index] = future.result()
+            except SnapshotMiss:
+                raise
+            except Exception as e:
+                logger.error("Fejl i batch %d: %s", index, e)
+
+    return [(andel, rental, output) for (andel, rental), output in zip(batches, outputs)]
+
+@lru_cache(maxsize=8)
+def prompt_instructions(criteria=DEFAULT_CRITERIA):
+    """
+    Static part of the prompt for a set of criteria. It is rendered once and sent
+    as a byte-identical prefix on every call so the provider can cache it; only
+    the listings vary.
+    """
+    areas = ", ".join(criteria.areas)
+    rooms = ""
+    if criteria.rooms:
+        rooms = f"\n        - Antal værelser skal være en af: {', '.join(str(r) for r in criteria.rooms)} hvis det er angivet"
+    return f"""
+        Du er bolig-dataassistent. Svar KUN med gyldig JSON.
+
+        ############################
+        ##  KRITERIER              #
+        ############################
+        Fælles:
+        - Størrelse: Forsøg at udtrække fra titel (fx "93m2" eller "93 m²") eller beskrivelse
+        - STRIKT minimum {criteria.min_sqm} m² (ignorer ALT under {criteria.min_sqm})
+        - STRIKT maximum {criteria.max_sqm} m² (ignorer ALT over {criteria.max_sqm})
+        - Område skal ligge i én af: {areas}{rooms}
+        - URL skal være direkte link til en specifik bolig (ikke søgesider)
+
+        Andelsboliger:
+        - Max pris {_format_dkk(criteria.max_price)} DKK hvis prisen er angivet
+        - Ignorer hvis beskrivelse indeholder: "solgt", "reserveret", "overtaget"
+
+        Lejeboliger:
+        - Max leje {_format_dkk(criteria.max_rent)} DKK / md hvis lejen er angivet
+        - Ignorer hvis beskrivelse indeholder: "udlejet", "er desværre udlejet"
+
+        ############################
+        ##  PARSING REGLER         #
+        ############################
+        1. Størrelse: 
+           - Led efter mønstre som "93m2", "93 m²", "93 kvm" i titel og beskrivelse
+           - Hvis størrelse findes i titel (fx "93m2-3-vaer"), brug dette tal
+           - Hvis flere størrelser nævnes, brug den første
+
+        2. Område:
+           - Hvis input har feltet "area", brug det uændret
+           - Ellers find området ud fra postnummer eller bydel i titel og beskrivelse, ikke ud fra
+             områder boligen blot ligger tæt på (fx "10 min til Christianshavn")
+           - Ignorer boligen hvis området ikke kan afgøres eller ligger uden for de tilladte
+           
+        3. URL validering:
+           - URL må ikke indeholde: "/search", "/soeg", "?soeg=", "/marketplace/search"
+           - URL skal indeholde specifikt ID eller adresse
+           - Ignorer kategori- og søgesider
+
+        ############################
+        ##  OUTPUT FORMAT          #
+        ############################
+        {{
+            "summary": "<kort dansk tekst der matcher antallet af viste boliger>",
+            "andelsboliger": [
+                {{
+                    "address": "<string>",
+                    "price_dkk": <integer eller null>,
+                    "sqm": <integer eller null>,
+                    "rooms": <integer eller null>,
+                    "url": "<string>",
+                    "source": "<domain>",
+                    "area": "<Vesterbro|Østerbro|…>",
+                    "key_features": "<kort sætning>",
+                    "missing_fields": ["price_dkk", "sqm"]
+                }}
+            ],
+            "lejeboliger": [
+                {{
+                    "address": "<string>",
+                    "rent_dkk": <integer eller null>,
+                    "sqm": <integer eller null>,
+                    "rooms": <integer eller null>,
+                    "url": "<string>",
+                    "source": "<domain>",
+                    "area": "<Vesterbro|Østerbro|…>",
+                    "key_features": "<kort sætning>",
+                    "missing_fields": ["rent_dkk", "sqm"]
+                }}
+            ]
+        }}
+
+        ############################
+        ##  REGLER                 #
+        ############################
+        1. Inkluder bolig hvis:
+           - URL er et direkte link til en specifik bolig
+           - Område matcher en af de tilladte områder
+           - Hvis størrelse er kendt: mellem {criteria.min_sqm}-{criteria.max_sqm} m²
+           - Hvis pris er kendt: under maksimum
+        2. Hvis et felt ikke kan udtrækkes, sæt det til null og tilføj i missing_fields
+        3. Fjern dubletter (samme url eller adresse+sqm)
+        4. Summary skal matche det faktiske antal viste boliger
+        """
+
+def _build_prompt(andelsbolig_results, rental_results, criteria=DEFAULT_CRITERIA):
+    """
+    Build the extraction prompt for OpenAI, static instructions first and listings last
+    """
+    listings = json.dumps(
+        {"andelsbolig_raw": andelsbolig_results, "rental_raw": rental_results},
+        ensure_ascii=False,
+        separators=(',', ':'),
+    )
+    return f"""{prompt_instructions(criteria)}
+        ############################
+        ##  INPUT                  #
+        ############################
+        {listings}
+        """
+
+def _process_with_openai(andelsbolig_results, rental_results, budget=None, on_listing=None,
+                         criteria=DEFAULT_CRITERIA):
+    """
+    Use OpenAI to process and structure both search results.
+    The completion is streamed and parsed incrementally: every listing is validated
+    and passed to on_listing(key, listing) as soon as its object closes.
+    Returns {'andelsboliger': [...], 'lejeboliger': [...], 'complete': bool}, or None
+    if the call failed before any listing arrived. Raises BudgetExceeded without
+    calling the model if the prompt does not fit in the budget.
+    """
+    dump_payload(logger, "OpenAI-input andelsboliger", andelsbolig_results)
+    dump_payload(logger, "OpenAI-input lejeboliger", rental_results)
+
+    prompt = _build_prompt(andelsbolig_results, rental_results, criteria)
+    prompt_tokens = count_tokens(SYSTEM_PROMPT) + count_tokens(prompt)
+    if budget is not None and not budget.reserve(prompt_tokens):
+        logger.warning("Springer OpenAI-kald over: %d tokens overskrider budgettet", prompt_tokens)
+        raise BudgetExceeded(prompt_tokens)
+
+    parser = ListingStreamParser(on_item=on_listing)
+    try:
+        with metrics.timer('openai_chat_completion'):
+            stream = get_guard('openai').call(
+                get_openai_client().chat.completions.create,
+                model=OPENAI_MODEL,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            for chunk in stream:
+                usage = getattr(chunk, 'usage', None)
+                if usage is not None and budget is not None:
+                    budget.record_usage(usage)
+                if chunk.choices:
+                    parser.feed(chunk.choices[0].delta.content)
+        metrics.inc('api_calls', provider='openai')
+    except SnapshotMiss:
+        # A replay that asks for an unrecorded request has diverged, retrying cannot fix it
+        raise
     except Exception as e:
-        print(f"Fejl i OpenAI behandling: {str(e)}")
-        logging.error(f"Fejl i OpenAI behandling: {str(e)}")
-        return None
+        metrics.inc('api_errors', provider='openai')
+        logger.error("Fejl i OpenAI behandling: %s", e)
+
+    dump_payload(logger, "OpenAI-svar", parser.text)
 
-def send_email_report(results, recipient_email):
+    parsed = sum(len(items) for items in parser.items.values())
+    if parser.errors:
+        metrics.inc('llm_invalid_listings', parser.errors)
+        logger.warning("%d ugyldige boliger i OpenAI-svaret blev sprunget over", parser.errors)
+    if not parser.complete:
+        metrics.inc('llm_truncated_outputs')
+        logger.warning("OpenAI-svaret var ufuldstændigt, beholder %d boliger", parsed)
+        if not parsed:
+            return None
+
+    return dict(parser.items, complete=parser.complete)
+
+@timed('send_email_report')
+def send_email_report(results, recipient_email, rendered=None, message_bytes=None, name=None):
     """
-    Send search results via email using Gmail API
+    Send search results via email using Gmail API.
+    rendered and message_bytes can be passed in to reuse a report rendered once per run.
     """
     try:
-        print(f"Attempting to send email to: {recipient_email}")
-        print(f"Using email address: {os.getenv('EMAIL_ADDRESS')}")
-        
-        if not os.getenv('EMAIL_ADDRESS'):
+        logger.debug("Sender email til %s fra %s", recipient_email, env_str('EMAIL_ADDRESS'))
+
+        if not env_str('EMAIL_ADDRESS'):
             raise ValueError("Email address not found in .env file")
             
         if not recipient_email:
             raise ValueError("Recipient email not provided")
 
-        # Parse the results as JSON to ensure proper formatting
-        results_json = json.loads(results) if isinstance(results, str) else results
-        
-        # Format the results in a more readable way
-        formatted_results = []
-        
-        # Add summary
-        if 'summary' in results_json:
-            formatted_results.append("<h3>Oversigt</h3>")
-            formatted_results.append(f"<p>{results_json['summary']}</p>")
-        
-        # Format andelsboliger
-        if 'andelsboliger' in results_json:
-            formatted_results.append("<h3>Andelsboliger</h3>")
-            for bolig in results_json['andelsboliger']:
-                formatted_results.append('<div class="listing">')
-                formatted_results.append(f"<p><strong>Adresse:</strong> {bolig.get('address', 'Ikke angivet')}</p>")
-                formatted_results.append(f"<p><strong>Pris:</strong> {bolig.get('price_dkk', 'Ikke angivet'):,} DKK</p>".replace(',', '.') if bolig.get('price_dkk') else "<p><strong>Pris:</strong> Ikke angivet</p>")
-                formatted_results.append(f"<p><strong>Størrelse:</strong> {bolig.get('sqm', 'Ikke angivet')} m²</p>")
-                formatted_results.append(f"<p><strong>Område:</strong> {bolig.get('area', 'Ikke angivet')}</p>")
-                formatted_results.append(f"<p><strong>Beskrivelse:</strong> {bolig.get('key_features', 'Ingen beskrivelse')}</p>")
-                formatted_results.append(f"<p><strong>Link:</strong> <a href='{bolig.get('url', '#')}'>{bolig.get('source', 'Link')}</a></p>")
-                formatted_results.append("</div>")
-        
-        # Format lejeboliger
-        if 'lejeboliger' in results_json:
-            formatted_results.append("<h3>Lejeboliger</h3>")
-            for bolig in results_json['lejeboliger']:
-                formatted_results.append('<div class="listing">')
-                formatted_results.append(f"<p><strong>Adresse:</strong> {bolig.get('address', 'Ikke angivet')}</p>")
-                formatted_results.append(f"<p><strong>Månedlig leje:</strong> {bolig.get('rent_dkk', 'Ikke angivet'):,} DKK</p>".replace(',', '.') if bolig.get('rent_dkk') else "<p><strong>Månedlig leje:</strong> Ikke angivet</p>")
-                formatted_results.append(f"<p><strong>Størrelse:</strong> {bolig.get('sqm', 'Ikke angivet')} m²</p>")
-                formatted_results.append(f"<p><strong>Område:</strong> {bolig.get('area', 'Ikke angivet')}</p>")
-                formatted_results.append(f"<p><strong>Beskrivelse:</strong> {bolig.get('key_features', 'Ingen beskrivelse')}</p>")
-                formatted_results.append(f"<p><strong>Link:</strong> <a href='{bolig.get('url', '#')}'>{bolig.get('source', 'Link')}</a></p>")
-                formatted_results.append("</div>")
-
-        # Format email subject
-        subject = f"Boligsøgning Resultater - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-        
-        # Create HTML email with proper CSS
-        css = """
-            body { font-family: Arial, sans-serif; line-height: 1.6; margin: 0; padding: 20px; }
-            h2, h3 { color: #2c3e50; margin-top: 20px; }
-            .container { max-width: 800px; margin: 0 auto; padding: 20px; }
-            .listing { margin-bottom: 20px; padding: 15px; border: 1px solid #ddd; border-radius: 5px; background-color: #fff; }
-            a { color: #3498db; text-decoration: none; }
-            a:hover { text-decoration: underline; }
-            p { margin: 8px 0; }
-            .footer { margin-top: 30px; color: #7f8c8d; border-top: 1px solid #eee; padding-top: 20px; }
-        """
-        
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <style>{css}</style>
-        </head>
-        <body>
-            <div class="container">
-                <h2>Boligsøgning Resultater (Under udvikling - Cest la vie)</h2>
-                {''.join(formatted_results)}
-                <div class="footer">
-                    <p>Med Venlig Hilsen,<br>Mikkel</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        print("Sending email...")
-        gmail_sender.send_email(recipient_email, subject, html_content)
-        
-        print(f"Email sent successfully to {recipient_email}")
-        logging.info(f"Email sent successfully to {recipient_email}")
+        if message_bytes is None:
+            rendered = rendered or render_email_report(results)
+            message_bytes = get_gmail_sender().prepare_message(rendered['subject'], rendered['html'])
+
+        try:
+            with metrics.timer('gmail_send'):
+                get_guard('gmail').call(get_gmail_sender().send_prepared, recipient_email, message_bytes, name=name)
+        except Exception:
+            metrics.inc('api_errors', provider='gmail')
+            raise
+        metrics.inc('api_calls', provider='gmail')
+        metrics.inc('email_bytes_sent', len(message_bytes))
+
+        logger.info("Email sent successfully to %s", recipient_email)
     except ValueError as ve:
-        error_msg = f"Configuration error: {str(ve)}"
-        print(error_msg)
-        logging.error(error_msg)
+        logger.error("Configuration error: %s", ve)
         raise
     except Exception as e:
-        error_msg = f"Error sending email: {str(e)}"
-        print(error_msg)
-        logging.error(error_msg)
-        raise
\ No newline at end of file
+        logger.error("Error sending email: %s", e)
+        raise
+
+def _send_to_recipient(message_bytes, recipient):
+    """
+    Send the report to one recipient and return the delivery status
+    """
+    email = recipient.get('email')
+    name = recipient.get('name', 'Unknown')
+    if not email:
+        logger.warning("Manglende email for modtager: %s", name)
+        return {'name': name, 'email': email, 'ok': False, 'error': 'Manglende email'}
+
+    try:
+        logger.info("Sender email til %s (%s)", name, email)
+        send_email_report(None, email, message_bytes=message_bytes, name=recipient.get('name'))
+        return {'name': name, 'email': email, 'ok': True, 'error': None}
+    except Exception as e:
+        logger.error("Fejl ved afsendelse af email til %s: %s", email, e)
+        return {'name': name, 'email': email, 'ok': False, 'error': str(e)}
+
+def send_email_reports(results, recipients, max_workers=None):
+    """
+    Send the report to all recipients through a bounded, rate limited worker pool.
+    Returns one status dict per recipient in the order of recipients.
+    """
+    # Render and serialize the report once, workers only add the To header
+    with metrics.timer('render_email_report'):
+        rendered = render_email_report(results)
+        message_bytes = get_gmail_sender().prepare_message(rendered['subject'], rendered['html'])
+
+    max_workers = max(1, max_workers or env_int('EMAIL_CONCURRENCY', EMAIL_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        statuses = list(executor.map(lambda recipient: _send_to_recipient(message_bytes, recipient), recipients))
+
+    sent = sum(1 for status in statuses if status['ok'])
+    metrics.inc('emails_sent', sent)
+    metrics.inc('emails_failed', len(statuses) - sent)
+    logger.info("Email sendt til %d/%d modtagere", sent, len(statuses))
+    return statuses
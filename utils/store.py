@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from .cache import CACHE_DIR
+from .filter import canonical_url
+from .neardup import NearDuplicateIndex, fingerprint_result
+
+# Listings seen within this many seconds are checked for near-duplicates
+DUPLICATE_WINDOW = 30 * 24 * 3600
+
+class ListingStore:
+    """
+    SQLite-backed store of listings seen in earlier runs, keyed by canonical URL
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, 'listings.sqlite')
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS listings (
+                url TEXT PRIMARY KEY,
+                listing_type TEXT,
+                content_hash TEXT NOT NULL,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL
+            )
+            """
+        )
+        # MinHash signature and blocking fields per listing, for near-duplicate detection
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                url TEXT PRIMARY KEY,
+                listing_type TEXT,
+                signature BLOB NOT NULL,
+                fields TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def content_hash(result):
+        """Hashes the parts of a Tavily result that describe the listing."""
+        raw = f"{result.get('title', '')}\n{result.get('content', '')}"
+        return hashlib.sha256(raw.strip().encode('utf-8')).hexdigest()
+
+    def diff(self, results):
+        """
+        Returns the Tavily results that are new or whose content changed since
+        they were last recorded. Nothing is written, call mark_seen afterwards.
+        """
+        if not results or 'results' not in results:
+            return results
+
+        fresh = []
+        with self._lock:
+            for result in results['results']:
+                url = result.get('url')
+                if not url:
+                    continue
+                row = self._conn.execute(
+                    "SELECT content_hash FROM listings WHERE url = ?", (canonical_url(url),)
+                ).fetchone()
+                if row is None or row[0] != self.content_hash(result):
+                    fresh.append(result)
+        return {'results': fresh}
+
+    def mark_seen(self, results, listing_type):
+        """Records the results as seen, updating last_seen and the content hash."""
+        if not results or 'results' not in results:
+            return
+
+        now = time.time()
+        fingerprints = [fingerprint_result(r, listing_type) for r in results['results'] if r.get('url')]
+        with self._lock:
+            for result in results['results']:
+                url = result.get('url')
+                if not url:
+                    continue
+                self._conn.execute(
+                    """
+                    INSERT INTO listings (url, listing_type, content_hash, first_seen, last_seen)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(url) DO UPDATE SET
+                        content_hash = excluded.content_hash,
+                        last_seen = excluded.last_seen
+                    """,
+                    (canonical_url(url), listing_type, self.content_hash(result), now, now)
+                )
+            for fingerprint in fingerprints:
+                signature, fields = fingerprint.to_row()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO fingerprints (url, listing_type, signature, fields) VALUES (?, ?, ?, ?)",
+                    (fingerprint.key, listing_type, signature, json.dumps(fields, ensure_ascii=False))
+                )
+            self._conn.commit()
+
+    def seen_index(self, listing_type, window=DUPLICATE_WINDOW):
+        """NearDuplicateIndex of the listings of listing_type seen within window seconds."""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT f.url, f.signature, f.fields FROM fingerprints f
+                JOIN listings l ON l.url = f.url
+                WHERE f.listing_type = ? AND l.last_seen >= ?
+                """,
+                (listing_type, time.time() - window)
+            ).fetchall()
+        return NearDuplicateIndex.from_rows((url, signature, json.loads(fields)) for url, signature, fields in rows)
+
+    def touch(self, results):
+        """Updates last_seen for results that are already stored."""
+        if not results or 'results' not in results:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE listings SET last_seen = ? WHERE url = ?",
+                [(now, canonical_url(r['url'])) for r in results['results'] if r.get('url')]
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
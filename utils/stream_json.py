@@ -0,0 +1,131 @@
+import json
+
+# Arrays in the model output whose objects are emitted as soon as they close
+LISTING_KEYS = ('andelsboliger', 'lejeboliger')
+
+class ListingStreamParser:
+    """
+    Incremental parser for the model's JSON output.
+
+    Text is fed in chunks as it streams in. Every object inside one of the
+    LISTING_KEYS arrays of the top-level object is decoded and passed to
+    on_item(key, item) the moment its closing brace arrives, so well-formed
+    entries survive even when the tail of the output is cut off or broken.
+    Text before the first '{' (such as a ```json fence) is ignored.
+    """
+
+    def __init__(self, on_item=None, keys=LISTING_KEYS):
+        self.on_item = on_item
+        self.keys = set(keys)
+        self.items = {key: [] for key in keys}
+        self.errors = 0
+        self._text = ''
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._pending_key = None
+        self._item_start = None
+        self._done = False
+
+    @property
+    def text(self):
+        """All text fed so far."""
+        return self._text
+
+    @property
+    def complete(self):
+        """True once the top-level object has been closed."""
+        return self._done
+
+    def feed(self, chunk):
+        if not chunk or self._done:
+            return
+        self._text += chunk
+        text = self._text
+        for i in range(self._pos, len(text)):
+            char = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._stack and self._stack[-1][0] == 'obj':
+                        self._last_string = text[self._string_start:i + 1]
+                continue
+
+            if not self._stack and char != '{':
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char == ':':
+                if self._stack and self._stack[-1][0] == 'obj' and self._last_string is not None:
+                    try:
+                        self._pending_key = json.loads(self._last_string)
+                    except ValueError:
+                        self._pending_key = None
+                    self._last_string = None
+            elif char == '{':
+                if self._is_listing_array():
+                    self._item_start = i
+                self._stack.append(('obj', None))
+                self._last_string = None
+            elif char == '[':
+                key = self._pending_key if len(self._stack) == 1 else None
+                self._stack.append(('arr', key))
+                self._pending_key = None
+            elif char == '}':
+                if self._stack:
+                    self._stack.pop()
+                if self._item_start is not None and self._is_listing_array():
+                    self._emit(self._stack[-1][1], text[self._item_start:i + 1])
+                    self._item_start = None
+                if not self._stack:
+                    self._done = True
+                    self._pos = i + 1
+                    return
+            elif char == ']':
+                if self._stack:
+                    self._stack.pop()
+            elif char == ',':
+                self._last_string = None
+        self._pos = len(text)
+
+    def _is_listing_array(self):
+        return (
+            len(self._stack) == 2
+            and self._stack[-1][0] == 'arr'
+            and self._stack[-1][1] in self.keys
+        )
+
+    def _emit(self, key, raw):
+        try:
+            item = json.loads(raw)
+        except ValueError:
+            self.errors += 1
+            return
+        if not valid_listing(item, key):
+            self.errors += 1
+            return
+        self.items[key].append(item)
+        if self.on_item is not None:
+            self.on_item(key, item)
+
+def _is_int_or_none(value):
+    return value is None or (isinstance(value, int) and not isinstance(value, bool))
+
+def valid_listing(item, key):
+    """
+    Check that an output entry has a url and integer-or-null numeric fields
+    """
+    if not isinstance(item, dict) or not isinstance(item.get('url'), str) or not item['url']:
+        return False
+    price_field = 'price_dkk' if key == 'andelsboliger' else 'rent_dkk'
+    return _is_int_or_none(item.get(price_field)) and _is_int_or_none(item.get('sqm'))
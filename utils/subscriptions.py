@@ -0,0 +1,132 @@
+from bisect import bisect_left, bisect_right
+from .filter import record_fields
+from .gazetteer import AREAS
+
+class _Subscription:
+    __slots__ = ('key', 'criteria', 'listing_types')
+
+    def __init__(self, key, criteria, listing_types):
+        self.key = key
+        self.criteria = criteria
+        self.listing_types = tuple(listing_types)
+
+# Set bit positions of every byte value
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+def _bits(mask):
+    """Positions of the set bits of mask, lowest first."""
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+    return [offset * 8 + bit for offset, value in enumerate(data) if value for bit in _BYTE_BITS[value]]
+
+def _group(bounds):
+    """Merges the masks of equal bound values, sorted by value."""
+    grouped = {}
+    for value, mask in bounds:
+        grouped[value] = grouped.get(value, 0) | mask
+    return sorted(grouped.items())
+
+class _UpperBounds:
+    """
+    Sorted upper bounds with the suffix OR of their masks: lookup(value)
+    returns the mask of every subscription whose bound is >= value
+    """
+
+    def __init__(self, bounds):
+        bounds = _group(bounds)
+        self.values = [value for value, _ in bounds]
+        self.masks = [0] * (len(bounds) + 1)
+        for i in range(len(bounds) - 1, -1, -1):
+            self.masks[i] = self.masks[i + 1] | bounds[i][1]
+
+    def lookup(self, value):
+        return self.masks[bisect_left(self.values, value)]
+
+class _LowerBounds:
+    """
+    Sorted lower bounds with the prefix OR of their masks: lookup(value)
+    returns the mask of every subscription whose bound is <= value
+    """
+
+    def __init__(self, bounds):
+        bounds = _group(bounds)
+        self.values = [value for value, _ in bounds]
+        self.masks = [0] * (len(bounds) + 1)
+        for i, (_, mask) in enumerate(bounds):
+            self.masks[i + 1] = self.masks[i] | mask
+
+    def lookup(self, value):
+        return self.masks[bisect_right(self.values, value)]
+
+class SubscriptionIndex:
+    """
+    Finds the subscriptions (profiles, saved searches) a listing matches without
+    checking every subscription. Each subscription is a bit; areas, room counts
+    and listing types have inverted postings (bitmasks), the sqm range and price
+    caps are sorted bounds with cumulative masks. A lookup is a handful of
+    bisects and ANDs of integers, and matches what Criteria.matches would say.
+    """
+
+    def __init__(self):
+        self._subscriptions = []
+        self._built = False
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def add(self, key, criteria, listing_types=('andelsbolig', 'lejebolig')):
+        self._subscriptions.append(_Subscription(key, criteria, listing_types))
+        self._built = False
+
+    def _build(self):
+        self._by_type = {}
+        self._by_area = {area: 0 for area in AREAS}
+        self._by_rooms = {}
+        # Subscriptions that accept any room count
+        self._any_rooms = 0
+        min_sqm, max_sqm, max_price, max_rent = [], [], [], []
+
+        for position, subscription in enumerate(self._subscriptions):
+            bit = 1 << position
+            criteria = subscription.criteria
+            for listing_type in subscription.listing_types:
+                self._by_type[listing_type] = self._by_type.get(listing_type, 0) | bit
+            for area in criteria.areas:
+                self._by_area[area] |= bit
+            if criteria.rooms:
+                for rooms in criteria.rooms:
+                    self._by_rooms[rooms] = self._by_rooms.get(rooms, 0) | bit
+            else:
+                self._any_rooms |= bit
+            min_sqm.append((criteria.min_sqm, bit))
+            max_sqm.append((criteria.max_sqm, bit))
+            max_price.append((criteria.max_price, bit))
+            max_rent.append((criteria.max_rent, bit))
+
+        self._min_sqm = _LowerBounds(min_sqm)
+        self._max_sqm = _UpperBounds(max_sqm)
+        self._price_caps = {'andelsbolig': _UpperBounds(max_price), 'lejebolig': _UpperBounds(max_rent)}
+        self._built = True
+
+    def match_mask(self, sqm, price, area, rooms, listing_type):
+        """Bitmask of the subscriptions matching the fields, None always passes."""
+        if not self._built:
+            self._build()
+        mask = self._by_type.get(listing_type, 0)
+        if mask and area is not None:
+            mask &= self._by_area.get(area, 0)
+        if mask and rooms is not None:
+            mask &= self._by_rooms.get(rooms, 0) | self._any_rooms
+        if mask and sqm is not None:
+            mask &= self._min_sqm.lookup(sqm) & self._max_sqm.lookup(sqm)
+        if mask and price is not None:
+            mask &= self._price_caps[listing_type].lookup(price)
+        return mask
+
+    def match(self, sqm, price, area, rooms, listing_type):
+        """Keys of the matching subscriptions in the order they were added."""
+        mask = self.match_mask(sqm, price, area, rooms, listing_type)
+        return [self._subscriptions[position].key for position in _bits(mask)]
+
+    def match_record(self, record, listing_type):
+        """Keys of the subscriptions matching an output record."""
+        return self.match(*record_fields(record, listing_type), listing_type)